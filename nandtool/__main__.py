@@ -1,10 +1,11 @@
 import logging
 import sys
+import time
 from argparse import ArgumentParser
 from pathlib import Path
 
-from nandtool.config import get_configs
-from nandtool.mount import mount
+# heavy modules (numpy, bchlib, fusepy) are only imported by the subcommands that need them
+from nandtool.config import LAYOUT_STYLES, UNCORRECTABLE_POLICIES, get_configs
 from nandtool.logger import setup_logging
 
 LOGGER = logging.getLogger("nandtool")
@@ -15,15 +16,82 @@ if __name__ == "__main__":
     parser = ArgumentParser(description="The parent parser", add_help=False)
 
     main_parser = ArgumentParser(prog="mode")
-    subparsers = main_parser.add_subparsers(title="mount or list", required=True, dest="type")
+    subparsers = main_parser.add_subparsers(title="mount, extract, batch, detect, generate, benchmark, list or cache", required=True, dest="type")
 
     parser_mount = subparsers.add_parser("mount", parents=[parser], help="mount (ecc corrected) partitions of the image")
-    parser_mount.add_argument("image", type=Path, help="path to image")
+    parser_mount.add_argument("image", type=Path, nargs="+", help="path to image, or paths of image files that form the image (e.g. one per die)")
+    parser_mount.add_argument("--interleave", choices=["block", "page"], help="interleave the image files by block or page instead of concatenating them")
+    parser_mount.add_argument("--reread", action="append", nargs="+", type=Path, default=[], help="another dump of the same chip to recover uncorrectable chunks from, repeat for every dump")
+    parser_mount.add_argument("--uncorrectable_policy", choices=UNCORRECTABLE_POLICIES, help="reading an uncorrectable page fails, returns zeros or returns the data as read (default: policy of the layout)")
     parser_mount.add_argument("-m", "--mount_point", type=Path, help="path to mount point", required=True)
     parser_mount.add_argument("-c", "--config", help="path or key of configuration file", required=True)
+    parser_mount.add_argument("--lazy", action="store_true", help="correct pages on demand instead of before mounting")
+    parser_mount.add_argument("--cache_size", type=int, default=256, help="size of the corrected page cache in MiB (lazy mode, and page files of partitions loaded from the correction cache)")
+    parser_mount.add_argument("-j", "--jobs", type=int, default=1, help="number of processes used for ecc correction")
+    parser_mount.add_argument("--threads", action="store_true", help="serve concurrent reads from multiple threads")
+    parser_mount.add_argument("--readahead", type=int, default=64, help="number of pages to correct ahead on sequential reads (lazy mode)")
+    parser_mount.add_argument("--stats", action="store_true", help="collect counters and timers, served in the virtual file /.stats")
+    parser_mount.add_argument("--scratch_dir", type=Path, help="keep corrected partitions in files in this directory instead of in memory")
+    parser_mount.add_argument("--disk_cache", action="store_true", help="load and store corrected partitions in the cache directory")
+    parser_mount.add_argument("--cache_max_size", type=float, default=64, help="maximum total size of the cache directory in GiB")
+    parser_mount.add_argument("--cache_max_age", type=float, default=30, help="remove cache entries not used for this many days")
+
+    parser_extract = subparsers.add_parser("extract", parents=[parser], help="write (ecc corrected) partitions of the image to files")
+    parser_extract.add_argument("image", type=Path, nargs="+", help="path to image, or paths of image files that form the image (e.g. one per die)")
+    parser_extract.add_argument("--interleave", choices=["block", "page"], help="interleave the image files by block or page instead of concatenating them")
+    parser_extract.add_argument("--reread", action="append", nargs="+", type=Path, default=[], help="another dump of the same chip to recover uncorrectable chunks from, repeat for every dump")
+    parser_extract.add_argument("--uncorrectable_policy", choices=UNCORRECTABLE_POLICIES, help="reading an uncorrectable page fails, returns zeros or returns the data as read (default: policy of the layout)")
+    parser_extract.add_argument("-o", "--output_dir", type=Path, help="path to output directory", required=True)
+    parser_extract.add_argument("-c", "--config", help="path or key of configuration file", required=True)
+    parser_extract.add_argument("-p", "--partitions", nargs="+", help="names of the partitions to extract (default: all)")
+    parser_extract.add_argument("-j", "--jobs", type=int, default=1, help="number of processes used for ecc correction")
+    parser_extract.add_argument("--sparse", action="store_true", help="leave holes for erased pages, which read as 0x00 instead of 0xff, and list them in <partition>.erased.json")
+
+    parser_batch = subparsers.add_parser("batch", parents=[parser], help="extract the partitions of many images listed in a manifest")
+    parser_batch.add_argument("manifest", type=Path, help="path to the manifest, a TOML file with a [[job]] table per image")
+    parser_batch.add_argument("-j", "--jobs", type=int, default=1, help="number of jobs run at once")
+    parser_batch.add_argument("--checkpoint_blocks", type=int, default=256, help="number of blocks corrected between two checkpoints")
+
+    parser_benchmark = subparsers.add_parser("benchmark", parents=[parser], help="measure correction speed on synthetic images")
+    parser_benchmark.add_argument("-s", "--styles", nargs="+", default=list(LAYOUT_STYLES), choices=list(LAYOUT_STYLES), help="layout styles to benchmark")
+    parser_benchmark.add_argument("--flips", nargs="+", type=int, default=[0, 2], help="numbers of bits flipped per chunk")
+    parser_benchmark.add_argument("--erased", nargs="+", type=float, default=[0.0, 0.25], help="fractions of erased pages")
+    parser_benchmark.add_argument("--blocks", type=int, default=64, help="size of the synthetic images in blocks")
+    parser_benchmark.add_argument("-j", "--jobs", type=int, default=1, help="number of processes used for ecc correction")
+    parser_benchmark.add_argument("--seed", type=int, default=0, help="seed of the synthetic images")
+    parser_benchmark.add_argument("-o", "--output", type=Path, help="save the results as JSON")
+
+    parser_detect = subparsers.add_parser("detect", parents=[parser], help="rank configurations and search layouts on sampled pages")
+    parser_detect.add_argument("image", type=Path, help="path to image")
+    parser_detect.add_argument("-n", "--samples", type=int, default=256, help="number of pages sampled per partition or page geometry")
+    parser_detect.add_argument("-j", "--jobs", type=int, help="number of processes (default: number of CPUs)")
+    parser_detect.add_argument("--seed", type=int, default=0, help="seed of the page sampling")
+    parser_detect.add_argument("--no_search", action="store_true", help="only score the bundled configurations")
+    parser_detect.add_argument("--top", type=int, default=10, help="number of results to show")
+    parser_detect.add_argument("-o", "--output", type=Path, help="write the configuration of the best searched layout to this file")
+
+    parser_generate = subparsers.add_parser("generate", parents=[parser], help="generate a synthetic image for a configuration")
+    parser_generate.add_argument("image", type=Path, help="path of the image to write")
+    parser_generate.add_argument("-c", "--config", help="path or key of configuration file", required=True)
+    parser_generate.add_argument("--blocks", type=int, help="size of the image in blocks (default: end of the last partition)")
+    parser_generate.add_argument("--seed", type=int, default=0, help="seed of the random generators")
+    parser_generate.add_argument("--erased", type=float, default=0.0, help="fraction of erased pages")
+    parser_generate.add_argument("--flips", default="0", help="bitflips per chunk: <flips>, poisson:<mean> or uniform:<min>-<max>")
+    parser_generate.add_argument("--uncorrectable", type=float, default=0.0, help="fraction of chunks with more bitflips than the ecc can correct")
+    parser_generate.add_argument("--manifest", type=Path, help="path of the manifest (default: <image>.manifest.json)")
+
+    for subparser in (parser_mount, parser_extract):
+        subparser.add_argument("--stats_report", type=Path, help="collect counters and timers and write them as JSON to this file at the end")
 
     parser_list = subparsers.add_parser("list", parents=[parser], help="list available config files")
 
+    parser_cache = subparsers.add_parser("cache", parents=[parser], help="list or purge the cache of corrected partitions")
+    parser_cache.add_argument("action", choices=["list", "purge"], help="list or remove cache entries")
+    parser_cache.add_argument("--older_than", type=float, help="only purge entries not used for this many days")
+
+    for subparser in (parser_mount, parser_cache):
+        subparser.add_argument("--cache_dir", type=Path, help="path to the cache directory (default: $XDG_CACHE_HOME/nandtool or ~/.cache/nandtool)")
+
     args = main_parser.parse_args()
 
 
@@ -38,10 +106,93 @@ if __name__ == "__main__":
 
     setup_logging(LOGGER)
 
-    if args.type == "mount":
+    if args.type in ("mount", "cache"):
+        from nandtool.cache import DEFAULT_CACHE_DIR, CorrectionCache
+
+        args.cache_dir = args.cache_dir or DEFAULT_CACHE_DIR
+
+    if args.type == "cache":
+        disk_cache = CorrectionCache(args.cache_dir)
+        if args.action == "purge":
+            disk_cache.purge(None if args.older_than is None else args.older_than * 24 * 3600)
+            sys.exit(0)
+        print(f"Cache entries in {args.cache_dir}:")
+        for entry in disk_cache.entries():
+            print(
+                f"  {entry['key'][:16]}  {entry['partition']:<16} {entry['disk_size'] / 1024**2:10.1f} MiB  "
+                f"last used {time.ctime(entry['last_used'])}  {entry['image']}"
+            )
+        sys.exit(0)
+
+    if args.type == "detect":
+        from nandtool.detect import detect, layout_toml, print_results
+
+        if not args.image.exists():
+            LOGGER.warning(f"Image file {args.image} not found, exiting.")
+            sys.exit(-1)
+        results = detect(args.image, samples=args.samples, jobs=args.jobs, seed=args.seed, search=not args.no_search)
+        print_results(results, args.top)
+        if results and results[0]["source"] == "config":
+            print(f"Best match is the bundled configuration {results[0]['name']}, use -c {results[0]['name']}")
+        searched = [result for result in results if result["source"] == "search" and result["score"]]
+        if searched:
+            toml = layout_toml(searched[0]["layout"])
+            if args.output:
+                args.output.write_text(toml)
+                LOGGER.info(f"Wrote configuration of {searched[0]['name']} to {args.output}")
+            else:
+                print(f"Configuration of {searched[0]['name']}:")
+                print(toml)
+        sys.exit(0)
+
+    if args.type == "batch":
+        from nandtool.batch import load_jobs, print_summaries, run_batch
+        from nandtool.config import ConfigError
+
+        if not args.manifest.exists():
+            LOGGER.warning(f"Manifest {args.manifest} not found, exiting.")
+            sys.exit(-1)
+        try:
+            jobs = load_jobs(args.manifest)
+        except ConfigError as e:
+            LOGGER.warning(f"Invalid manifest: {e}, exiting.")
+            sys.exit(-2)
+        summaries = run_batch(jobs, concurrency=args.jobs, checkpoint_blocks=args.checkpoint_blocks)
+        print_summaries(summaries)
+        sys.exit(-3 if any("error" in summary for summary in summaries) else 0)
+
+    if args.type == "benchmark":
+        from nandtool.benchmark import benchmark
+
+        benchmark(args.styles, args.flips, args.erased, num_blocks=args.blocks, jobs=args.jobs, seed=args.seed, output=args.output)
+        sys.exit(0)
+
+    if args.type in ("mount", "extract", "generate"):
         if args.config in config_files:
             args.config = Path(config_files[args.config])
         else:
             args.config = Path(args.config)
 
-        sys.exit(mount(args.image, args.mount_point, args.config))
+    if args.type == "generate":
+        from nandtool.config import load_config
+        from nandtool.synthetic import generate_image
+
+        generate_image(
+            args.image, load_config(args.config), num_blocks=args.blocks, seed=args.seed, erased_fraction=args.erased,
+            flips=args.flips, uncorrectable_fraction=args.uncorrectable, manifest_path=args.manifest, config_path=args.config,
+        )
+        sys.exit(0)
+
+    if args.type == "extract":
+        from nandtool.extract import extract
+
+        sys.exit(extract(args.image, args.output_dir, args.config, partitions=args.partitions, jobs=args.jobs, stats_report=args.stats_report, sparse=args.sparse, interleave=args.interleave, rereads=args.reread, policy=args.uncorrectable_policy))
+
+    if args.type == "mount":
+        from nandtool.mount import mount
+
+        disk_cache = None
+        if args.disk_cache:
+            disk_cache = CorrectionCache(args.cache_dir, args.cache_max_size * 1024**3, args.cache_max_age * 24 * 3600)
+
+        sys.exit(mount(args.image, args.mount_point, args.config, lazy=args.lazy, cache_size=args.cache_size * 1024**2, jobs=args.jobs, disk_cache=disk_cache, scratch_dir=args.scratch_dir, readahead=args.readahead, threads=args.threads, stats=args.stats, stats_report=args.stats_report, interleave=args.interleave, rereads=args.reread, policy=args.uncorrectable_policy))
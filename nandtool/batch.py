@@ -0,0 +1,263 @@
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python < 3.11
+    import tomli as tomllib
+
+from nandtool.cache import write_atomic
+from nandtool.config import UNCORRECTABLE_POLICIES, ConfigError, get_configs, load_config
+from nandtool.extract import save_status
+from nandtool.nand import NAND
+from nandtool.source import image_paths, open_image
+from nandtool.stats import Stats, build_report, write_report
+
+LOGGER = logging.getLogger(__name__)
+
+# blocks corrected between two checkpoints of a partition
+DEFAULT_CHECKPOINT_BLOCKS = 256
+
+# report of a job, written to its output directory
+REPORT_NAME = "report.json"
+
+# increase when the checkpoint format changes, older checkpoints are ignored
+CHECKPOINT_VERSION = 1
+
+WRITE_BUFFER_SIZE = 16 * 1024**2
+
+
+def load_jobs(manifest_path):
+    """Load and validate a batch manifest, a TOML file with a [[job]] table per image.
+
+    Every job has an image (path or list of paths), a config (bundled name or path) and an output_dir, and optionally
+    partitions, interleave, rereads and uncorrectable_policy like the options of extract. Relative paths are relative
+    to the manifest.
+
+    Returns:
+        list: Jobs with resolved paths, partitions is None for all partitions.
+    """
+    manifest_path = Path(manifest_path)
+    with open(manifest_path, "rb") as f:
+        try:
+            manifest = tomllib.load(f)
+        except tomllib.TOMLDecodeError as e:
+            raise ConfigError(f"{manifest_path.name}: {e}") from None
+    if not isinstance(manifest.get("job"), list) or not manifest["job"]:
+        raise ConfigError(f"{manifest_path.name} has no [[job]] tables")
+
+    config_files = get_configs()
+    jobs = []
+    for i, job in enumerate(manifest["job"]):
+        for key in ("image", "config", "output_dir"):
+            if key not in job:
+                raise ConfigError(f"job {i} of {manifest_path.name} has no {key}")
+        if job.get("interleave") not in (None, "block", "page"):
+            raise ConfigError(f"interleave of job {i} must be block or page")
+        if job.get("uncorrectable_policy") not in (None,) + UNCORRECTABLE_POLICIES:
+            raise ConfigError(f"uncorrectable_policy of job {i} must be one of {', '.join(UNCORRECTABLE_POLICIES)}")
+        images = job["image"] if isinstance(job["image"], list) else [job["image"]]
+        config = config_files.get(job["config"]) or manifest_path.parent / job["config"]
+        jobs.append(
+            {
+                "image": [manifest_path.parent / image for image in images],
+                "config": Path(config),
+                "output_dir": manifest_path.parent / job["output_dir"],
+                "partitions": job.get("partitions"),
+                "interleave": job.get("interleave"),
+                "rereads": [
+                    [manifest_path.parent / path for path in (paths if isinstance(paths, list) else [paths])]
+                    for paths in job.get("rereads", [])
+                ],
+                "uncorrectable_policy": job.get("uncorrectable_policy"),
+            }
+        )
+    return jobs
+
+
+def checkpoint_key(nand, images):
+    """Key of everything the output of a partition depends on, a checkpoint is only resumed if the key matches."""
+    files = []
+    for source in images:
+        for path in image_paths(source):
+            st = path.stat()
+            files.append([str(path.resolve()), st.st_size, st.st_mtime_ns])
+    normalized = json.dumps(
+        {
+            "version": CHECKPOINT_VERSION,
+            "files": files,
+            "interleave": [getattr(source, "interleave", 0) for source in images],
+            "partition": nand.part_conf,
+            "policy": nand.policy,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def read_checkpoint(checkpoint_path, key):
+    try:
+        checkpoint = json.loads(checkpoint_path.read_text())
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get("key") != key:
+        LOGGER.warning(f"Ignoring checkpoint {checkpoint_path} of another image or configuration")
+        return None
+    return checkpoint
+
+
+def extract_resumable(nand, output_path, images, checkpoint_blocks=DEFAULT_CHECKPOINT_BLOCKS):
+    """Extract a partition to a file, resuming from the last checkpoint of an interrupted extraction.
+
+    A checkpoint is written every checkpoint_blocks blocks, after the corrected data and the status of the pages
+    up to that block are flushed to disk. The status is appended to <output>.status.partial while extracting and
+    saved to <output>.status when done.
+
+    Args:
+        nand (NAND): Partition to extract.
+        output_path (Path): Path of the output file.
+        images (list): Image and rereads (ImageSource) the partition is read from, identify the checkpoint.
+        checkpoint_blocks (int): Number of blocks between two checkpoints.
+
+    Returns:
+        int: Number of pages corrected in this run.
+    """
+    checkpoint_path = Path(f"{output_path}.checkpoint.json")
+    partial_path = Path(f"{output_path}.status.partial")
+    key = checkpoint_key(nand, images)
+    checkpoint = read_checkpoint(checkpoint_path, key)
+    if checkpoint is not None and checkpoint["complete"] and Path(f"{output_path}.status").exists():
+        LOGGER.info(f"Partition {output_path.name} is already extracted")
+        nand.status = np.load(f"{output_path}.status")
+        nand.corrected_bits = checkpoint["corrected_bits"]
+        return 0
+
+    first = 0
+    if checkpoint is not None and output_path.exists() and partial_path.exists():
+        first = checkpoint["pages"]
+        nand.status[:first] = np.fromfile(partial_path, dtype=nand.status.dtype, count=first)
+        nand.corrected_bits = checkpoint["corrected_bits"]
+        LOGGER.info(f"Resuming partition {output_path.name} at block {first // nand.layout.pages_per_block}")
+
+    pages_per_block = nand.layout.pages_per_block
+    position = last_checkpoint = first
+    with open(output_path, "r+b" if first else "wb", buffering=WRITE_BUFFER_SIZE) as f, open(
+        partial_path, "r+b" if first else "wb"
+    ) as status_file:
+        for out, offset in ((f, first * nand.corrected_pagesize), (status_file, first * nand.status.itemsize)):
+            out.truncate(offset)
+            out.seek(offset)
+        for userdata in nand.iter_corrected(first):
+            pages = nand.apply_policy(position, userdata)
+            f.write(pages)
+            status_file.write(nand.status[position : position + len(pages)].tobytes())
+            position += len(pages)
+            if position - last_checkpoint >= checkpoint_blocks * pages_per_block and position % pages_per_block == 0:
+                for out in (f, status_file):
+                    out.flush()
+                    os.fsync(out.fileno())
+                checkpoint = {"key": key, "pages": position, "corrected_bits": nand.corrected_bits, "complete": False}
+                write_atomic(checkpoint_path, json.dumps(checkpoint).encode())
+                last_checkpoint = position
+
+    save_status(nand, output_path)
+    checkpoint = {"key": key, "pages": position, "corrected_bits": nand.corrected_bits, "complete": True}
+    write_atomic(checkpoint_path, json.dumps(checkpoint).encode())
+    partial_path.unlink()
+    nand.log_uncorrectable()
+    return position - first
+
+
+def run_job(job, checkpoint_blocks=DEFAULT_CHECKPOINT_BLOCKS):
+    """Extract the partitions of a job and write its report to the output directory.
+
+    Returns:
+        dict: Summary of the job with its throughput and correction statistics.
+    """
+    start = perf_counter()
+    conf = load_config(job["config"])
+    partitions = job["partitions"] or list(conf.partitions)
+    unknown = [partition for partition in partitions if partition not in conf.partitions]
+    if unknown:
+        raise ConfigError(f"partitions {', '.join(unknown)} not in configuration")
+
+    extracted = dict()
+    raw_bytes = 0
+    # image and other dumps opened so far, closed also if opening the others fails
+    sources = []
+    try:
+        source = open_image(job["image"], conf, job["interleave"])
+        sources.append(source)
+        for paths in job["rereads"]:
+            sources.append(open_image(paths, conf, job["interleave"], size=len(source)))
+        rereads = sources[1:]
+        output_dir = Path(job["output_dir"])
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        for partition in partitions:
+            LOGGER.info(f"Start extracting partition {partition} of {source}")
+            nand = NAND(source, conf[partition], stats=Stats(), rereads=rereads, policy=job["uncorrectable_policy"])
+            pages = extract_resumable(nand, output_dir / partition, [source] + rereads, checkpoint_blocks)
+            raw_bytes += pages * nand.raw_pagesize
+            extracted[partition] = nand
+    finally:
+        for data in sources:
+            data.close()
+
+    seconds = perf_counter() - start
+    summary = {
+        "image": str(source),
+        "output_dir": str(output_dir),
+        "seconds": seconds,
+        "raw_bytes": raw_bytes,
+        "throughput_mib_s": raw_bytes / 1024**2 / seconds,
+        "corrected_bits": sum(nand.corrected_bits for nand in extracted.values()),
+        "uncorrectable_pages": sum(int(nand.status["uncorrectable"].sum()) for nand in extracted.values()),
+    }
+    write_report(output_dir / REPORT_NAME, build_report(extracted, **summary))
+    return summary
+
+
+def run_batch(jobs, concurrency=1, checkpoint_blocks=DEFAULT_CHECKPOINT_BLOCKS):
+    """Run the jobs of a manifest with a pool of at most concurrency worker processes.
+
+    A failing job does not stop the others, running the batch again resumes the jobs that did not complete.
+
+    Returns:
+        list: Summary of every job in the order of the manifest, with an error instead of the statistics if it failed.
+    """
+    summaries = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(run_job, job, checkpoint_blocks): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                summaries[i] = future.result()
+                LOGGER.info(
+                    f"Job {i} done in {summaries[i]['seconds']:.1f}s ({summaries[i]['throughput_mib_s']:.1f} MiB/s), "
+                    f"{summaries[i]['corrected_bits']} corrected bits, "
+                    f"{summaries[i]['uncorrectable_pages']} uncorrectable pages"
+                )
+            except Exception as e:
+                summaries[i] = {"image": ", ".join(map(str, jobs[i]["image"])), "error": str(e)}
+                LOGGER.error(f"Job {i} failed: {e}", exc_info=True)
+    return summaries
+
+
+def print_summaries(summaries):
+    for i, summary in enumerate(summaries):
+        if "error" in summary:
+            print(f"{i:3d}  failed: {summary['error']}  {summary['image']}")
+        else:
+            print(
+                f"{i:3d}  {summary['seconds']:8.1f}s  {summary['throughput_mib_s']:8.1f} MiB/s  "
+                f"{summary['corrected_bits']:10d} bits  {summary['uncorrectable_pages']:6d} uncorrectable  "
+                f"{summary['output_dir']}"
+            )
@@ -0,0 +1,160 @@
+import json
+import logging
+import mmap
+import platform
+import resource
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from multiprocessing import get_context
+from pathlib import Path
+from time import perf_counter, time
+
+from nandtool.config import LAYOUT_STYLES, FrozenConfig, get_configs, load_config
+from nandtool.logger import get_git_revision_hash
+from nandtool.nand import PageCache, build_partitions
+from nandtool.synthetic import write_image
+
+LOGGER = logging.getLogger(__name__)
+
+PARTITION = "BENCHMARK"
+
+# maximum size of a single FUSE read request
+READ_SIZE = 128 * 1024
+
+
+def layout_styles():
+    conf = load_config(get_configs()["example"])
+    return {style: dict(conf[partition].layout) for style, partition in LAYOUT_STYLES.items()}
+
+
+def partition_config(layout_conf):
+    """Configuration with a single partition spanning the whole image."""
+    return FrozenConfig({"partitions": [PARTITION], PARTITION: {"startblock": 0, "endblock": -1, "layout": layout_conf}})
+
+
+def run_case(image_path, layout_conf, lazy=False, jobs=1, read_size=READ_SIZE):
+    """Mount a partition and read it sequentially like the FUSE read path does.
+
+    Meant to run in a fresh process, so the peak RSS only covers this case.
+
+    Returns:
+        dict: Measurements of the case.
+    """
+    conf = partition_config(layout_conf)
+    with open(image_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = perf_counter()
+        cache = PageCache() if lazy else None
+        nand = build_partitions(mm, conf, lazy=lazy, cache=cache, jobs=jobs, image_path=image_path)[PARTITION]
+        build_seconds = perf_counter() - start
+
+        nand.read(0, read_size)
+        first_byte_seconds = perf_counter() - start
+        for offset in range(read_size, nand.corrected_partition_size, read_size):
+            nand.read(offset, read_size)
+        seconds = perf_counter() - start
+
+    raw_mib = nand.raw_partition_size / 1024**2
+    return {
+        "build_seconds": build_seconds,
+        "first_byte_seconds": first_byte_seconds,
+        "seconds": seconds,
+        "pages_per_second": nand.num_pages / seconds,
+        "mib_per_second": raw_mib / seconds,
+        "peak_rss_mib": peak_rss() / 1024**2,
+        "corrected_bits": nand.corrected_bits,
+        "uncorrectable_pages": int(nand.status["uncorrectable"].sum()),
+    }
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes.
+
+    On Linux the high water mark of the memory map is used, ru_maxrss also includes the parent process at the time
+    this process was started.
+    """
+    status = Path("/proc/self/status")
+    if status.exists():
+        for line in status.read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def benchmark(
+    styles=tuple(LAYOUT_STYLES),
+    flips=(0, 2),
+    erased=(0.0, 0.25),
+    num_blocks=64,
+    jobs=1,
+    seed=0,
+    output=None,
+):
+    """Benchmark eager and lazy correction of synthetic images for every combination of the parameters.
+
+    Args:
+        styles (list): Layout styles, keys of LAYOUT_STYLES.
+        flips (list): Numbers of bits flipped in every chunk.
+        erased (list): Fractions of erased pages.
+        num_blocks (int): Size of the synthetic images in blocks.
+        jobs (int): Number of worker processes used for eager correction.
+        seed (int): Seed of the synthetic images.
+        output (Path): Path of a JSON file to save the results in.
+
+    Returns:
+        list: Results of all cases.
+    """
+    layouts = layout_styles()
+    results = []
+    # a fresh process per case keeps the peak RSS of the cases apart
+    context = get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for style, flips_per_chunk, erased_fraction in product(styles, flips, erased):
+            if flips_per_chunk and not layouts[style]["ecc_algorithm"]:
+                # no bits are flipped in layouts without ecc
+                continue
+            image_path = Path(tmp_dir) / f"{style}.bin"
+            write_image(image_path, layouts[style], num_blocks, seed, erased_fraction, flips_per_chunk)
+            for lazy in (False, True):
+                case = {
+                    "style": style,
+                    "flips_per_chunk": flips_per_chunk,
+                    "erased_fraction": erased_fraction,
+                    "mode": "lazy" if lazy else "eager",
+                    "pages": num_blocks * layouts[style]["pages_per_block"],
+                }
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    try:
+                        case.update(executor.submit(run_case, image_path, layouts[style], lazy, jobs).result())
+                    except ValueError as e:
+                        case["error"] = str(e)
+                LOGGER.info(format_result(case))
+                results.append(case)
+
+    if output is not None:
+        report = {
+            "revision": get_git_revision_hash(Path(__file__).parent),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "created": time(),
+            "num_blocks": num_blocks,
+            "jobs": jobs,
+            "seed": seed,
+            "results": results,
+        }
+        Path(output).write_text(json.dumps(report, indent=1))
+        LOGGER.info(f"Saved benchmark results to {output}")
+    return results
+
+
+def format_result(case):
+    name = f"{case['style']:<8} flips {case['flips_per_chunk']:<2} erased {case['erased_fraction']:<5} {case['mode']:<6}"
+    if "error" in case:
+        return f"{name} failed: {case['error']}"
+    return (
+        f"{name} {case['pages_per_second']:10.0f} pages/s {case['mib_per_second']:8.1f} MiB/s "
+        f"first byte {case['first_byte_seconds'] * 1000:8.1f} ms  peak RSS {case['peak_rss_mib']:7.1f} MiB"
+    )
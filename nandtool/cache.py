@@ -0,0 +1,221 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from time import time
+
+import numpy as np
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "nandtool"
+DEFAULT_MAX_SIZE = 64 * 1024**3
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+
+# increase when the corrected output or the status format changes, invalidates all entries
+CACHE_VERSION = 5
+
+HASH_BLOCKSIZE = 16 * 1024**2
+
+
+class CorrectionCache:
+    """On-disk cache of corrected partitions.
+
+    Every entry is a directory named after the digest of the image and the partition configuration. It holds the
+    corrected pages that are not erased (corrected.bin), the slot of every page in it (slots.npy, -1 if erased),
+    the status of every page (status.npy) and some metadata (meta.json).
+
+    Args:
+        directory (Path): Cache directory.
+        max_size (int): Maximum total size of all entries in bytes, least recently used entries are evicted first.
+        max_age (int): Maximum time in seconds since an entry was last used.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE, max_age=DEFAULT_MAX_AGE):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def image_digest(self, image_path, rereads=()):
+        """Digest of the image content, given as a path or an ImageSource.
+
+        The digest of an image of several files combines the digests of the files and how they are interleaved, the
+        digests of other dumps of the chip are combined with the digest of the image.
+        """
+        from nandtool.source import ImageSource, image_paths
+
+        if rereads:
+            digest = hashlib.blake2b(bytes.fromhex(self.image_digest(image_path)), digest_size=32)
+            for reread in rereads:
+                digest.update(bytes.fromhex(self.image_digest(reread)))
+            return digest.hexdigest()
+        paths = image_paths(image_path)
+        if len(paths) == 1:
+            return self.file_digest(paths[0])
+        interleave = image_path.interleave if isinstance(image_path, ImageSource) else 0
+        digest = hashlib.blake2b(f"interleave:{interleave}".encode(), digest_size=32)
+        for path in paths:
+            digest.update(bytes.fromhex(self.file_digest(path)))
+        return digest.hexdigest()
+
+    def file_digest(self, image_path):
+        """Digest of the content of an image file.
+
+        Hashing is done once per image file, the digest is remembered by path, size, inode and modification time.
+        """
+        st = os.stat(image_path)
+        file_id = f"{Path(image_path).resolve()}:{st.st_size}:{st.st_ino}:{st.st_mtime_ns}"
+        digests_path = self.directory / "digests.json"
+        digests = json.loads(digests_path.read_text()) if digests_path.exists() else dict()
+        if file_id in digests:
+            return digests[file_id]
+
+        LOGGER.info(f"Computing digest of {image_path}")
+        digest = hashlib.blake2b(digest_size=32)
+        with open(image_path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCKSIZE), b""):
+                digest.update(block)
+
+        digests[file_id] = digest.hexdigest()
+        write_atomic(digests_path, json.dumps(digests, indent=1).encode())
+        return digests[file_id]
+
+    @staticmethod
+    def key(image_digest, part_conf):
+        """Cache key of a partition of an image, based on the normalized partition configuration."""
+        normalized = json.dumps(
+            {"version": CACHE_VERSION, "image": image_digest, "partition": part_conf}, sort_keys=True
+        )
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def load(self, key, nand):
+        """Load a cached partition into a NAND object, the corrected data is memory mapped from the cache.
+
+        Returns:
+            bool: Whether the partition was found in the cache.
+        """
+        from nandtool.nand import SparseBuffer
+
+        entry = self.directory / key
+        try:
+            meta = json.loads((entry / "meta.json").read_text())
+            status = np.load(entry / "status.npy")
+            slots = np.load(entry / "slots.npy")
+        except (OSError, ValueError):
+            return False
+        if (
+            meta["size"] != nand.corrected_partition_size
+            or status.dtype != nand.status.dtype
+            or len(slots) != nand.num_pages
+        ):
+            LOGGER.warning(f"Ignoring invalid cache entry {key}")
+            return False
+
+        if meta["stored_size"]:
+            # a private mapping is writable, so zero-copy reads can hand out ctypes views of it
+            with open(entry / "corrected.bin", "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        else:
+            data = bytearray()
+        nand.corrected = SparseBuffer(nand.layout.erased_userdata, nand.num_pages, data=data, slots=slots)
+        nand.status = status
+        nand.corrected_bits = meta["corrected_bits"]
+        # mark as recently used
+        os.utime(entry / "meta.json")
+        return True
+
+    def store(self, key, nand, name, image_path):
+        """Store a corrected partition in the cache."""
+        from nandtool.source import image_paths
+
+        entry = self.directory / key
+        entry.mkdir(exist_ok=True)
+        write_atomic(entry / "corrected.bin", nand.corrected.data)
+        with open(entry / "status.npy", "wb") as f:
+            np.save(f, nand.status)
+        with open(entry / "slots.npy", "wb") as f:
+            np.save(f, nand.corrected.slots)
+        meta = {
+            "image": ", ".join(str(path.resolve()) for path in image_paths(image_path)),
+            # image files the entry was made from, including other dumps, their digests are kept while it exists
+            "files": [str(path.resolve()) for source in [image_path, *nand.rereads] for path in image_paths(source)],
+            "partition": name,
+            "size": len(nand.corrected),
+            "stored_size": len(nand.corrected.data),
+            "corrected_bits": nand.corrected_bits,
+            "uncorrectable_pages": int(nand.status["uncorrectable"].sum()),
+            "created": time(),
+        }
+        # meta.json is written last, entries without it are incomplete
+        write_atomic(entry / "meta.json", json.dumps(meta, indent=1).encode())
+
+    def entries(self):
+        """List all complete entries, least recently used first."""
+        entries = []
+        for entry in self.directory.iterdir():
+            meta_path = entry / "meta.json"
+            if not meta_path.is_file():
+                continue
+            meta = json.loads(meta_path.read_text())
+            meta["key"] = entry.name
+            meta["last_used"] = meta_path.stat().st_mtime
+            meta["disk_size"] = sum(f.stat().st_size for f in entry.iterdir())
+            entries.append(meta)
+        return sorted(entries, key=lambda meta: meta["last_used"])
+
+    def remove(self, key):
+        LOGGER.info(f"Removing cache entry {key}")
+        shutil.rmtree(self.directory / key, ignore_errors=True)
+
+    def evict(self):
+        """Remove entries that were not used within max_age, then the least recently used until within max_size."""
+        entries = self.entries()
+        total_size = sum(meta["disk_size"] for meta in entries)
+        for meta in entries:
+            if time() - meta["last_used"] > self.max_age or total_size > self.max_size:
+                self.remove(meta["key"])
+                total_size -= meta["disk_size"]
+        self.prune_digests()
+
+    def purge(self, older_than=None):
+        """Remove all entries, or only those not used for older_than seconds."""
+        for meta in self.entries():
+            if older_than is None or time() - meta["last_used"] > older_than:
+                self.remove(meta["key"])
+        self.prune_digests()
+
+    def prune_digests(self):
+        """Drop the digests of image files that are gone or changed, or that no remaining entry was made from."""
+        digests_path = self.directory / "digests.json"
+        if not digests_path.exists():
+            return
+        digests = json.loads(digests_path.read_text())
+        used = {path for meta in self.entries() for path in meta.get("files", meta["image"].split(", "))}
+        kept = dict()
+        for file_id, digest in digests.items():
+            path = file_id.rsplit(":", 3)[0]
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if path in used and file_id == f"{path}:{st.st_size}:{st.st_ino}:{st.st_mtime_ns}":
+                kept[file_id] = digest
+        if len(kept) < len(digests):
+            LOGGER.info(f"Dropping {len(digests) - len(kept)} image digests")
+            write_atomic(digests_path, json.dumps(kept, indent=1).encode())
+
+
+def write_atomic(path, data):
+    """Write a file by renaming a temporary file with a unique name, so concurrent writers never mix their data."""
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False) as f:
+        try:
+            f.write(data)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
@@ -1,6 +1,105 @@
+from collections.abc import Mapping
+from functools import lru_cache
 from pathlib import Path
 
-from dynaconf import Dynaconf
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python < 3.11
+    import tomli as tomllib
+
+# partitions of example.toml that represent every layout style
+LAYOUT_STYLES = {"simple": "SIMPLE", "complex": "COMPLEX1", "etfs": "ETFS", "noecc": "RAW"}
+
+# default values of the optional layout parameters
+LAYOUT_DEFAULTS = {
+    "ecc": None,
+    "ecc_protected_data": None,
+    "ecc_algorithm": None,
+    "left_shift_ecc_buf": 0,
+    "ecc_protected_data_reverse": False,
+    "ecc_protected_data_invert": False,
+    "ecc_reverse": False,
+    "ecc_invert": False,
+    "ecc_strict": True,
+    "uncorrectable_policy": None,
+    "erased_bitflip_threshold": 0,
+    "bad_block_marker": None,
+    "bad_block_pages": [0],
+}
+
+# default values of the optional partition parameters
+PARTITION_DEFAULTS = {"skip_bad_blocks": False}
+
+# handling of uncorrectable pages when they are read: raise an error, read zeros, or read the data as it is
+UNCORRECTABLE_POLICIES = ("abort", "zero", "raw")
+
+# parameters of every type of ecc algorithm with their defaults, None if the parameter is required
+ECC_PARAMETERS = {
+    "bch": {"poly": None, "t": None},
+    "hamming": {"step": 256, "byte_order": "linux"},
+    "rs": {"nsym": None, "symbol_size": 8, "prim": None, "fcr": 0},
+}
+
+# size in bytes of the etfs transaction fields
+ETFS_FIELDS = {"fid": 2, "cluster": 4, "nclusters": 2, "sequence": 4}
+
+
+class ConfigError(ValueError):
+    """Invalid configuration."""
+
+
+class FrozenConfig(Mapping):
+    """Immutable configuration table, items can also be accessed as attributes.
+
+    Nested tables are frozen as well and arrays become tuples.
+    """
+
+    def __init__(self, items):
+        object.__setattr__(self, "_items", {key: freeze(value) for key, value in items.items()})
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getattr__(self, key):
+        if key.startswith("_"):
+            raise AttributeError(key)
+        try:
+            return self._items[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Configurations are immutable")
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self):
+        """Mutable copy with plain dicts and lists, e.g. to serialize the configuration."""
+        return to_dict(self)
+
+
+def freeze(value):
+    if isinstance(value, Mapping):
+        return value if isinstance(value, FrozenConfig) else FrozenConfig(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def to_dict(value):
+    """Convert (frozen) configuration tables and arrays into plain dicts and lists."""
+    if isinstance(value, Mapping):
+        return {key: to_dict(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_dict(item) for item in value]
+    return value
 
 
 def get_configs():
@@ -11,52 +110,233 @@ def get_configs():
 
 
 def load_config(config_path: Path):
-    settings = Dynaconf(
-        envvar_prefix="DYNACONF",
-        settings_files=[str(config_path)],
-    )
-    check_and_augment_conf(settings)
-    return settings
-
-
-def check_and_augment_conf(settings):
-    # TODO: add decent checks
-    for partition in settings.partitions:
-        part = settings[partition]
-        part.layout = settings[part.layout]
-        layout = part.layout
-        layout.blocksize = (layout.pagesize + layout.oobsize) * layout.pages_per_block
-
-        if hasattr(layout, "ecc_algorithm"):
-            ecc_algorithm = layout.ecc_algorithm
-            layout.ecc_algorithm = (
-                settings[ecc_algorithm]
-                if isinstance(ecc_algorithm, str)
-                else layout.ecc_algorithm
-            )
-        else:
-            layout.ecc_algorithm = None
-        if not hasattr(layout, "ecc"):
-            layout.ecc = None
-        if not hasattr(layout, "ecc_protected_data"):
-            layout.ecc_protected_data = None
-
-        if hasattr(layout, "etfs"):
-            etfs_layout = layout.etfs
-            layout.etfs = (
-                settings[etfs_layout] if isinstance(etfs_layout, str) else layout.etfs
+    """Load and validate a configuration file.
+
+    The compiled configuration is cached until the file changes.
+
+    Returns:
+        FrozenConfig: Configuration with the partitions listed in partitions, their layout, ecc algorithm and etfs
+            sections resolved and the defaults of optional parameters filled in.
+    """
+    path = Path(config_path).resolve()
+    st = path.stat()
+    return _load_config(path, st.st_mtime_ns, st.st_size)
+
+
+@lru_cache(maxsize=64)
+def _load_config(path, mtime_ns, size):
+    with open(path, "rb") as f:
+        try:
+            settings = tomllib.load(f)
+        except tomllib.TOMLDecodeError as e:
+            raise ConfigError(f"{path.name}: {e}") from None
+    try:
+        return FrozenConfig(compile_config(settings))
+    except ConfigError as e:
+        raise ConfigError(f"{path.name}: {e}") from None
+
+
+def compile_config(settings):
+    """Resolve the sections referenced by the partitions, fill in defaults and validate the result.
+
+    Args:
+        settings (dict): Parsed configuration file.
+
+    Returns:
+        dict: Compiled configuration.
+    """
+    if not isinstance(settings.get("partitions"), list) or not settings["partitions"]:
+        raise ConfigError("partitions must be a list of partition names")
+    conf = dict(settings)
+    layouts = dict()
+    for partition in settings["partitions"]:
+        part = dict(section(settings, partition, "partition"))
+        for key in ("startblock", "endblock", "layout"):
+            if key not in part:
+                raise ConfigError(f"partition {partition} has no {key}")
+        name = part["layout"] if isinstance(part["layout"], str) else partition
+        if name not in layouts:
+            layouts[name] = compile_layout(settings, section(settings, part["layout"], "layout"), name)
+        part["layout"] = layouts[name]
+        part = {**PARTITION_DEFAULTS, **part}
+        check_partition(part, partition)
+        conf[partition] = part
+    return conf
+
+
+def section(settings, reference, kind):
+    """Section referenced by name, or the referenced value itself if it is an inline table."""
+    if isinstance(reference, Mapping):
+        return reference
+    if not isinstance(reference, str) or not isinstance(settings.get(reference), Mapping):
+        raise ConfigError(f"{kind} {reference} is not defined")
+    return settings[reference]
+
+
+def compile_layout(settings, layout, name):
+    layout = {**LAYOUT_DEFAULTS, **layout}
+    for key in ("pagesize", "oobsize", "pages_per_block", "user_data"):
+        if key not in layout:
+            raise ConfigError(f"layout {name} has no {key}")
+    layout["blocksize"] = (layout["pagesize"] + layout["oobsize"]) * layout["pages_per_block"]
+    if layout["ecc_algorithm"] is not None:
+        layout["ecc_algorithm"] = dict(section(settings, layout["ecc_algorithm"], "ecc algorithm"))
+    if "etfs" in layout:
+        layout["etfs"] = dict(section(settings, layout["etfs"], "etfs transaction"))
+    check_layout(layout, name)
+    return layout
+
+
+def check_intervals(chunks, raw_pagesize, where):
+    """Check a list of chunks, each a list of [start, end) intervals within the page."""
+    if not isinstance(chunks, list):
+        raise ConfigError(f"{where} must be a list of chunks")
+    for chunk in chunks:
+        if not isinstance(chunk, list):
+            raise ConfigError(f"{where} must be a list of chunks, each a list of [start, end] intervals")
+        for interval in chunk:
+            if (
+                not isinstance(interval, list)
+                or len(interval) != 2
+                or not all(isinstance(offset, int) for offset in interval)
+                or not 0 <= interval[0] < interval[1] <= raw_pagesize
+            ):
+                raise ConfigError(
+                    f"{where} has invalid interval {interval}, intervals are [start, end] with "
+                    f"0 <= start < end <= {raw_pagesize}"
+                )
+
+
+def chunk_length(chunk):
+    return sum(end - start for start, end in chunk)
+
+
+def check_layout(layout, name):
+    for key in ("pagesize", "oobsize", "pages_per_block"):
+        if not isinstance(layout[key], int) or layout[key] < (0 if key == "oobsize" else 1):
+            raise ConfigError(f"{key} of layout {name} must be a positive integer")
+    raw_pagesize = layout["pagesize"] + layout["oobsize"]
+    check_intervals(layout["user_data"], raw_pagesize, f"user_data of layout {name}")
+
+    ecc, protected_data, ecc_algorithm = layout["ecc"], layout["ecc_protected_data"], layout["ecc_algorithm"]
+    if ecc_algorithm is not None:
+        if ecc is None or protected_data is None:
+            raise ConfigError(f"layout {name} has an ecc_algorithm, but no ecc or ecc_protected_data")
+        check_ecc_algorithm(ecc_algorithm, name)
+    if ecc is not None or protected_data is not None:
+        check_intervals(ecc or [], raw_pagesize, f"ecc of layout {name}")
+        check_intervals(protected_data or [], raw_pagesize, f"ecc_protected_data of layout {name}")
+        if len(ecc or []) != len(protected_data or []):
+            raise ConfigError(
+                f"layout {name} has {len(protected_data or [])} chunks of ecc_protected_data, "
+                f"but {len(ecc or [])} chunks of ecc"
             )
+    if ecc_algorithm is not None:
+        ecc_bytes, data_bytes, algorithm = ecc_geometry(ecc_algorithm)
+        for i, (data_chunk, ecc_chunk) in enumerate(zip(protected_data, ecc)):
+            if chunk_length(ecc_chunk) != ecc_bytes:
+                raise ConfigError(
+                    f"chunk {i} of layout {name} has {chunk_length(ecc_chunk)} ecc bytes, {algorithm} has {ecc_bytes}"
+                )
+            if chunk_length(data_chunk) > data_bytes.stop - 1:
+                raise ConfigError(f"chunk {i} of layout {name} has more protected data than the ecc algorithm allows")
+            if chunk_length(data_chunk) not in data_bytes:
+                raise ConfigError(
+                    f"chunk {i} of layout {name} has {chunk_length(data_chunk)} bytes of protected data, "
+                    f"{algorithm} needs at least {data_bytes.start}"
+                )
+
+    if "etfs" in layout:
+        for field, size in ETFS_FIELDS.items():
+            interval = layout["etfs"].get(field)
+            check_intervals([[interval]], raw_pagesize, f"etfs field {field} of layout {name}")
+            if interval[1] - interval[0] != size:
+                raise ConfigError(f"etfs field {field} of layout {name} must be {size} bytes")
+
+    if layout["uncorrectable_policy"] not in (None,) + UNCORRECTABLE_POLICIES:
+        raise ConfigError(f"uncorrectable_policy of layout {name} must be one of {', '.join(UNCORRECTABLE_POLICIES)}")
+
+    for key in ("left_shift_ecc_buf", "erased_bitflip_threshold"):
+        if not isinstance(layout[key], int) or layout[key] < 0:
+            raise ConfigError(f"{key} of layout {name} must be a non-negative integer")
+    if layout["bad_block_marker"] is not None:
+        if not isinstance(layout["bad_block_marker"], int) or not 0 <= layout["bad_block_marker"] < raw_pagesize:
+            raise ConfigError(f"bad_block_marker of layout {name} must be an offset within the page")
+        pages_per_block = layout["pages_per_block"]
+        if not all(-pages_per_block <= page < pages_per_block for page in layout["bad_block_pages"]):
+            raise ConfigError(f"bad_block_pages of layout {name} must be pages within the block")
+
+
+def check_ecc_algorithm(ecc_algorithm, name):
+    kind = ecc_algorithm.get("type", "bch")
+    if kind not in ECC_PARAMETERS:
+        raise ConfigError(f"type of the ecc algorithm of layout {name} must be one of {', '.join(ECC_PARAMETERS)}")
+    unknown = set(ecc_algorithm) - set(ECC_PARAMETERS[kind]) - {"type"}
+    if unknown:
+        raise ConfigError(f"ecc algorithm of layout {name} has unknown parameters {', '.join(sorted(unknown))}")
+    algorithm = {**ECC_PARAMETERS[kind], **ecc_algorithm}
+    if kind == "bch":
+        if not all(isinstance(algorithm[key], int) and algorithm[key] > 0 for key in ("poly", "t")):
+            raise ConfigError(f"ecc algorithm of layout {name} needs a positive poly and t")
+    elif kind == "hamming":
+        if algorithm["step"] not in (256, 512):
+            raise ConfigError(f"step of the hamming ecc of layout {name} must be 256 or 512")
+        if algorithm["byte_order"] not in ("linux", "smartmedia"):
+            raise ConfigError(f"byte_order of the hamming ecc of layout {name} must be linux or smartmedia")
+    else:
+        m = algorithm["symbol_size"]
+        if not isinstance(m, int) or not 3 <= m <= 16:
+            raise ConfigError(f"symbol_size of the rs ecc of layout {name} must be 3 to 16 bits")
+        if not isinstance(algorithm["nsym"], int) or not 0 < algorithm["nsym"] < 2**m - 1:
+            raise ConfigError(f"nsym of the rs ecc of layout {name} must be a positive number below {2**m - 1}")
+        if algorithm["prim"] is not None and (
+            not isinstance(algorithm["prim"], int) or algorithm["prim"].bit_length() - 1 != m
+        ):
+            raise ConfigError(f"prim of the rs ecc of layout {name} must be a polynomial of degree {m}")
+        if not isinstance(algorithm["fcr"], int) or algorithm["fcr"] < 0:
+            raise ConfigError(f"fcr of the rs ecc of layout {name} must be a non-negative integer")
+
 
-        # Set default values for optional parameters
-        if not hasattr(layout, "left_shift_ecc_buf"):
-            layout.left_shift_ecc_buf = 0
-        if not hasattr(layout, "ecc_protected_data_reverse"):
-            layout.ecc_protected_data_reverse = False
-        if not hasattr(layout, "ecc_protected_data_invert"):
-            layout.ecc_protected_data_invert = False
-        if not hasattr(layout, "ecc_reverse"):
-            layout.ecc_reverse = False
-        if not hasattr(layout, "ecc_invert"):
-            layout.ecc_invert = False
-        if not hasattr(layout, "ecc_strict"):
-            layout.ecc_strict = True
+def ecc_geometry(ecc_algorithm):
+    """Size of the ecc of a chunk and of the protected data it can have under a validated ecc algorithm.
+
+    Returns:
+        tuple: Number of ecc bytes, range of the allowed number of protected data bytes and a description of the
+            algorithm for error messages.
+    """
+    kind = ecc_algorithm.get("type", "bch")
+    algorithm = {**ECC_PARAMETERS[kind], **ecc_algorithm}
+    if kind == "bch":
+        # degree of the primitive polynomial, the BCH code has codewords of 2^m - 1 bits
+        m = algorithm["poly"].bit_length() - 1
+        data_bits = 2**m - 1 - m * algorithm["t"]
+        description = f"bch(poly={algorithm['poly']}, t={algorithm['t']})"
+        return -(-m * algorithm["t"] // 8), range(1, data_bits // 8 + 1), description
+    if kind == "hamming":
+        # line parities of every bit of the byte address and six column parities, 22 or 24 bits
+        return 3, range(algorithm["step"], algorithm["step"] + 1), f"hamming(step={algorithm['step']})"
+    # the RS code has codewords of 2^m - 1 symbols of m bits
+    m, nsym = algorithm["symbol_size"], algorithm["nsym"]
+    data_bits = (2**m - 1 - nsym) * m
+    return -(-m * nsym // 8), range(1, data_bits // 8 + 1), f"rs(nsym={nsym}, symbol_size={m})"
+
+
+def check_partition(part, name):
+    start, end = part["startblock"], part["endblock"]
+    if not isinstance(start, int) or start < 0:
+        raise ConfigError(f"startblock of partition {name} must be a non-negative integer")
+    if not isinstance(end, int) or (end != -1 and end < start):
+        raise ConfigError(f"endblock of partition {name} must be -1 (end of the image) or at least the startblock")
+
+
+def check_image_size(conf, image_size):
+    """Check that all partitions lie within an image of the given size in bytes."""
+    for partition in conf.partitions:
+        part = conf[partition]
+        num_blocks = image_size // part.layout.blocksize
+        last = num_blocks - 1 if part.endblock == -1 else part.endblock
+        if part.startblock >= num_blocks or last >= num_blocks:
+            raise ConfigError(
+                f"partition {partition} spans blocks {part.startblock} to {last}, but the image has {num_blocks} "
+                f"blocks of {part.layout.blocksize} bytes"
+            )
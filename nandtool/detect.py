@@ -0,0 +1,324 @@
+import logging
+import mmap
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import bchlib
+import numpy as np
+
+from nandtool.config import get_configs, load_config
+from nandtool.nand import NAND, shift_right, translate_table
+
+LOGGER = logging.getLogger(__name__)
+
+# number of pages sampled per partition or page geometry
+DEFAULT_SAMPLES = 256
+
+# minimum number of located pages that agree on the offset of the ecc
+MIN_MATCHES = 3
+
+# search space
+GEOMETRIES = ((512, 16), (2048, 64), (2048, 128), (4096, 128), (4096, 224), (4096, 256), (8192, 448), (8192, 640))
+DEFAULT_POLYS = (8219, 16427, 32771)
+STRENGTHS = (4, 8, 12, 16, 24)
+CHUNK_SIZES = (512, 1024)
+# bytes of the spare area protected per chunk, directly after the page data
+SPARE_SIZES = (0, 4)
+PAGES_PER_BLOCK = 64
+
+# state of a worker process, set up once by the pool initializer
+_WORKER = dict()
+
+
+def _init_worker(image_path, samples, seed):
+    f = open(image_path, "rb")
+    _WORKER["file"] = f
+    _WORKER["mm"] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    _WORKER["samples"] = samples
+    _WORKER["seed"] = seed
+    _WORKER["pages"] = dict()
+
+
+def sample_pages(data, raw_pagesize, samples, seed, first=0, last=None):
+    """Sample random pages that are not erased or otherwise filled with a single byte value.
+
+    Args:
+        data: Image data.
+        raw_pagesize (int): Size of a page including the spare area.
+        samples (int): Maximum number of pages to sample.
+        seed (int): Seed of the random generator.
+        first (int): Index of the first page to sample from.
+        last (int): Index of the page after the last page to sample from, defaults to the end of the image.
+
+    Returns:
+        tuple: Sampled pages with shape (pages, raw_pagesize) and their page indices.
+    """
+    last = len(data) // raw_pagesize if last is None else min(last, len(data) // raw_pagesize)
+    if last <= first:
+        return np.zeros((0, raw_pagesize), dtype="u1"), np.zeros(0, dtype=np.intp)
+
+    rng = np.random.default_rng([seed, raw_pagesize, first])
+    # random order, so every prefix of the samples is spread over the whole range
+    candidates = rng.choice(last - first, size=min(4 * samples, last - first), replace=False) + first
+    pages = np.frombuffer(data, "u1", count=last * raw_pagesize).reshape(-1, raw_pagesize)[candidates]
+    used = (pages != pages[:, :1]).any(axis=1)
+    return pages[used][:samples], candidates[used][:samples]
+
+
+def score_layout(nand, pages):
+    """Decode the chunks of sampled pages that are not erased.
+
+    Returns:
+        tuple: Number of chunks that decode, number of chunks and total number of bitflips.
+    """
+    zero_bits = nand.count_zero_bits(pages)
+    erased = zero_bits <= nand.layout.erased_threshold
+    clean = chunks = flips = 0
+    for chunk, (data_index, ecc_index) in enumerate(zip(nand.layout.data_index, nand.layout.ecc_index)):
+        rows = np.flatnonzero(~erased[:, chunk])
+        if not len(rows):
+            continue
+        _, _, chunk_flips = nand.correct_chunks(pages[rows[:, None], data_index], pages[rows[:, None], ecc_index])
+        clean += int((chunk_flips >= 0).sum())
+        chunks += len(rows)
+        flips += int(chunk_flips[chunk_flips > 0].sum())
+    return clean, chunks, flips
+
+
+def score_config(name, config_path):
+    """Score a bundled configuration on pages sampled from every partition with ecc."""
+    data = _WORKER["mm"]
+    result = {"name": name, "source": "config", "clean_chunks": 0, "chunks": 0, "flips": 0}
+    try:
+        conf = load_config(config_path)
+        for partition in conf.partitions:
+            nand = NAND(data, conf[partition])
+            if not nand.has_ecc:
+                continue
+            first = nand.start_offset // nand.raw_pagesize
+            pages, _ = sample_pages(
+                data, nand.raw_pagesize, _WORKER["samples"], _WORKER["seed"], first, first + nand.num_pages
+            )
+            clean, chunks, flips = score_layout(nand, pages)
+            result["clean_chunks"] += clean
+            result["chunks"] += chunks
+            result["flips"] += flips
+    except Exception as e:
+        LOGGER.debug(f"Failed to score configuration {name}: {e}")
+        result["error"] = str(e)
+    return finish_result(result)
+
+
+def finish_result(result):
+    result["score"] = result["clean_chunks"] / result["chunks"] if result["chunks"] else None
+    result["flips_per_chunk"] = result["flips"] / result["clean_chunks"] if result["clean_chunks"] else None
+    return result
+
+
+def geometry_pages(pagesize, oobsize):
+    """Sampled pages of a page geometry, memoized per worker."""
+    raw_pagesize = pagesize + oobsize
+    if raw_pagesize not in _WORKER["pages"]:
+        _WORKER["pages"][raw_pagesize], _ = sample_pages(
+            _WORKER["mm"], raw_pagesize, _WORKER["samples"], _WORKER["seed"]
+        )
+    return _WORKER["pages"][raw_pagesize]
+
+
+def locate_ecc(pages, ecc, table, left_shift):
+    """Find the offset in the pages where the ecc is stored after reverting the buffer modifications.
+
+    Bytes of the stored ecc that are partly shifted out or padding are not compared.
+
+    Returns:
+        int: Offset of the ecc in the page, or None if fewer than MIN_MATCHES pages agree.
+    """
+    raw_ecc = shift_right(ecc, left_shift)
+    if table is not None:
+        raw_ecc = table[raw_ecc]
+    skip = 1 if left_shift else 0
+    offsets = Counter()
+    for page, page_ecc in zip(pages, raw_ecc):
+        position = page.tobytes().find(page_ecc[skip:-1].tobytes())
+        if position >= 0:
+            offsets[position - skip] += 1
+    if not offsets:
+        return None
+    offset, matches = offsets.most_common(1)[0]
+    return offset if matches >= MIN_MATCHES else None
+
+
+def encode_chunks(bch, data, table):
+    if table is not None:
+        data = table[data]
+    raw = data.tobytes()
+    length = data.shape[1]
+    return np.frombuffer(b"".join(bch.encode(raw[i * length : (i + 1) * length]) for i in range(len(data))), "u1").reshape(
+        len(data), -1
+    )
+
+
+def candidate_layout(pagesize, oobsize, poly, t, chunk_size, spare, ecc_offsets, ecc_bytes, options):
+    chunks = pagesize // chunk_size
+    protected_data = []
+    for i in range(chunks):
+        intervals = [[i * chunk_size, (i + 1) * chunk_size]]
+        if spare:
+            intervals.append([pagesize + i * spare, pagesize + (i + 1) * spare])
+        protected_data.append(intervals)
+    return {
+        "pagesize": pagesize,
+        "oobsize": oobsize,
+        "pages_per_block": PAGES_PER_BLOCK,
+        "blocksize": (pagesize + oobsize) * PAGES_PER_BLOCK,
+        "ecc_protected_data": protected_data,
+        "user_data": [[[i * chunk_size, (i + 1) * chunk_size]] for i in range(chunks)],
+        "ecc": [[[offset, offset + ecc_bytes]] for offset in ecc_offsets],
+        "ecc_algorithm": {"poly": poly, "t": t},
+        "ecc_strict": True,
+        "erased_bitflip_threshold": 0,
+        **options,
+    }
+
+
+def search_candidate(pagesize, oobsize, poly, t, chunk_size, spare):
+    """Search the location of the ecc for a BCH code and chunk layout, trying every buffer modification.
+
+    The ecc of the sampled chunks is calculated and looked up in the sampled pages, so the ecc offsets do not have
+    to be enumerated. This needs at least MIN_MATCHES sampled chunks without bitflips. Located layouts are scored on
+    all sampled pages.
+
+    Returns:
+        list: Results of the located layouts.
+    """
+    try:
+        bch = bchlib.BCH(prim_poly=poly, t=t)
+    except Exception:
+        return []
+    chunks = pagesize // chunk_size
+    if not chunks or chunks * (bch.ecc_bytes + spare) > oobsize or (chunk_size + spare) * 8 + bch.ecc_bits > bch.n:
+        return []
+
+    pages = geometry_pages(pagesize, oobsize)
+    results = []
+    for data_reverse, data_invert in product((False, True), repeat=2):
+        data_table = translate_table(data_reverse, data_invert)
+        chunk_data = []
+        for i in range(chunks):
+            index = np.r_[i * chunk_size : (i + 1) * chunk_size, pagesize + i * spare : pagesize + (i + 1) * spare]
+            chunk_data.append(pages[:, index])
+        first_ecc = encode_chunks(bch, chunk_data[0], data_table)
+
+        for ecc_reverse, ecc_invert, left_shift in product((False, True), (False, True), (0, 4)):
+            ecc_table = translate_table(ecc_reverse, ecc_invert)
+            offsets = [locate_ecc(pages, first_ecc, ecc_table, left_shift)]
+            for i in range(1, chunks):
+                if offsets[-1] is None:
+                    break
+                offsets.append(locate_ecc(pages, encode_chunks(bch, chunk_data[i], data_table), ecc_table, left_shift))
+            if None in offsets:
+                continue
+
+            options = {
+                "left_shift_ecc_buf": left_shift,
+                "ecc_protected_data_reverse": data_reverse,
+                "ecc_protected_data_invert": data_invert,
+                "ecc_reverse": ecc_reverse,
+                "ecc_invert": ecc_invert,
+            }
+            layout = candidate_layout(pagesize, oobsize, poly, t, chunk_size, spare, offsets, bch.ecc_bytes, options)
+            nand = NAND(b"", {"startblock": 0, "endblock": 0, "layout": layout})
+            clean, total, flips = score_layout(nand, pages)
+            name = (
+                f"{pagesize}+{oobsize} bch(poly={poly}, t={t}) {chunks}x{chunk_size}"
+                + (f"+{spare}" if spare else "")
+                + f" ecc@{offsets[0]:#x}"
+                + "".join(f" {key}" for key, value in options.items() if value and key != "left_shift_ecc_buf")
+                + (f" shift {left_shift}" if left_shift else "")
+            )
+            results.append(
+                finish_result(
+                    {"name": name, "source": "search", "clean_chunks": clean, "chunks": total, "flips": flips, "layout": layout}
+                )
+            )
+    return results
+
+
+def search_space(polys=DEFAULT_POLYS, geometries=GEOMETRIES):
+    return list(product(geometries, polys, STRENGTHS, CHUNK_SIZES, SPARE_SIZES))
+
+
+def detect(image, samples=DEFAULT_SAMPLES, jobs=None, seed=0, search=True, geometries=GEOMETRIES):
+    """Score the bundled configurations and search for layouts on pages sampled from the image.
+
+    Args:
+        image (Path): Path to the image.
+        samples (int): Number of pages sampled per partition or page geometry.
+        jobs (int): Number of worker processes, defaults to the number of CPUs.
+        seed (int): Seed of the page sampling.
+        search (bool): Search the parameter space besides scoring the bundled configurations.
+        geometries (list): Page geometries (pagesize, oobsize) to search.
+
+    Returns:
+        list: Results ranked by score, the fraction of the sampled chunks that decode.
+    """
+    configs = get_configs()
+    size = os.path.getsize(image)
+    # polys of the bundled configurations are likely candidates as well
+    polys = set(DEFAULT_POLYS)
+    for config_path in configs.values():
+        conf = load_config(config_path)
+        for partition in conf.partitions:
+            ecc_algorithm = conf[partition].layout.ecc_algorithm
+            if ecc_algorithm and ecc_algorithm.get("type", "bch") == "bch":
+                polys.add(ecc_algorithm["poly"])
+    geometries = [geometry for geometry in geometries if size % sum(geometry) == 0]
+
+    with ProcessPoolExecutor(
+        max_workers=jobs or os.cpu_count(), initializer=_init_worker, initargs=(str(image), samples, seed)
+    ) as executor:
+        futures = [executor.submit(score_config, name, path) for name, path in sorted(configs.items())]
+        if search:
+            LOGGER.info(f"Searching {len(search_space(polys, geometries))} candidates")
+            searches = [
+                executor.submit(search_candidate, pagesize, oobsize, poly, t, chunk_size, spare)
+                for (pagesize, oobsize), poly, t, chunk_size, spare in search_space(sorted(polys), geometries)
+            ]
+        results = [future.result() for future in futures]
+        if search:
+            for future in searches:
+                results.extend(future.result())
+
+    return sorted(results, key=lambda result: (result["score"] is not None, result["score"] or 0), reverse=True)
+
+
+def layout_toml(layout):
+    """Configuration file with a single partition spanning the whole image for a detected layout."""
+    lines = [
+        "# generated by nandtool detect, pages_per_block is assumed",
+        "partitions = ['DATA']",
+        "",
+        "[detected_bch]",
+        f"t = {layout['ecc_algorithm']['t']}",
+        f"poly = {layout['ecc_algorithm']['poly']}",
+        "",
+        "[detected_layout]",
+    ]
+    for key in ("pagesize", "oobsize", "pages_per_block", "ecc_protected_data", "user_data", "ecc"):
+        lines.append(f"{key} = {layout[key]}")
+    lines.append("ecc_algorithm = 'detected_bch'")
+    for key in ("left_shift_ecc_buf", "ecc_protected_data_reverse", "ecc_protected_data_invert", "ecc_reverse", "ecc_invert"):
+        value = layout[key]
+        lines.append(f"{key} = {str(value).lower() if isinstance(value, bool) else value}")
+    lines += ["", "[DATA]", "startblock = 0", "endblock = -1", "layout = 'detected_layout'", ""]
+    return "\n".join(lines)
+
+
+def print_results(results, top=10):
+    print(f"{'score':>7} {'chunks':>7} {'flips/chunk':>11}  candidate")
+    for result in results[:top]:
+        score = "-" if result["score"] is None else f"{result['score']:.3f}"
+        flips = "-" if result["flips_per_chunk"] is None else f"{result['flips_per_chunk']:.2f}"
+        print(f"{score:>7} {result['chunks']:>7} {flips:>11}  {result['name']} ({result['source']})")
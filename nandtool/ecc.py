@@ -0,0 +1,432 @@
+import logging
+from time import perf_counter
+
+import bchlib
+import numpy as np
+
+from nandtool.config import ECC_PARAMETERS
+
+LOGGER = logging.getLogger(__name__)
+
+# parity of every byte value
+PARITY = np.array([bin(i).count("1") & 1 for i in range(256)], dtype="u1")
+
+# primitive polynomials of GF(2^m) per symbol size m, the default of Reed-Solomon codes
+PRIMITIVE_POLYS = {
+    3: 0xB,
+    4: 0x13,
+    5: 0x25,
+    6: 0x43,
+    7: 0x89,
+    8: 0x11D,
+    9: 0x211,
+    10: 0x409,
+    11: 0x805,
+    12: 0x1053,
+    13: 0x201B,
+    14: 0x4443,
+    15: 0x8003,
+    16: 0x1100B,
+}
+
+
+class ECCEngine:
+    """Error correcting code of the chunks of a layout, encoding and correcting batches of chunks.
+
+    The data and ecc are given as transformed by the layout, as arrays with shape (chunks, data length) and
+    (chunks, ecc length).
+
+    Attributes:
+        t (int): Number of errors the code corrects per chunk.
+        ecc_bytes (int): Number of ecc bytes per chunk.
+        ecc_bits (int): Number of ecc bits per chunk, the remaining bits of the last ecc byte are padding.
+    """
+
+    t = 0
+    ecc_bytes = 0
+    ecc_bits = 0
+
+    def encode(self, data):
+        """Calculate the ecc of a batch of chunks.
+
+        Returns:
+            np.ndarray: Ecc with shape (chunks, ecc_bytes).
+        """
+        raise NotImplementedError
+
+    def correct(self, data, ecc, stats=None):
+        """Correct a batch of chunks in place.
+
+        Args:
+            data (np.ndarray): Protected data of the chunks.
+            ecc (np.ndarray): Ecc of the chunks.
+            stats (Stats): Stage timers to add the decode and correct time to.
+
+        Returns:
+            np.ndarray: Number of bitflips per chunk, -1 if the chunk is uncorrectable.
+        """
+        raise NotImplementedError
+
+
+class BCHEngine(ECCEngine):
+    """BCH code of bchlib.
+
+    Every chunk is checked by the BCH decoder, which compares the calculated and the stored ecc in C, and only chunks
+    with a mismatch are corrected. Error-free chunks thus cost a single decode call.
+    """
+
+    def __init__(self, poly, t):
+        self.bch = bchlib.BCH(prim_poly=poly, t=t)
+        self.t = t
+        self.ecc_bytes = self.bch.ecc_bytes
+        self.ecc_bits = self.bch.ecc_bits
+
+    def encode(self, data):
+        length = data.shape[1]
+        raw_data = data.tobytes()
+        ecc = b"".join(self.bch.encode(raw_data[i * length : (i + 1) * length]) for i in range(len(data)))
+        return np.frombuffer(ecc, "u1").reshape(len(data), self.ecc_bytes).copy()
+
+    def correct(self, data, ecc, stats=None):
+        decode_start = perf_counter()
+        correct_seconds = 0.0
+        data_length = data.shape[1]
+        ecc_length = ecc.shape[1]
+        raw_data = data.tobytes()
+        raw_ecc = ecc.tobytes()
+        decode = self.bch.decode
+        flips = np.zeros(len(data), dtype=np.int64)
+        corrected = 0
+        for i in range(len(data)):
+            chunk_data = raw_data[i * data_length : (i + 1) * data_length]
+            chunk_ecc = raw_ecc[i * ecc_length : (i + 1) * ecc_length]
+            chunk_flips = decode(chunk_data, chunk_ecc)
+            if chunk_flips > 0:
+                LOGGER.debug(f"Detected {chunk_flips} flips")
+                correct_start = perf_counter()
+                chunk_data = bytearray(chunk_data)
+                chunk_ecc = bytearray(chunk_ecc)
+                self.bch.correct(chunk_data, chunk_ecc)
+                data[i] = np.frombuffer(chunk_data, "u1")
+                ecc[i] = np.frombuffer(chunk_ecc, "u1")
+                corrected += 1
+                correct_seconds += perf_counter() - correct_start
+            flips[i] = chunk_flips
+        if stats is not None:
+            stats.add_time("decode", perf_counter() - decode_start - correct_seconds, calls=len(data))
+            if corrected:
+                stats.add_time("correct", correct_seconds, calls=corrected)
+        return flips
+
+
+class HammingEngine(ECCEngine):
+    """Hamming code of SmartMedia and the Linux software nand_ecc, 3 ecc bytes correct a single bitflip in a chunk.
+
+    The ecc holds the inverted parities of the halves of the chunk selected by every bit of the byte address (line
+    parities rp0 to rp15, or rp17 for 512 byte chunks) and of the bit number within the bytes (column parities cp0 to
+    cp5). An erased chunk has an erased ecc. A single bitflip in the data flips exactly one parity of every pair,
+    those of the odd halves give its address. A single flip in the ecc is corrected as well.
+
+    Args:
+        step (int): Size of a chunk, 256 or 512 bytes.
+        byte_order (str): "linux" for the ecc byte order of Linux, "smartmedia" for the SmartMedia order, which has
+            the first two ecc bytes swapped.
+    """
+
+    t = 1
+    ecc_bytes = 3
+    ecc_bits = 24
+
+    def __init__(self, step=256, byte_order="linux"):
+        if step not in (256, 512):
+            raise ValueError("Hamming ecc is calculated over 256 or 512 bytes")
+        self.step = step
+        self.address_bits = step.bit_length() - 1
+        # ecc bit (byte * 8 + bit) of every parity: rp0 to rp15 in the first two bytes, cp0 to cp5 in bits 2 to 7
+        # of the third byte, and rp16 and rp17 or two set bits in its bits 0 and 1
+        line = np.arange(16)
+        if byte_order == "linux":
+            line ^= 8
+        self.positions = np.concatenate((line, np.arange(16, 2 * self.address_bits), 18 + np.arange(6)))
+        self.fixed = 16 + np.arange(2 * self.address_bits - 16, 2)
+
+    def parities(self, data):
+        """Inverted line and column parities of every chunk, with shape (chunks, 2 * address bits + 6)."""
+        if data.shape[1] != self.step:
+            raise ValueError(f"Hamming ecc is calculated over {self.step} bytes, not {data.shape[1]}")
+        parities = np.empty((len(data), 2 * self.address_bits + 6), dtype="u1")
+        total = np.bitwise_xor.reduce(data, axis=1)
+        for bit in range(self.address_bits):
+            # bytes with this address bit set
+            odd = data.reshape(len(data), -1, 2, 1 << bit)[:, :, 1]
+            parities[:, 2 * bit + 1] = PARITY[np.bitwise_xor.reduce(odd, axis=(1, 2))]
+        # bits with this bit number bit clear and set
+        for bit, (clear, set_) in enumerate(((0x55, 0xAA), (0x33, 0xCC), (0x0F, 0xF0))):
+            parities[:, 2 * self.address_bits + 2 * bit] = PARITY[total & clear]
+            parities[:, 2 * self.address_bits + 2 * bit + 1] = PARITY[total & set_]
+        parities[:, : 2 * self.address_bits : 2] = PARITY[total][:, None] ^ parities[:, 1 : 2 * self.address_bits : 2]
+        return parities ^ 1
+
+    def pack(self, parities):
+        bits = np.zeros((len(parities), 24), dtype="u1")
+        bits[:, self.positions] = parities
+        bits[:, self.fixed] = 1
+        return np.packbits(bits.reshape(-1, 3, 8), axis=2, bitorder="little").reshape(-1, 3)
+
+    def encode(self, data):
+        return self.pack(self.parities(data))
+
+    def correct(self, data, ecc, stats=None):
+        start = perf_counter()
+        bits = np.unpackbits(ecc[:, :3, None], axis=2, bitorder="little").reshape(-1, 24)
+        syndrome = self.parities(data) ^ bits[:, self.positions]
+        fixed_errors = (bits[:, self.fixed] ^ 1).sum(axis=1, dtype=np.int64)
+        errors = syndrome.sum(axis=1, dtype=np.int64) + fixed_errors
+        pairs = syndrome.reshape(len(data), -1, 2)
+        single = (pairs[:, :, 0] != pairs[:, :, 1]).all(axis=1) & (fixed_errors == 0)
+        flips = np.where(errors == 0, 0, np.where(single | (errors == 1), 1, -1))
+
+        rows = np.flatnonzero(single)
+        if len(rows):
+            weights = 1 << np.arange(self.address_bits + 3)
+            address = pairs[rows, :, 1].astype(np.int64) @ weights
+            byte, bit = address & (self.step - 1), address >> self.address_bits
+            data[rows, byte] ^= (1 << bit).astype("u1")
+        rows = np.flatnonzero(errors == 1)
+        if len(rows):
+            ecc[rows, :3] = self.encode(data[rows])
+        if stats is not None:
+            stats.add_time("decode", perf_counter() - start, calls=len(data))
+        return flips
+
+
+class RSEngine(ECCEngine):
+    """Reed-Solomon code over GF(2^symbol_size) with nsym parity symbols, corrects nsym // 2 symbols per chunk.
+
+    The protected data is read as a big-endian bit string, padded with zero bits at the start to whole symbols, and
+    the parity symbols are stored the same way at the start of the ecc. The codeword has its first symbol as the
+    coefficient of the highest power and the generator polynomial has the roots alpha^fcr to alpha^(fcr + nsym - 1).
+    Encoding and the syndromes are calculated for the whole batch at once, errors are only located in the chunks
+    with a non-zero syndrome.
+
+    Args:
+        nsym (int): Number of parity symbols.
+        symbol_size (int): Bits per symbol.
+        prim (int): Primitive polynomial of the field, None for the default of the symbol size.
+        fcr (int): Exponent of the first consecutive root of the generator polynomial.
+    """
+
+    def __init__(self, nsym, symbol_size=8, prim=None, fcr=0):
+        self.nsym = nsym
+        self.m = symbol_size
+        self.fcr = fcr
+        self.t = nsym // 2
+        self.ecc_bits = nsym * symbol_size
+        self.ecc_bytes = -(-self.ecc_bits // 8)
+
+        size = 1 << symbol_size
+        prim = prim or PRIMITIVE_POLYS[symbol_size]
+        self.order = size - 1
+        self.exp = np.zeros(2 * self.order, dtype=np.int64)
+        self.log = np.zeros(size, dtype=np.int64)
+        value = 1
+        for i in range(self.order):
+            if i and value == 1:
+                raise ValueError(f"{prim} is not a primitive polynomial of GF(2^{symbol_size})")
+            self.exp[i] = value
+            self.log[value] = i
+            value <<= 1
+            if value & size:
+                value ^= prim
+        self.exp[self.order :] = self.exp[: self.order]
+
+        generator = [1]
+        for j in range(nsym):
+            root = int(self.exp[(fcr + j) % self.order])
+            generator = [a ^ self.mul(b, root) for a, b in zip(generator + [0], [0] + generator)]
+        # products of every symbol with the generator coefficients and with the roots of the generator
+        self.generator_table = self.mul_table(generator[1:])
+        self.root_table = self.mul_table([int(self.exp[(fcr + j) % self.order]) for j in range(nsym)])
+
+    def mul(self, a, b):
+        if a == 0 or b == 0:
+            return 0
+        return int(self.exp[self.log[a] + self.log[b]])
+
+    def div(self, a, b):
+        if a == 0:
+            return 0
+        return int(self.exp[(self.log[a] - self.log[b]) % self.order])
+
+    def mul_table(self, factors):
+        """Products of all symbols with every factor, with shape (factors, 2^m)."""
+        logs = self.log[np.arange(1, self.order + 1)]
+        table = np.zeros((len(factors), self.order + 1), dtype=np.int64)
+        for i, factor in enumerate(factors):
+            if factor:
+                table[i, 1:] = self.exp[logs + self.log[factor]]
+        return table
+
+    def to_symbols(self, array, count, pad_start):
+        """Split the bytes of every row into count symbols, padding or truncating the bit string at its start or end."""
+        bits = np.unpackbits(array, axis=1)
+        pad = count * self.m - bits.shape[1]
+        if pad > 0:
+            padding = np.zeros((len(bits), pad), dtype="u1")
+            bits = np.concatenate((padding, bits) if pad_start else (bits, padding), axis=1)
+        elif pad < 0:
+            bits = bits[:, :pad] if not pad_start else bits[:, -pad:]
+        weights = 1 << np.arange(self.m - 1, -1, -1)
+        return bits.reshape(len(bits), count, self.m).astype(np.int64) @ weights
+
+    def from_symbols(self, symbols, nbytes, pad_start):
+        """Join the symbols of every row into nbytes bytes, the inverse of to_symbols."""
+        bits = ((symbols[:, :, None] >> np.arange(self.m - 1, -1, -1)) & 1).astype("u1").reshape(len(symbols), -1)
+        pad = nbytes * 8 - bits.shape[1]
+        if pad > 0:
+            bits = np.concatenate((bits, np.zeros((len(bits), pad), dtype="u1")), axis=1)
+        elif pad < 0:
+            bits = bits[:, -pad:] if pad_start else bits[:, :pad]
+        return np.packbits(bits, axis=1)
+
+    def data_symbols(self, length):
+        count = -(-length * 8 // self.m)
+        if count + self.nsym > self.order:
+            raise ValueError(f"Chunks of {length} bytes do not fit a codeword of {self.order} symbols")
+        return count
+
+    def parity(self, symbols):
+        """Parity symbols of a batch of data symbols, the remainder of the division by the generator polynomial."""
+        remainder = np.zeros((len(symbols), self.nsym), dtype=np.int64)
+        rows = np.arange(self.nsym)
+        for i in range(symbols.shape[1]):
+            feedback = symbols[:, i] ^ remainder[:, 0]
+            remainder[:, :-1] = remainder[:, 1:]
+            remainder[:, -1] = 0
+            remainder ^= self.generator_table[rows, feedback[:, None]]
+        return remainder
+
+    def syndromes(self, codewords):
+        """Codewords evaluated at the roots of the generator polynomial, with shape (chunks, nsym)."""
+        syndromes = np.zeros((len(codewords), self.nsym), dtype=np.int64)
+        rows = np.arange(self.nsym)
+        for i in range(codewords.shape[1]):
+            syndromes = self.root_table[rows, syndromes] ^ codewords[:, i : i + 1]
+        return syndromes
+
+    def encode(self, data):
+        symbols = self.to_symbols(data, self.data_symbols(data.shape[1]), pad_start=True)
+        return self.from_symbols(self.parity(symbols), self.ecc_bytes, pad_start=False)
+
+    def correct(self, data, ecc, stats=None):
+        decode_start = perf_counter()
+        count = self.data_symbols(data.shape[1])
+        codewords = np.concatenate(
+            (self.to_symbols(data, count, pad_start=True), self.to_symbols(ecc, self.nsym, pad_start=False)), axis=1
+        )
+        syndromes = self.syndromes(codewords)
+        rows = np.flatnonzero(syndromes.any(axis=1))
+        flips = np.zeros(len(data), dtype=np.int64)
+        if stats is not None:
+            stats.add_time("decode", perf_counter() - decode_start, calls=len(data))
+        if not len(rows):
+            return flips
+
+        correct_start = perf_counter()
+        corrected = codewords[rows]
+        failed = np.array([not self.correct_codeword(corrected[i], syndromes[row]) for i, row in enumerate(rows)])
+        # miscorrections that leave the codeword invalid or set the padding bits of the data
+        pad_bits = count * self.m - data.shape[1] * 8
+        failed |= self.syndromes(corrected).any(axis=1) | (corrected[:, 0] >> (self.m - pad_bits) != 0)
+        good = rows[~failed]
+        flips[rows[failed]] = -1
+        if len(good):
+            changed = corrected[~failed] ^ codewords[good]
+            flips[good] = sum((changed >> bit) & 1 for bit in range(self.m)).sum(axis=1)
+            data[good] = self.from_symbols(corrected[~failed, :count], data.shape[1], pad_start=True)
+            # the padding bits at the end of the ecc are kept
+            padding = np.uint8((1 << (self.ecc_bytes * 8 - self.ecc_bits)) - 1)
+            new_ecc = self.from_symbols(corrected[~failed, count:], self.ecc_bytes, pad_start=False)
+            new_ecc[:, -1] |= ecc[good, self.ecc_bytes - 1] & padding
+            ecc[good, : self.ecc_bytes] = new_ecc
+            LOGGER.debug(f"Corrected {int(flips[good].sum())} flips in {len(good)} chunks")
+        if stats is not None:
+            stats.add_time("correct", perf_counter() - correct_start, calls=len(rows))
+        return flips
+
+    def correct_codeword(self, codeword, syndromes):
+        """Locate and correct up to t symbol errors of a single codeword in place.
+
+        The error locator is found by Berlekamp-Massey, its roots by a Chien search over all positions at once and
+        the error values by the Forney algorithm.
+
+        Returns:
+            bool: Whether the errors could be located.
+        """
+        syndromes = [int(s) for s in syndromes]
+        locator, previous, shift, last = [1], [1], 1, 1
+        errors = 0
+        for n in range(self.nsym):
+            discrepancy = syndromes[n]
+            for i in range(1, min(errors, len(locator) - 1) + 1):
+                discrepancy ^= self.mul(locator[i], syndromes[n - i])
+            if discrepancy == 0:
+                shift += 1
+                continue
+            factor = self.div(discrepancy, last)
+            update = locator + [0] * max(0, len(previous) + shift - len(locator))
+            for i, coefficient in enumerate(previous):
+                update[i + shift] ^= self.mul(factor, coefficient)
+            if 2 * errors <= n:
+                previous, last, errors, shift = locator, discrepancy, n + 1 - errors, 1
+            else:
+                shift += 1
+            locator = update
+        locator = (locator + [0] * errors)[: errors + 1]
+        if errors == 0 or 2 * errors > self.nsym or locator[errors] == 0:
+            return False
+
+        # codeword position i has the power n - 1 - i, its error is at a root alpha^-(n - 1 - i) of the locator
+        n = len(codeword)
+        powers = np.arange(n - 1, -1, -1)
+        values = np.zeros(n, dtype=np.int64)
+        for k, coefficient in enumerate(locator):
+            if coefficient:
+                values ^= self.exp[(self.log[coefficient] - k * powers) % self.order]
+        positions = np.flatnonzero(values == 0)
+        if len(positions) != errors:
+            return False
+
+        evaluator = [0] * self.nsym
+        for i, s in enumerate(syndromes):
+            for k, coefficient in enumerate(locator[: self.nsym - i]):
+                evaluator[i + k] ^= self.mul(s, coefficient)
+        for position in positions:
+            power = int(powers[position])
+            inverse = int(self.exp[(-power) % self.order])
+            numerator = denominator = 0
+            x = 1
+            for coefficient in evaluator:
+                numerator ^= self.mul(coefficient, x)
+                x = self.mul(x, inverse)
+            # formal derivative of the locator, only odd powers remain
+            x = 1
+            for k in range(1, len(locator), 2):
+                denominator ^= self.mul(locator[k], x)
+                x = self.mul(x, self.mul(inverse, inverse))
+            if denominator == 0:
+                return False
+            scale = int(self.exp[(power * (1 - self.fcr)) % self.order])
+            codeword[position] ^= self.mul(scale, self.div(numerator, denominator))
+        return True
+
+
+# engine class of every type of ecc algorithm
+ENGINES = {"bch": BCHEngine, "hamming": HammingEngine, "rs": RSEngine}
+
+
+def build_engine(ecc_algorithm):
+    """Build the ecc engine of an ecc algorithm section, of the bch type if it has no type."""
+    kind = ecc_algorithm.get("type", "bch")
+    parameters = {**ECC_PARAMETERS[kind], **{key: value for key, value in ecc_algorithm.items() if key != "type"}}
+    return ENGINES[kind](**parameters)
@@ -0,0 +1,114 @@
+import logging
+
+import numpy as np
+
+LOGGER = logging.getLogger(__name__)
+
+# transaction appended to the user data of every page of a partition with an etfs layout
+TRANSACTION_DTYPE = np.dtype(
+    [("fid", "<u4"), ("cluster", "<u4"), ("nclusters", "<u2"), ("tacode", "u1"), ("dacode", "u1"), ("sequence", "<u4")]
+)
+
+# fid of erased pages
+ERASED_FID = 0xFFFF
+
+
+def read_transactions(nand):
+    """Read the transaction of every page of a partition from the corrected etfs fields, in a single pass.
+
+    Built partitions are read from the corrected buffer, other partitions are corrected batch by batch through the
+    page cache, see NAND.iter_cached_batches.
+
+    Returns:
+        np.ndarray: Transactions with dtype TRANSACTION_DTYPE, erased pages have fid ERASED_FID.
+    """
+    size = TRANSACTION_DTYPE.itemsize
+    transactions = np.zeros(nand.num_pages, dtype=TRANSACTION_DTYPE)
+    transactions["fid"] = ERASED_FID
+    corrected = nand.corrected
+    if corrected is not None:
+        # stored pages are kept in page order in the compact buffer
+        tails = np.frombuffer(corrected.data, "u1").reshape(-1, corrected.pagesize)[:, -size:]
+        transactions[corrected.slots >= 0] = np.ascontiguousarray(tails).view(TRANSACTION_DTYPE)[:, 0]
+        return transactions
+
+    LOGGER.info("Correcting the partition to index the etfs transactions")
+    for first, pages, _ in nand.iter_cached_batches():
+        tails = nand.userdata(pages)[:, -size:]
+        transactions[first : first + len(pages)] = np.ascontiguousarray(tails).view(TRANSACTION_DTYPE)[:, 0]
+    return transactions
+
+
+class ETFSIndex:
+    """Index of the latest version of every cluster of every file in an ETFS partition.
+
+    Clusters are rewritten with a higher sequence number, so only the page with the highest sequence number of every
+    (fid, cluster) is kept. Per file the page of every cluster is held in an array indexed by cluster, which resolves
+    a cluster in O(1). Erased, bad and uncorrectable pages are left out.
+
+    The names and sizes of the files are kept in the ETFS file table, which is not parsed. Files are identified by
+    their fid and span up to their last cluster.
+
+    Args:
+        nand (NAND): Partition with an etfs layout.
+    """
+
+    def __init__(self, nand):
+        self.nand = nand
+        self.clustersize = nand.corrected_pagesize - TRANSACTION_DTYPE.itemsize
+        transactions = read_transactions(nand)
+
+        # clusters beyond the number of pages can only come from corrupt transactions
+        valid = (
+            (transactions["fid"] != ERASED_FID)
+            & (transactions["cluster"] < nand.num_pages)
+            & ~nand.status["uncorrectable"]
+            & ~nand.status["bad_block"]
+        )
+        pages = np.flatnonzero(valid)
+        fids = transactions["fid"][pages]
+        clusters = transactions["cluster"][pages]
+        # sort by fid, cluster and sequence, the last page of every (fid, cluster) is the latest
+        order = np.lexsort((transactions["sequence"][pages], clusters, fids))
+        pages, fids, clusters = pages[order], fids[order], clusters[order]
+        latest = np.ones(len(pages), dtype=bool)
+        latest[:-1] = (fids[1:] != fids[:-1]) | (clusters[1:] != clusters[:-1])
+        pages, fids, clusters = pages[latest], fids[latest], clusters[latest]
+
+        self.files = dict()
+        first = np.ones(len(fids), dtype=bool)
+        first[1:] = fids[1:] != fids[:-1]
+        starts = np.flatnonzero(first)
+        for start, end in zip(starts, np.r_[starts[1:], len(fids)]):
+            file_pages = np.full(int(clusters[end - 1]) + 1, -1, dtype=np.int64)
+            file_pages[clusters[start:end]] = pages[start:end]
+            self.files[int(fids[start])] = file_pages
+        LOGGER.info(f"Indexed {len(pages)} clusters of {len(self.files)} etfs files")
+
+    def file_size(self, fid):
+        return len(self.files[fid]) * self.clustersize
+
+    def read(self, fid, offset, size):
+        """Read from a file, clusters that are not found read as zeros.
+
+        Args:
+            fid (int): File id.
+            offset (int): Offset in the file.
+            size (int): Number of bytes to read.
+
+        Returns:
+            bytes: File data.
+        """
+        file_pages = self.files[fid]
+        end = min(offset + size, len(file_pages) * self.clustersize)
+        if offset >= end:
+            return b""
+        first = offset // self.clustersize
+        last = (end - 1) // self.clustersize
+        empty = bytes(self.clustersize)
+        data = b"".join(
+            empty if page < 0 else self.nand.read(page * self.nand.corrected_pagesize, self.clustersize)
+            for page in file_pages[first : last + 1].tolist()
+        )
+        skip = offset - first * self.clustersize
+        return data[skip : skip + end - offset]
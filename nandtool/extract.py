@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+from nandtool.config import ConfigError, load_config
+from nandtool.nand import NAND, erased_runs
+from nandtool.parallel import iter_corrected_parallel
+from nandtool.source import open_image
+from nandtool.stats import Stats, build_report, write_report
+
+LOGGER = logging.getLogger(__name__)
+
+WRITE_BUFFER_SIZE = 16 * 1024**2
+
+# value the holes left for erased pages by sparse extraction read as, erased pages are 0xff
+SPARSE_FILL = 0x00
+
+
+def extract_partition(nand, output_path, jobs=1, image_path=None, sparse=False):
+    """Stream the corrected user data of a partition to a file, one batch of pages at a time.
+
+    Args:
+        nand (NAND): Partition to extract.
+        output_path (Path): Path of the output file.
+        jobs (int): Number of worker processes used for ecc correction.
+        image_path (Path): Path to the image, needed by the worker processes when jobs > 1.
+        sparse (bool): Leave holes for erased pages, which read as zeros instead of 0xff, and list them with the
+            fill value of the holes in <output>.erased.json.
+
+    The uncorrectable policy of the partition is applied to every batch, and the status of all pages is saved in
+    <output>.status (NumPy .npy format).
+
+    Raises:
+        ValueError: If a page is uncorrectable and the uncorrectable policy is abort.
+    """
+    if jobs > 1 and nand.has_ecc:
+        batches = iter_corrected_parallel(nand, image_path, jobs, progress=True)
+    else:
+        batches = nand.iter_corrected(progress=True)
+
+    extents = []
+    position = 0
+    with open(output_path, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+        for data in batches:
+            pages = nand.apply_policy(position, np.frombuffer(data, "u1").reshape(-1, nand.corrected_pagesize))
+            written = 0
+            if sparse:
+                erased = (pages == nand.layout.erased_userdata).all(axis=1)
+                for first, last in erased_runs(erased):
+                    f.write(pages[written:first])
+                    f.seek((last - first) * nand.corrected_pagesize, os.SEEK_CUR)
+                    extents.append(((position + first) * nand.corrected_pagesize, (position + last) * nand.corrected_pagesize))
+                    written = last
+            f.write(pages[written:])
+            position += len(pages)
+        # a trailing hole is only part of the file once the size is set
+        f.truncate(f.tell())
+    if nand.has_ecc:
+        save_status(nand, output_path)
+        nand.log_uncorrectable()
+
+    if sparse:
+        extents = merge_extents(extents)
+        erased_path = Path(f"{output_path}.erased.json")
+        erased_path.write_text(
+            json.dumps(
+                {"pagesize": nand.corrected_pagesize, "fill": SPARSE_FILL, "extents": extents}, indent=1
+            )
+        )
+        LOGGER.info(f"Left {len(extents)} holes for erased pages, listed in {erased_path}")
+        if extents:
+            LOGGER.warning(
+                f"Erased pages of {output_path} read as 0x{SPARSE_FILL:02x} instead of 0xff, extract without "
+                f"--sparse if the exact bytes matter"
+            )
+
+
+def save_status(nand, output_path):
+    """Save the status of all pages of a partition in <output>.status (NumPy .npy format)."""
+    with open(f"{output_path}.status", "wb") as f:
+        np.save(f, nand.status)
+
+
+def merge_extents(extents):
+    """Merge adjacent (start, end) extents, e.g. runs of erased pages split over batches."""
+    merged = []
+    for start, end in extents:
+        if merged and merged[-1][1] == start:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def extract(
+    image,
+    output_dir,
+    conf,
+    partitions=None,
+    jobs=1,
+    stats_report=None,
+    sparse=False,
+    interleave=None,
+    rereads=None,
+    policy=None,
+):
+    images = image if isinstance(image, (list, tuple)) else [image]
+    rereads = rereads or []
+    for path in images + [path for paths in rereads for path in paths]:
+        if not path.exists():
+            LOGGER.warning(f"Image file {path} not found, exiting.")
+            return -1
+
+    if not output_dir.is_dir():
+        LOGGER.warning(f"Output directory {output_dir} not found, exiting.")
+        return -2
+
+    if not conf.exists():
+        LOGGER.warning(f"Configuration file {conf} not found, exiting.")
+        return -3
+
+    image = ", ".join(str(path) for path in images)
+    LOGGER.info(f"Extracting corrected image {image} to {output_dir} with configuration {conf}")
+    try:
+        conf = load_config(conf)
+        source = open_image(images, conf, interleave)
+        rereads = [open_image(paths, conf, interleave, size=len(source)) for paths in rereads]
+    except ConfigError as e:
+        LOGGER.warning(f"Invalid configuration: {e}, exiting.")
+        return -5
+    partitions = partitions or conf.partitions
+    unknown = [partition for partition in partitions if partition not in conf.partitions]
+    if unknown:
+        for data in [source] + rereads:
+            data.close()
+        LOGGER.warning(f"Partitions {', '.join(unknown)} not in configuration, exiting.")
+        return -4
+
+    extracted = dict()
+    try:
+        for partition in partitions:
+            LOGGER.info(f"Start extracting partition: {partition}")
+            nand = NAND(
+                source,
+                conf[partition],
+                stats=Stats() if stats_report is not None else None,
+                rereads=rereads,
+                policy=policy,
+            )
+            extract_partition(nand, output_dir / partition, jobs=jobs, image_path=source, sparse=sparse)
+            extracted[partition] = nand
+            LOGGER.info(f"Corrected {nand.corrected_bits} bits")
+            LOGGER.info(f"Done extracting partition {partition} to {output_dir / partition}")
+
+        if stats_report is not None:
+            write_report(stats_report, build_report(extracted, image=image))
+            LOGGER.info(f"Wrote statistics to {stats_report}")
+    finally:
+        for data in [source] + rereads:
+            data.close()
@@ -3,7 +3,6 @@ import sys
 from socket import gethostname
 from getpass import getuser
 from pathlib import Path
-import subprocess
 
 FORMATTER = logging.Formatter("%(asctime)s — %(module)s — %(levelname)s — %(message)s")
 
@@ -33,9 +32,34 @@ def get_console_handler():
 
 
 def get_git_revision_hash(git_dir):
+    """Commit hash of the git repository containing git_dir, read from the .git directory instead of running git."""
     try:
-        output = subprocess.check_output(['git', '-C', str(git_dir), 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL)
-        return output.decode('utf8').rstrip()
-    except subprocess.CalledProcessError:
+        for directory in (Path(git_dir).resolve(), *Path(git_dir).resolve().parents):
+            dot_git = directory / '.git'
+            if dot_git.is_file():
+                # worktrees and submodules point to their git directory
+                dot_git = (directory / dot_git.read_text().split(':', 1)[1].strip()).resolve()
+            if dot_git.is_dir():
+                return read_head(dot_git)
+    except (OSError, IndexError):
         pass
     return None
+
+
+def read_head(git_dir):
+    head = (git_dir / 'HEAD').read_text().strip()
+    if not head.startswith('ref:'):
+        # detached head
+        return head
+    ref = head[4:].strip()
+    common_dir = git_dir
+    if (git_dir / 'commondir').is_file():
+        common_dir = (git_dir / (git_dir / 'commondir').read_text().strip()).resolve()
+    for directory in (git_dir, common_dir):
+        if (directory / ref).is_file():
+            return (directory / ref).read_text().strip()
+    if (common_dir / 'packed-refs').is_file():
+        for line in (common_dir / 'packed-refs').read_text().splitlines():
+            if line.endswith(f' {ref}'):
+                return line.split()[0]
+    return None
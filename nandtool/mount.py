@@ -1,43 +1,220 @@
+import ctypes
+import errno
+import io
+import json
 import logging
-import mmap
 import os
 import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from time import time
+from time import perf_counter, time
 
-from fuse import FUSE, Operations
+import numpy as np
+from fuse import FUSE, FuseOSError, Operations
 
-from nandtool.config import load_config
-from nandtool.nand import build_partitions
+from nandtool.config import ConfigError, load_config
+from nandtool.etfs import ETFSIndex
+from nandtool.nand import DEFAULT_CACHE_SIZE, PageCache, build_partitions
+from nandtool.source import open_image
+from nandtool.stats import Stats, build_report, write_report
 
 LOGGER = logging.getLogger(__name__)
 
+DEFAULT_READAHEAD = 64
+
+# virtual file with the live statistics of the mount
+STATS_FILE = ".stats"
+
+# suffix of the directories with the files of the ETFS partitions
+ETFS_SUFFIX = ".files"
+
+# suffix of the virtual files with the page status of the partitions with ecc
+STATUS_SUFFIX = ".status"
+
+# suffixes of the virtual files with the full corrected pages and with only their spare area
+PAGES_SUFFIX = ".pages"
+OOB_SUFFIX = ".oob"
+
 
 class FuseNAND(Operations):
     """Fuse implementation of the ETFS file system.
 
     Args:
-        image (Path): Path to the image.
-        offset (int): Start of the ETFS partition in the image.
+        source (ImageSource): Image, one or more opened image files.
+        mountpoint (Path): Path to the mount point.
+        conf: Loaded configuration.
+        lazy (bool): Correct pages on demand when they are read instead of building the partitions up front.
+        cache_size (int): Maximum size in bytes of the corrected page cache, used in lazy mode and by the page files
+            of partitions loaded from the disk cache.
+        jobs (int): Number of worker processes used to correct the partitions.
+        disk_cache (CorrectionCache): On-disk cache of corrected partitions.
+        scratch_dir (Path): Directory for file backed buffers of the corrected partitions.
+        readahead (int): Number of pages to correct ahead in the background on sequential reads in lazy mode.
+        stats (bool): Collect counters and timers, served as JSON in the virtual file /.stats.
+        rereads (list): Other dumps of the same chip (ImageSource), uncorrectable chunks are recovered from them.
+        policy (str): Uncorrectable policy of all partitions, overriding the policy of their layouts.
+
+    The status of every page of a partition with ecc is served in /<partition>.status (NumPy .npy format). The full
+    corrected pages of every partition, spare area included, are served in /<partition>.pages and their spare areas
+    in /<partition>.oob, corrected on demand through the page cache unless the partition is built. The files of
+    every partition with an etfs layout are shown in the directory /<partition>.files, named by fid.
     """
 
-    def __init__(self, image_path, mountpoint, conf):
+    def __init__(
+        self,
+        source,
+        mountpoint,
+        conf,
+        lazy=False,
+        cache_size=DEFAULT_CACHE_SIZE,
+        jobs=1,
+        disk_cache=None,
+        scratch_dir=None,
+        readahead=DEFAULT_READAHEAD,
+        stats=False,
+        rereads=(),
+        policy=None,
+    ):
         self.mountpoint = Path(mountpoint)
 
-        self.image_path = image_path
-        self.f = open(self.image_path, "rb")
-        self.mm = mmap.mmap(
-            self.f.fileno(),
-            0,
-            access=mmap.ACCESS_READ,
+        self.source = source
+        self.rereads = list(rereads)
+
+        # also serves the page files of partitions loaded from the disk cache
+        self.cache = PageCache(cache_size)
+        self.partitions = build_partitions(
+            self.source,
+            conf,
+            lazy=lazy,
+            cache=self.cache,
+            jobs=jobs,
+            image_path=self.source,
+            disk_cache=disk_cache,
+            scratch_dir=scratch_dir,
+            stats=stats,
+            rereads=self.rereads,
+            policy=policy,
+        )
+        self.stats = Stats() if stats else None
+        self.stats_snapshot = b""
+        self.status_files = {
+            f"{name}{STATUS_SUFFIX}": name for name, partition in self.partitions.items() if partition.has_ecc
+        }
+        self.status_snapshots = dict()
+        # page files and their partition, with whether they hold only the spare area
+        self.page_files = {f"{name}{PAGES_SUFFIX}": (name, False) for name in self.partitions}
+        self.page_files.update(
+            {
+                f"{name}{OOB_SUFFIX}": (name, True)
+                for name, partition in self.partitions.items()
+                if partition.layout.oobsize
+            }
         )
 
-        self.partitions = build_partitions(self.mm, conf)
+        # sequential read detection per partition: expected offset of the next read and end of the readahead
+        self.readahead = readahead if lazy else 0
+        self.sequential = dict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="readahead")
+
+        # ETFS directories and the partition they show, indexed on first access
+        self.etfs = {
+            f"{name}{ETFS_SUFFIX}": name for name, partition in self.partitions.items() if partition.layout.etfs_layout
+        }
+        self.etfs_indexes = dict()
+        self.etfs_lock = threading.Lock()
         LOGGER.info(f"NAND chip is now mounted at {mountpoint}")
 
     def close(self):
-        self.mm.close()
-        self.f.close()
+        self.executor.shutdown(wait=True)
+        for source in [self.source] + self.rereads:
+            source.close()
+
+    def schedule_readahead(self, name, partition, offset, size, pagesize):
+        """Correct the next pages in the background when a file of a partition is read sequentially.
+
+        Args:
+            name (str): Name of the file, sequential reads are detected per file.
+            partition (NAND): Partition the file shows.
+            offset (int): Offset of the read in the file.
+            size (int): Number of bytes read.
+            pagesize (int): Number of bytes of every page in the file.
+        """
+        with self.lock:
+            expected, readahead_end = self.sequential.get(name, (None, 0))
+            self.sequential[name] = (offset + size, readahead_end)
+            if offset != expected:
+                return
+
+            # only schedule when less than half of the readahead window is left
+            next_page = (offset + size) // pagesize
+            if readahead_end - next_page > self.readahead // 2:
+                return
+            first = max(next_page, readahead_end)
+            last = next_page + self.readahead
+            self.sequential[name] = (offset + size, last)
+        self.executor.submit(self.prefetch, partition, first, last)
+
+    @staticmethod
+    def prefetch(partition, first, last):
+        try:
+            partition.cache_pages(first, last)
+        except Exception as e:
+            LOGGER.debug(f"Readahead of pages {first} to {last} failed: {e}")
+
+    def stats_report(self):
+        """Report of the partitions, the FUSE reads and the page cache."""
+        mount_report = self.stats.report()
+        hits = sum(nand.stats.counters.get("cache_hits", 0) for nand in self.partitions.values())
+        misses = sum(nand.stats.counters.get("cache_misses", 0) for nand in self.partitions.values())
+        mount_report["cache"] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+            "size": self.cache.size,
+        }
+        return build_report(self.partitions, image=str(self.source), fuse=mount_report)
+
+    def etfs_index(self, directory):
+        """Index of the ETFS partition shown in a directory, built on first use."""
+        with self.etfs_lock:
+            if directory not in self.etfs_indexes:
+                self.etfs_indexes[directory] = ETFSIndex(self.partitions[self.etfs[directory]])
+            return self.etfs_indexes[directory]
+
+    def etfs_file(self, path):
+        """Index and fid of a file in an ETFS directory, or None if the path is not such a file."""
+        if path.parent.parent != Path("/") or path.parent.name not in self.etfs or not path.name.isdigit():
+            return None
+        index = self.etfs_index(path.parent.name)
+        if int(path.name) not in index.files:
+            return None
+        return index, int(path.name)
+
+    @staticmethod
+    def node_stat(mode, size):
+        return {
+            "st_mode": mode,
+            "st_nlink": 2,
+            "st_size": size,
+            "st_atime": time(),
+            "st_ctime": time(),
+            "st_mtime": time(),
+            "st_gid": 0,
+            "st_uid": 0,
+        }
+
+    def refresh_stats(self):
+        self.stats_snapshot = json.dumps(self.stats_report(), indent=1).encode()
+        return self.stats_snapshot
+
+    def refresh_status(self, name):
+        """Snapshot of the page status of a partition, in lazy mode it grows as pages are corrected."""
+        f = io.BytesIO()
+        np.save(f, self.partitions[self.status_files[name]].status)
+        self.status_snapshots[name] = f.getvalue()
+        return self.status_snapshots[name]
 
     def getattr(self, path, fh=None):
         """Get directory with stat information.
@@ -57,18 +234,27 @@ class FuseNAND(Operations):
                 (key, getattr(st, key))
                 for key in ("st_atime", "st_ctime", "st_gid", "st_mode", "st_mtime", "st_nlink", "st_size", "st_uid")
             )
-        elif path.name in self.partitions:
-            part = self.partitions[path.name]
-            return {
-                "st_mode": 0o444 | stat.S_IFREG,
-                "st_nlink": 2,
-                "st_size": part.corrected_partition_size,
-                "st_atime": time(),
-                "st_ctime": time(),
-                "st_mtime": time(),
-                "st_gid": 0,
-                "st_uid": 0,
-            }
+        elif path.parent == Path("/") and (path.name in self.partitions or self.is_stats_file(path)):
+            if self.is_stats_file(path):
+                # the statistics are refreshed on every stat, so the size matches the content read after opening
+                size = len(self.refresh_stats())
+            else:
+                size = self.partitions[path.name].corrected_partition_size
+            return self.node_stat(0o444 | stat.S_IFREG, size)
+        elif path.parent == Path("/") and path.name in self.status_files:
+            # refreshed on every stat like the statistics
+            return self.node_stat(0o444 | stat.S_IFREG, len(self.refresh_status(path.name)))
+        elif path.parent == Path("/") and path.name in self.page_files:
+            name, oob = self.page_files[path.name]
+            partition = self.partitions[name]
+            pagesize = partition.layout.oobsize if oob else partition.raw_pagesize
+            return self.node_stat(0o444 | stat.S_IFREG, partition.num_pages * pagesize)
+        elif path.parent == Path("/") and path.name in self.etfs:
+            return self.node_stat(0o555 | stat.S_IFDIR, 0)
+        etfs_file = self.etfs_file(path)
+        if etfs_file is not None:
+            index, fid = etfs_file
+            return self.node_stat(0o444 | stat.S_IFREG, index.file_size(fid))
         return dict()
 
     def readdir(self, path, fh):
@@ -86,6 +272,17 @@ class FuseNAND(Operations):
         if path == Path("/"):
             for part in self.partitions:
                 yield part
+            yield from self.etfs
+            yield from self.status_files
+            yield from self.page_files
+            if self.stats is not None:
+                yield STATS_FILE
+        elif path.parent == Path("/") and path.name in self.etfs:
+            for fid in self.etfs_index(path.name).files:
+                yield str(fid)
+
+    def is_stats_file(self, path):
+        return self.stats is not None and path == Path("/") / STATS_FILE
 
     def read(self, path, size, offset, fh):
         """Read content from an object.
@@ -101,16 +298,95 @@ class FuseNAND(Operations):
         """
         LOGGER.debug(f"read({path}, {size}, {offset})")
         path = Path(path)
+        if self.is_stats_file(path):
+            return self.stats_snapshot[offset : offset + size]
+        if path.parent == Path("/") and path.name in self.status_files:
+            return self.status_snapshots.get(path.name, b"")[offset : offset + size]
         if path.parent == Path("/") and path.name in self.partitions:
+            start = perf_counter()
             partition = self.partitions[path.name]
-            return partition.corrected[offset : offset + size]
+            try:
+                data = partition.read(offset, size)
+            except ValueError as e:
+                LOGGER.error(f"Failed to read {path} at offset {offset}: {e}")
+                raise FuseOSError(errno.EIO)
+            if self.readahead and partition.corrected is None and partition.has_ecc:
+                self.schedule_readahead(path.name, partition, offset, len(data), partition.corrected_pagesize)
+            if self.stats is not None:
+                self.stats.add_time("read", perf_counter() - start, histogram=True)
+                self.stats.count("read_bytes", len(data))
+            return as_fuse_buffer(data)
+        if path.parent == Path("/") and path.name in self.page_files:
+            start = perf_counter()
+            name, oob = self.page_files[path.name]
+            partition = self.partitions[name]
+            try:
+                data = partition.read_pages(offset, size, oob=oob)
+            except ValueError as e:
+                LOGGER.error(f"Failed to read {path} at offset {offset}: {e}")
+                raise FuseOSError(errno.EIO)
+            if self.readahead and partition.has_ecc:
+                pagesize = partition.layout.oobsize if oob else partition.raw_pagesize
+                self.schedule_readahead(path.name, partition, offset, len(data), pagesize)
+            if self.stats is not None:
+                self.stats.add_time("read", perf_counter() - start, histogram=True)
+                self.stats.count("read_bytes", len(data))
+            return data
+        etfs_file = self.etfs_file(path)
+        if etfs_file is not None:
+            index, fid = etfs_file
+            try:
+                return index.read(fid, offset, size)
+            except ValueError as e:
+                LOGGER.error(f"Failed to read {path} at offset {offset}: {e}")
+                raise FuseOSError(errno.EIO)
         return b""
 
 
-def mount(image, mount_point, conf):
-    if not image.exists():
-        LOGGER.warning(f"Image file {image} not found, exiting.")
-        return -1
+def as_fuse_buffer(data):
+    """Make read results usable by fusepy without copying.
+
+    fusepy copies the result of read with ctypes.memmove, which does not accept memoryviews but does accept ctypes
+    arrays sharing the memory of a writable buffer.
+    """
+    if not isinstance(data, memoryview):
+        return data
+    if data.readonly:
+        return data.tobytes()
+    return (ctypes.c_char * len(data)).from_buffer(data)
+
+
+def mount(
+    image,
+    mount_point,
+    conf,
+    lazy=False,
+    cache_size=DEFAULT_CACHE_SIZE,
+    jobs=1,
+    disk_cache=None,
+    scratch_dir=None,
+    readahead=DEFAULT_READAHEAD,
+    threads=False,
+    stats=False,
+    stats_report=None,
+    interleave=None,
+    rereads=None,
+    policy=None,
+):
+    """Mount the corrected partitions of an image.
+
+    Args:
+        image: Path to the image, or a list of paths of image files that form the image, see ImageSource.
+        interleave (str): "block" or "page" to interleave the image files by, concatenated if None.
+        rereads (list): Paths of the image files of other dumps of the same chip, per dump a list like image.
+        policy (str): Uncorrectable policy of all partitions, the policy of their layouts if None.
+    """
+    images = image if isinstance(image, (list, tuple)) else [image]
+    rereads = rereads or []
+    for path in images + [path for paths in rereads for path in paths]:
+        if not path.exists():
+            LOGGER.warning(f"Image file {path} not found, exiting.")
+            return -1
 
     if not mount_point.exists():
         LOGGER.warning(f"Mount point {mount_point} not found, exiting.")
@@ -120,13 +396,36 @@ def mount(image, mount_point, conf):
         LOGGER.warning(f"Configuration file {conf} not found, exiting.")
         return -3
 
+    image = ", ".join(str(path) for path in images)
     LOGGER.info(f"Mounting corrected image {image} on mount point {mount_point} with configuration {conf}")
-    conf = load_config(conf)
-    nand = FuseNAND(image, mount_point, conf)
-    call_fuse(nand, mount_point)
+    try:
+        conf = load_config(conf)
+        source = open_image(images, conf, interleave)
+        rereads = [open_image(paths, conf, interleave, size=len(source)) for paths in rereads]
+    except ConfigError as e:
+        LOGGER.warning(f"Invalid configuration: {e}, exiting.")
+        return -4
+    nand = FuseNAND(
+        source,
+        mount_point,
+        conf,
+        lazy=lazy,
+        cache_size=cache_size,
+        jobs=jobs,
+        disk_cache=disk_cache,
+        scratch_dir=scratch_dir,
+        readahead=readahead,
+        stats=stats or stats_report is not None,
+        rereads=rereads,
+        policy=policy,
+    )
+    call_fuse(nand, mount_point, threads=threads)
+    if stats_report is not None:
+        write_report(stats_report, nand.stats_report())
+        LOGGER.info(f"Wrote statistics to {stats_report}")
     nand.close()
     LOGGER.info(f"Unmounting image {image} from mount point {mount_point}")
 
 
-def call_fuse(nand, mount_point):
-    FUSE(nand, str(mount_point), nothreads=True, foreground=True)
+def call_fuse(nand, mount_point, threads=False):
+    FUSE(nand, str(mount_point), nothreads=not threads, foreground=True)
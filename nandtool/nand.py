@@ -1,12 +1,44 @@
 import logging
-from itertools import chain
+import mmap
+import tempfile
+import threading
+from collections import OrderedDict
 
-import bchlib
 import numpy as np
 from tqdm import tqdm
 
+from nandtool.config import freeze, to_dict
+from nandtool.ecc import build_engine
+from nandtool.source import take, view
+from nandtool.stats import Stats, stage_timer
+
 LOGGER = logging.getLogger(__name__)
 
+DEFAULT_CACHE_SIZE = 256 * 1024**2
+
+# number of pages corrected at once
+BATCH_PAGES = 1024
+
+# number of pages corrected at once while holding the partition lock for cached reads and readahead
+CACHE_RUN_PAGES = 8
+
+# correction status of a page, read is the dump the uncorrectable chunks of the first dump were recovered from, the
+# flips and erased state of every chunk are added per layout, see Layout.status_dtype
+STATUS_DTYPE = np.dtype([("flips", "<u4"), ("uncorrectable", "?"), ("bad_block", "?"), ("read", "i1")])
+
+# what reading an uncorrectable page does per uncorrectable policy
+POLICY_ACTIONS = {"abort": "fail", "zero": "return zeros", "raw": "return the data as read"}
+
+# read of a page whose chunks were recovered by a majority vote over all dumps, or from several dumps
+VOTED_READ = -1
+MIXED_READ = -2
+
+# bitwise reverse of every byte value
+REVERSE_BITS = np.array([int(f"{i:08b}"[::-1], 2) for i in range(256)], dtype="u1")
+
+# number of zero bits in every byte value
+ZERO_BITS = np.array([8 - bin(i).count("1") for i in range(256)], dtype="u1")
+
 
 def modify_buffer(buffer, reverse=False, invert=False, left_shift=False):
     if not buffer:
@@ -21,20 +53,290 @@ def modify_buffer(buffer, reverse=False, invert=False, left_shift=False):
     return array.astype("u1").tobytes()
 
 
-def build_partitions(image_data, conf):
+def translate_table(reverse=False, invert=False):
+    """256-entry table that bitwise reverses and/or inverts a byte, or None if the byte is left unchanged."""
+    if not (reverse or invert):
+        return None
+    table = np.arange(256, dtype="u1")
+    if reverse:
+        table = REVERSE_BITS[table]
+    if invert:
+        table ^= 0xFF
+    return table
+
+
+def shift_left(array, bits):
+    """Shift every row of a 2d array to the left as a single big-endian number, zeros are shifted in."""
+    if not bits:
+        return array
+    nbytes, bits = divmod(bits, 8)
+    shifted = np.zeros_like(array)
+    shifted[:, : array.shape[1] - nbytes] = array[:, nbytes:]
+    if bits:
+        carry = shifted[:, 1:] >> (8 - bits)
+        shifted <<= bits
+        shifted[:, :-1] |= carry
+    return shifted
+
+
+def shift_right(array, bits):
+    """Shift every row of a 2d array to the right as a single big-endian number, zeros are shifted in."""
+    if not bits:
+        return array
+    nbytes, bits = divmod(bits, 8)
+    shifted = np.zeros_like(array)
+    shifted[:, nbytes:] = array[:, : array.shape[1] - nbytes]
+    if bits:
+        carry = shifted[:, :-1] << (8 - bits)
+        shifted >>= bits
+        shifted[:, 1:] |= carry
+    return shifted
+
+
+def interval_index(intervals):
+    """Page offsets of all bytes in a list of [start, end) intervals, in interval order."""
+    return np.array([i for start, end in intervals for i in range(start, end)], dtype=np.intp)
+
+
+def index_runs(index):
+    """Split an index plan into runs of consecutive page offsets.
+
+    Returns:
+        list: (offset in plan, page offset, length) of every run, negative page offsets are left out.
+    """
+    runs = []
+    for position, offset in enumerate(index.tolist()):
+        if offset < 0:
+            continue
+        if runs and runs[-1][0] + runs[-1][2] == position and runs[-1][1] + runs[-1][2] == offset:
+            runs[-1][2] += 1
+        else:
+            runs.append([position, offset, 1])
+    return [tuple(run) for run in runs]
+
+
+def build_partitions(
+    image_data,
+    conf,
+    lazy=False,
+    cache=None,
+    jobs=1,
+    image_path=None,
+    disk_cache=None,
+    scratch_dir=None,
+    stats=False,
+    rereads=(),
+    policy=None,
+):
+    """Build the NAND objects for all partitions in the configuration.
+
+    Args:
+        image_data: Raw image data (bytes, mmap or ImageSource).
+        conf: Loaded configuration.
+        lazy (bool): Do not correct the partitions up front, pages are corrected on demand.
+        cache (PageCache): Cache shared by all partitions for lazily corrected pages.
+        jobs (int): Number of worker processes used to correct a partition.
+        image_path: Path or ImageSource of the image, needed by the worker processes when jobs > 1 and by the disk
+            cache.
+        disk_cache (CorrectionCache): On-disk cache to load corrected partitions from and store them in.
+        scratch_dir (Path): Directory for file backed buffers of the corrected partitions, kept in memory if None.
+        stats (bool): Collect counters and stage timers of every partition.
+        rereads (list): Other dumps of the same chip (ImageSource), uncorrectable chunks are recovered from them.
+        policy (str): Uncorrectable policy of all partitions, overriding the policy of their layouts.
+
+    Returns:
+        dict: NAND object per partition name.
+    """
+    from nandtool.parallel import correct_partition_parallel
+
+    if disk_cache is not None:
+        image_digest = disk_cache.image_digest(image_path, rereads)
+
     partitions = dict()
     for partition in conf.partitions:
         partconf = conf[partition]
-        LOGGER.info(f"Start building partition: {partition}")
-        nand = NAND(image_data, partconf)
-        nand.correct_partition()
+        nand = NAND(
+            image_data, partconf, cache=cache, stats=Stats() if stats else None, rereads=rereads, policy=policy
+        )
         partitions[partition] = nand
+        if len(nand.bad_blocks):
+            LOGGER.info(
+                f"Partition {partition} has {len(nand.bad_blocks)} bad blocks"
+                + (", skipped" if nand.block_map is not None else "")
+            )
+        if not nand.has_ecc:
+            # nothing to correct, reads are served from the image
+            continue
+        if disk_cache is not None:
+            key = disk_cache.key(image_digest, nand.part_conf)
+            if disk_cache.load(key, nand):
+                LOGGER.info(f"Loaded partition {partition} from cache")
+                continue
+        if lazy:
+            continue
+
+        LOGGER.info(f"Start building partition: {partition}")
+        if jobs > 1 and image_path is not None and nand.has_ecc:
+            correct_partition_parallel(nand, image_path, jobs, scratch_dir=scratch_dir)
+        else:
+            nand.correct_partition(scratch_dir=scratch_dir)
         LOGGER.info(f"Done building partition: {partition}")
+        if disk_cache is not None:
+            disk_cache.store(key, nand, partition, image_path)
+
+    if disk_cache is not None:
+        disk_cache.evict()
     return partitions
 
 
+class PageCache:
+    """Thread-safe LRU cache for corrected pages, bounded by the total size of the cached pages in bytes."""
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.pages
+
+    def get(self, key):
+        with self.lock:
+            page = self.pages.get(key)
+            if page is not None:
+                self.pages.move_to_end(key)
+            return page
+
+    def put(self, key, page):
+        with self.lock:
+            if key in self.pages:
+                return
+            self.pages[key] = page
+            self.size += len(page)
+            while self.size > self.max_size and len(self.pages) > 1:
+                _, evicted = self.pages.popitem(last=False)
+                self.size -= len(evicted)
+
+
+def erased_runs(erased):
+    """Split a mask of erased pages into runs.
+
+    Returns:
+        list: (first, last) page index ranges of the runs of erased pages, last exclusive.
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], erased, [False])).astype(np.int8)))
+    return [(int(first), int(last)) for first, last in zip(edges[::2], edges[1::2])]
+
+
+def page_runs(index, max_length):
+    """Split sorted page indices into runs of consecutive pages of at most max_length pages.
+
+    Returns:
+        list: (first, last) page index ranges of the runs, last exclusive.
+    """
+    runs = []
+    for page in index:
+        if runs and runs[-1][1] == page and page - runs[-1][0] < max_length:
+            runs[-1][1] += 1
+        else:
+            runs.append([page, page + 1])
+    return [(first, last) for first, last in runs]
+
+
+class SparseBuffer:
+    """Corrected partition in which erased pages are kept as extents instead of stored bytes.
+
+    Pages that are not erased are stored one after the other in a compact buffer, slots maps every page to its
+    position in that buffer, or -1 if the page is erased. Erased pages are synthesized on read.
+
+    Args:
+        erased_page (np.ndarray): Corrected content of an erased page.
+        num_pages (int): Number of pages.
+        data: Compact buffer of the stored pages, if None pages are added with append.
+        slots (np.ndarray): Slot of every page, needed if data is given.
+        scratch_dir (Path): Directory for a file backed compact buffer, which the OS can page out. If None the buffer
+            is kept in memory.
+    """
+
+    def __init__(self, erased_page, num_pages, data=None, slots=None, scratch_dir=None):
+        self.erased_page = erased_page
+        self.pagesize = len(erased_page)
+        self.num_pages = num_pages
+        self.slots = np.full(num_pages, -1, dtype=np.int64) if slots is None else slots
+        self.num_stored = int((self.slots >= 0).sum())
+        self.data = data
+        # number of pages added with append so far
+        self.position = 0 if data is None else num_pages
+        self.file = None
+        if data is None:
+            if scratch_dir is None:
+                self.data = bytearray()
+            else:
+                # the file is removed as soon as it is closed, the mapping keeps it alive until then
+                self.file = tempfile.TemporaryFile(dir=scratch_dir)
+
+    def __len__(self):
+        return self.num_pages * self.pagesize
+
+    def __bytes__(self):
+        return bytes(self.read(0, len(self)))
+
+    def append(self, pages):
+        """Add the next corrected pages with shape (pages, pagesize), erased pages are only recorded in slots."""
+        stored = np.flatnonzero((pages != self.erased_page).any(axis=1))
+        self.slots[self.position + stored] = self.num_stored + np.arange(len(stored))
+        self.position += len(pages)
+        self.num_stored += len(stored)
+        data = pages if len(stored) == len(pages) else pages[stored]
+        if self.file is not None:
+            self.file.write(np.ascontiguousarray(data).data)
+        else:
+            self.data += np.ascontiguousarray(data).data
+
+    def finish(self):
+        """Map the compact buffer after all pages are added."""
+        if self.file is not None:
+            self.file.flush()
+            size = self.num_stored * self.pagesize
+            self.data = mmap.mmap(self.file.fileno(), size) if size else bytearray()
+            self.file.close()
+            self.file = None
+        return self
+
+    def erased_extents(self):
+        """Byte ranges (start, end) of the runs of erased pages, end exclusive."""
+        return [(first * self.pagesize, last * self.pagesize) for first, last in erased_runs(self.slots < 0)]
+
+    def read(self, offset, size):
+        """Read from the partition, a memoryview of the compact buffer if the range holds no erased pages."""
+        end = min(offset + size, len(self))
+        if offset >= end:
+            return b""
+        first = offset // self.pagesize
+        last = (end - 1) // self.pagesize
+        slots = self.slots[first : last + 1]
+        skip = offset - first * self.pagesize
+        view = memoryview(self.data)
+        if (slots >= 0).all():
+            # stored pages are consecutive in the compact buffer
+            start = int(slots[0]) * self.pagesize + skip
+            return view[start : start + end - offset]
+
+        erased_page = self.erased_page.tobytes()
+        data = b"".join(
+            erased_page if slot < 0 else view[slot * self.pagesize : (slot + 1) * self.pagesize]
+            for slot in slots.tolist()
+        )
+        return data[skip : skip + end - offset]
+
+
 class Layout:
-    """Class to avoid diving into dynaconf object for every call. Unpacking into this class speeds up code."""
+    """Layout of a partition unpacked from its configuration, with the intervals compiled into index plans."""
 
     def __init__(self, layout_conf):
         # partition size info
@@ -44,9 +346,9 @@ class Layout:
         self.pages_per_block = layout_conf["pages_per_block"]
 
         # layout of ecc and data in the page
-        self.ecc = layout_conf["ecc"]
-        self.protected_data = layout_conf["ecc_protected_data"]
-        self.user_data = layout_conf["user_data"]
+        self.ecc = freeze(layout_conf["ecc"])
+        self.protected_data = freeze(layout_conf["ecc_protected_data"])
+        self.user_data = freeze(layout_conf["user_data"])
 
         # modifications to buffer
         self.left_shift = layout_conf["left_shift_ecc_buf"]
@@ -55,189 +357,779 @@ class Layout:
         self.ecc_reverse = layout_conf["ecc_reverse"]
         self.ecc_invert = layout_conf["ecc_invert"]
 
-        self.ecc_strict = layout_conf["ecc_strict"]
+        # what reading an uncorrectable page does, ecc_strict selects the policy if it is not set
+        self.uncorrectable_policy = layout_conf.get("uncorrectable_policy") or (
+            "abort" if layout_conf["ecc_strict"] else "raw"
+        )
+
+        # chunks with at most this number of zero bits are considered erased
+        self.erased_threshold = layout_conf["erased_bitflip_threshold"]
+
+        # page offset of the bad block marker and the pages of a block it is checked in (negative from the end)
+        self.bad_block_marker = layout_conf.get("bad_block_marker")
+        self.bad_block_pages = layout_conf.get("bad_block_pages") or [0]
 
         # etfs layout if specified
-        if hasattr(layout_conf, "etfs") or "etfs" in layout_conf:
-            self.etfs_layout = layout_conf["etfs"]
-        else:
-            self.etfs_layout = dict()
+        self.etfs_layout = layout_conf.get("etfs") or dict()
+
+        self.compile_plans()
+        self.compile_transforms()
 
-        # ecc algorithm if specified
+        # ecc engine of the ecc algorithm if specified
         ecc_algorithm = layout_conf["ecc_algorithm"]
-        if ecc_algorithm:
-            self.bch = bchlib.BCH(prim_poly=ecc_algorithm["poly"], t=ecc_algorithm["t"])
-        else:
-            self.bch = None
+        self.ecc_engine = build_engine(ecc_algorithm) if ecc_algorithm else None
+
+    def compile_plans(self):
+        """Compile the intervals of the layout into index arrays to gather and scatter the bytes of pages.
+
+        Indexing a (pages, raw_pagesize) array with these plans gives the protected data, ecc or user data of all
+        pages at once. Intervals are taken in order, so overlapping intervals are written in the same order as
+        they are listed in the layout.
+        """
+        # page offsets of the protected data and ecc bytes per chunk
+        self.data_index = [interval_index(chunk) for chunk in self.protected_data or []]
+        self.ecc_index = [interval_index(chunk) for chunk in self.ecc or []]
+        self.chunk_index = [
+            np.concatenate((data_index, ecc_index))
+            for data_index, ecc_index in zip(self.data_index, self.ecc_index)
+        ]
+
+        # page offsets of the user data, followed by the etfs transaction (fid, 2 bytes padding, cluster,
+        # nclusters, 2 bytes padding, sequence) if specified, padding is marked with -1
+        user_index = [interval_index(chunk) for chunk in self.user_data]
+        if self.etfs_layout:
+            padding = np.full(2, -1, dtype=np.intp)
+            user_index += [
+                interval_index([self.etfs_layout["fid"]]),
+                padding,
+                interval_index([self.etfs_layout["cluster"]]),
+                interval_index([self.etfs_layout["nclusters"]]),
+                padding,
+                interval_index([self.etfs_layout["sequence"]]),
+            ]
+        self.user_index = np.concatenate(user_index)
+        self.user_padding = np.flatnonzero(self.user_index < 0)
+        # user data of an erased page
+        self.erased_userdata = np.where(self.user_index < 0, 0, 0xFF).astype("u1")
+        # user data is gathered with slices, which is much faster than fancy indexing for long runs
+        self.user_runs = index_runs(self.user_index)
+        # page offsets of the bytes outside the protected data and ecc, which are not corrected
+        protected = np.zeros(self.pagesize + self.oobsize, dtype=bool)
+        for index in self.chunk_index:
+            protected[index] = True
+        self.unprotected_index = np.flatnonzero(~protected)
+        # page offsets of the protected bytes that are not user data, e.g. ecc and protected tags in the spare area
+        spare = protected.copy()
+        spare[self.user_index[self.user_index >= 0]] = False
+        self.spare_index = np.flatnonzero(spare)
+
+        # page status with the flips (-1 if uncorrectable) and erased state of every chunk
+        num_chunks = len(self.chunk_index)
+        self.status_dtype = np.dtype(
+            STATUS_DTYPE.descr + [("chunk_flips", "<i2", (num_chunks,)), ("chunk_erased", "?", (num_chunks,))]
+        )
+
+    def compile_transforms(self):
+        """Compile the buffer modifications into translate tables and a shift, applied to batches of chunks."""
+        self.data_table = translate_table(self.data_reverse, self.data_invert)
+        self.ecc_table = translate_table(self.ecc_reverse, self.ecc_invert)
+
+    def transform_data(self, data):
+        """Modify protected data of a batch of chunks for the ecc engine, returns a new array."""
+        if self.data_table is None:
+            return data.copy()
+        return self.data_table[data]
+
+    def revert_data(self, data):
+        """Revert transform_data in place."""
+        if self.data_table is not None:
+            np.take(self.data_table, data, out=data)
+        return data
+
+    def transform_ecc(self, ecc):
+        """Modify and shift the ecc of a batch of chunks for the ecc engine, returns a new array."""
+        if self.ecc_table is None:
+            return shift_left(ecc.copy(), self.left_shift)
+        return shift_left(self.ecc_table[ecc], self.left_shift)
+
+    def revert_ecc(self, ecc):
+        """Revert transform_ecc, bits shifted out by transform_ecc are zero."""
+        ecc = shift_right(ecc, self.left_shift)
+        if self.ecc_table is not None:
+            np.take(self.ecc_table, ecc, out=ecc)
+        return ecc
 
 
 class NAND:
-    def __init__(self, data, part_conf):
+    def __init__(self, data, part_conf, cache=None, stats=None, rereads=(), policy=None):
         self.data = data
+        # other dumps of the same chip, uncorrectable chunks are recovered from them
+        self.rereads = list(rereads)
+        self.cache = cache
+        # counters and stage timers, only collected if a Stats object is given
+        self.stats = stats
+        # serializes on-demand correction, the BCH decoder and the partition state are not thread-safe
+        self.lock = threading.RLock()
 
         # extract configuration of partition
-        self.part_conf = part_conf.to_dict()
+        self.part_conf = to_dict(part_conf)
         self.layout = Layout(self.part_conf["layout"])
-        self.start = part_conf["startblock"]
-        self.end = part_conf["endblock"]
+        # what reading an uncorrectable page does, overrides the policy of the layout if given
+        self.policy = policy or self.layout.uncorrectable_policy
+        self.start = self.part_conf["startblock"]
+        self.end = self.part_conf["endblock"]
         if self.end == -1:
             self.end = len(self.data) // self.layout.blocksize - 1
-        self.num_blocks = self.end + 1 - self.start
+        self.raw_pagesize = self.layout.pagesize + self.layout.oobsize
+        self.start_offset = self.start * self.layout.blocksize
+
+        # bad blocks relative to the start of the partition, skipped blocks are left out of the logical blocks
+        self.bad_blocks = self.scan_bad_blocks(self.end + 1 - self.start)
+        self.block_map = None
+        if self.part_conf.get("skip_bad_blocks") and len(self.bad_blocks):
+            self.block_map = np.setdiff1d(np.arange(self.end + 1 - self.start), self.bad_blocks)
+        self.num_blocks = self.end + 1 - self.start if self.block_map is None else len(self.block_map)
+        # logical blocks that are bad and not skipped, their pages are passed through without decoding
+        self.bad_block_mask = np.zeros(self.num_blocks, dtype=bool)
+        if self.block_map is None:
+            self.bad_block_mask[self.bad_blocks] = True
+
+        self.num_pages = self.num_blocks * self.layout.pages_per_block
         self.raw_partition_size = self.num_blocks * self.layout.blocksize
 
         # calculate corrected partition size
-        pagesize = sum(
-            (end - start for chunk in self.layout.user_data for start, end in chunk)
-        )
-        if self.layout.etfs_layout:
-            pagesize += 16
-        self.corrected_partition_size = (
-            self.num_blocks * self.layout.pages_per_block * pagesize
-        )
+        self.corrected_pagesize = len(self.layout.user_index)
+        self.corrected_partition_size = self.num_pages * self.corrected_pagesize
 
         # start ecc correction
         self.corrected_bits = 0
         self.corrected = None
+        # corrected protected bytes of every page that are not user data, kept by the build to serve full pages
+        self.spare = None
+        self.status = np.zeros(self.num_pages, dtype=self.layout.status_dtype)
+        self.status["bad_block"] = np.repeat(self.bad_block_mask, self.layout.pages_per_block)
 
-    @staticmethod
-    def rebuild_buffer(mapping, raw_pagesize):
-        out = b""
-        cursor = 0
-        for offset, buf in sorted(mapping.items(), key=lambda x: x[0]):
-            if offset > cursor:
-                out += b"\xff" * (offset - cursor)
-                cursor += offset - cursor
-            out += buf
-            cursor += len(buf)
-        if len(out) < raw_pagesize:
-            out += b"\xff" * (raw_pagesize - len(out))
-        return out
+    def scan_bad_blocks(self, num_blocks):
+        """Find the blocks with a bad block marker, reading the markers of all blocks at once.
+
+        A block is bad if the marker byte is not 0xff in any of the checked pages. Nothing is scanned if the layout
+        has no bad block marker.
+
+        Args:
+            num_blocks (int): Number of physical blocks of the partition.
+
+        Returns:
+            np.ndarray: Indices of the bad blocks, relative to the start of the partition.
+        """
+        layout = self.layout
+        if layout.bad_block_marker is None or num_blocks <= 0:
+            return np.zeros(0, dtype=np.intp)
+        pages = np.array(layout.bad_block_pages) % layout.pages_per_block
+        offsets = (
+            self.start_offset
+            + np.arange(num_blocks)[:, None] * layout.blocksize
+            + pages * self.raw_pagesize
+            + layout.bad_block_marker
+        )
+        markers = take(self.data, offsets)
+        return np.flatnonzero((markers != 0xFF).any(axis=1))
+
+    def physical_pages(self, first, last):
+        """Page indices relative to the start of the partition of the logical pages in [first, last)."""
+        index = np.arange(first, last)
+        if self.block_map is None:
+            return index
+        block, page = np.divmod(index, self.layout.pages_per_block)
+        return self.block_map[block] * self.layout.pages_per_block + page
+
+    def page_offset(self, index):
+        """Offset in the image of the page at the given page index of the partition."""
+        return self.start_offset + int(self.physical_pages(index, index + 1)[0]) * self.raw_pagesize
 
     def bch_correct_chunk(self, data, ecc):
-        uncorrectable = False
-        # modify data and ecc buffers if needed
-        ecc = modify_buffer(ecc, self.layout.ecc_invert, self.layout.ecc_reverse)
-        data = modify_buffer(data, self.layout.data_invert, self.layout.data_reverse)
-        if self.layout.left_shift == 4:
-            ecc = bytes.fromhex(ecc.hex()[1:] + "0")
-
-        # decode chunk
-        flips = self.layout.bch.decode(data, ecc)
-
-        # check flips
-        if flips == -1:
-            # raise ValueError("Uncorrectable number of bitflips.")
-            uncorrectable = True
-        elif flips > 0:
-            self.corrected_bits += flips
-            LOGGER.debug(f"Detected {flips} flips")
-            # correct bitflips
-            data = bytearray(data)
-            ecc = bytearray(ecc)
-            self.layout.bch.correct(data, ecc)
-
-        # modify data and ecc buffers to revert back
-        if self.layout.left_shift == 4:
-            ecc = bytes.fromhex("0" + ecc.hex()[:-1])
-        ecc = modify_buffer(ecc, self.layout.ecc_invert, self.layout.ecc_reverse)
-        data = modify_buffer(data, self.layout.data_invert, self.layout.data_reverse)
-
-        return data, ecc, uncorrectable
-
-    def correct_page(self, page):
-        data_map = dict()
-        all_erased = True
-        uncorrectable_page = False
-
-        # check if page is empty (all 0xff)
-        for chunk in chain(self.layout.protected_data, self.layout.ecc):
-            for start, end in chunk:
-                buf = page[start:end]
-                if buf != b"\xff" * len(buf):
-                    all_erased = False
-                data_map[start] = buf
-
-        corrected_data_map = {}
-        # correct if page not empty
-        if not all_erased:
-            for chunk_data_ranges, chunk_ecc_ranges in zip(
-                self.layout.protected_data, self.layout.ecc
-            ):
-                # concatenate chunks
-                raw_data = b"".join(data_map[start] for start, _ in chunk_data_ranges)
-                raw_ecc = b"".join(data_map[start] for start, _ in chunk_ecc_ranges)
-
-                # correct chunk
-                data_corrected, ecc_corrected, uncorrectable_chunk = (
-                    self.bch_correct_chunk(raw_data, raw_ecc)
-                )
-
-                uncorrectable_page |= uncorrectable_chunk
-
-                # split corrected buffers up into chunks
-                for start, end in chunk_data_ranges:
-                    length = end - start
-                    corrected_data_map[start] = data_corrected[:length]
-                    data_corrected = data_corrected[length:]
-                assert not data_corrected
-                for start, end in chunk_ecc_ranges:
-                    length = end - start
-                    corrected_data_map[start] = ecc_corrected[:length]
-                    ecc_corrected = ecc_corrected[length:]
-                assert not ecc_corrected
-
-        # Rebuild page data
-        corrected_page = self.rebuild_buffer(
-            corrected_data_map, self.layout.pagesize + self.layout.oobsize
+        data, ecc, flips = self.correct_chunks(
+            np.frombuffer(data, "u1").reshape(1, -1).copy(), np.frombuffer(ecc, "u1").reshape(1, -1)
         )
-        return corrected_page, uncorrectable_page
+        return data[0].tobytes(), ecc[0].tobytes(), bool(flips[0] < 0)
+
+    def correct_chunks(self, data, ecc):
+        """Correct a batch of chunks.
+
+        The buffer modifications are applied to the whole batch at once, then the batch is corrected by the ecc
+        engine of the layout.
+
+        Args:
+            data (np.ndarray): Protected data of the chunks with shape (chunks, data length), corrected in place.
+            ecc (np.ndarray): Ecc of the chunks with shape (chunks, ecc length).
+
+        Returns:
+            tuple: Corrected data, corrected ecc and the number of flips per chunk (-1 if uncorrectable).
+        """
+        layout = self.layout
+        # modify data and ecc buffers if needed
+        with stage_timer(self.stats, "transform"):
+            bch_data = layout.transform_data(data)
+            bch_ecc = layout.transform_ecc(ecc)
+
+        flips = layout.ecc_engine.correct(bch_data, bch_ecc, self.stats)
+        self.corrected_bits += int(flips[flips > 0].sum())
+
+        # modify data and ecc buffers to revert back, unchanged data does not need to be reverted
+        with stage_timer(self.stats, "rebuild"):
+            rows = np.flatnonzero(flips > 0)
+            if len(rows):
+                data[rows] = layout.revert_data(bch_data[rows])
+            ecc = layout.revert_ecc(bch_ecc)
+
+        return data, ecc, flips
+
+    def count_zero_bits(self, pages):
+        """Count the zero bits in the protected data and ecc of every chunk.
+
+        Args:
+            pages (np.ndarray): Raw pages with shape (pages, raw_pagesize).
+
+        Returns:
+            np.ndarray: Number of zero bits with shape (pages, chunks).
+        """
+        counts = np.empty((len(pages), len(self.layout.chunk_index)), dtype=np.int64)
+        for i, index in enumerate(self.layout.chunk_index):
+            counts[:, i] = ZERO_BITS[pages[:, index]].sum(axis=1)
+        return counts
 
-    def correct_partition(self):
-        corrected_pages = []
-        raw_pagesize = self.layout.pagesize + self.layout.oobsize
-        raw_blocksize = raw_pagesize * self.layout.pages_per_block
-        start_offset = self.start * raw_blocksize
+    def decode_pages(self, pages, zero_bits=None):
+        """Correct a batch of raw pages chunk by chunk, erased chunks are not decoded but restored to 0xff.
 
-        for i in tqdm(
-            range(start_offset, start_offset + self.raw_partition_size, raw_pagesize)
+        Args:
+            pages (np.ndarray): Raw pages with shape (pages, raw_pagesize).
+            zero_bits (np.ndarray): Zero bits per chunk of every page, counted if not given.
+
+        Returns:
+            tuple: Corrected pages with shape (pages, raw_pagesize), the flips per chunk with shape (pages, chunks),
+                -1 for uncorrectable chunks, and which chunks are erased.
+        """
+        with stage_timer(self.stats, "erased_check"):
+            if zero_bits is None:
+                zero_bits = self.count_zero_bits(pages)
+            erased = zero_bits <= self.layout.erased_threshold
+
+        # bitflips in erased chunks are corrected by restoring the chunk to 0xff
+        flips = np.where(erased, zero_bits, 0)
+        self.corrected_bits += int(flips.sum())
+
+        # bytes not covered by protected data or ecc are 0xff in the corrected page
+        corrected = np.full(pages.shape, 0xFF, dtype="u1")
+        for chunk, (data_index, ecc_index) in enumerate(
+            zip(self.layout.data_index, self.layout.ecc_index)
         ):
-            # correct page if sufficient parameters available
-            page = self.data[i : i + raw_pagesize]
-            if self.layout.ecc and self.layout.protected_data and self.layout.bch:
-                corrected_page, uncorrectable = self.correct_page(page)
-                if self.layout.ecc_strict and uncorrectable:
-                    raise ValueError(f"Uncorrectable bitflips in page at: 0x{i:08x}")
-                elif uncorrectable:
-                    print(
-                        f"Uncorrectable bitflips in page at: {i:08x}, resuming with corrupt data"
-                    )
+            rows = np.flatnonzero(~erased[:, chunk])
+            if not len(rows):
+                continue
+
+            # gather chunk buffers of all pages that need decoding
+            with stage_timer(self.stats, "transform"):
+                data = pages[rows[:, None], data_index]
+                ecc = pages[rows[:, None], ecc_index]
+            data, ecc, chunk_flips = self.correct_chunks(data, ecc)
+            flips[rows, chunk] = chunk_flips
+
+            # scatter corrected chunks back into the pages
+            with stage_timer(self.stats, "rebuild"):
+                corrected[rows[:, None], data_index] = data
+                corrected[rows[:, None], ecc_index] = ecc
+            if self.stats is not None:
+                self.stats.count("decoded_chunks", len(rows))
+                self.stats.count("corrected_chunks", (chunk_flips > 0).sum())
+                self.stats.count("uncorrectable_chunks", (chunk_flips < 0).sum())
+
+        if self.stats is not None:
+            self.stats.count("pages", len(pages))
+            self.stats.count("erased_chunks", erased.sum())
+        return corrected, flips, erased
+
+    def correct_pages(self, pages, zero_bits=None):
+        """Correct a batch of raw pages, erased chunks are not decoded but restored to 0xff.
+
+        Args:
+            pages (np.ndarray): Raw pages with shape (pages, raw_pagesize).
+            zero_bits (np.ndarray): Zero bits per chunk of every page, counted if not given.
+
+        Returns:
+            tuple: Corrected pages with shape (pages, raw_pagesize) and their status.
+        """
+        corrected, flips, erased = self.decode_pages(pages, zero_bits)
+        status = np.zeros(len(pages), dtype=self.layout.status_dtype)
+        status["flips"] = np.maximum(flips, 0).sum(axis=1)
+        status["uncorrectable"] = (flips < 0).any(axis=1)
+        status["chunk_flips"] = np.minimum(flips, np.iinfo(np.int16).max)
+        status["chunk_erased"] = erased
+        if self.stats is not None:
+            self.stats.count("flips", status["flips"].sum())
+        return corrected, status
+
+    def correct_page(self, page, zero_bits=None):
+        """Correct a single raw page.
+
+        Returns:
+            tuple: Corrected page and whether the page contains uncorrectable chunks.
+        """
+        pages = np.frombuffer(page, "u1").reshape(1, -1)
+        if zero_bits is not None:
+            zero_bits = zero_bits.reshape(1, -1)
+        corrected, status = self.correct_pages(pages, zero_bits)
+        return corrected[0].tobytes(), bool(status[0]["uncorrectable"])
+
+    @property
+    def has_ecc(self):
+        return bool(self.layout.ecc and self.layout.protected_data and self.layout.ecc_engine)
+
+    def raw_page(self, index):
+        offset = self.page_offset(index)
+        return bytes(view(self.data, offset, self.raw_pagesize))
+
+    def raw_pages(self, first, last):
+        """View the raw pages in [first, last) as an array with shape (pages, raw_pagesize).
+
+        If the range spans skipped bad blocks, the runs of physically consecutive pages are joined into a copy.
+        """
+        if self.block_map is None or last <= first:
+            return self.image_pages(first, last - first)
+
+        index = self.physical_pages(first, last)
+        runs = np.split(index, np.flatnonzero(np.diff(index) != 1) + 1)
+        views = [self.image_pages(int(run[0]), len(run)) for run in runs]
+        return views[0] if len(views) == 1 else np.concatenate(views)
+
+    def image_pages(self, first, count):
+        """View count physically consecutive raw pages, starting at physical page first of the partition."""
+        data = view(self.data, self.start_offset + first * self.raw_pagesize, count * self.raw_pagesize)
+        return np.frombuffer(data, "u1").reshape(-1, self.raw_pagesize)
+
+    def correct_raw_pages(self, first, last):
+        """Correct the raw pages in [first, last), pages of bad blocks are passed through without decoding.
+
+        Returns:
+            tuple: Corrected pages with shape (pages, raw_pagesize) and their status.
+        """
+        pages = self.raw_pages(first, last)
+        bad = self.bad_block_mask[np.arange(first, last) // self.layout.pages_per_block]
+        if not bad.any():
+            corrected, status = self.correct_pages(pages)
+        else:
+            corrected = pages.copy()
+            status = np.zeros(len(pages), dtype=self.layout.status_dtype)
+            status["bad_block"] = bad
+            good = np.flatnonzero(~bad)
+            if len(good):
+                corrected[good], status[good] = self.correct_pages(pages[good])
+            if self.stats is not None:
+                self.stats.count("bad_block_pages", bad.sum())
+        if self.rereads and status["uncorrectable"].any():
+            with stage_timer(self.stats, "fuse"):
+                self.fuse_pages(first, pages, corrected, status)
+        return corrected, status
+
+    def reread_pages(self, data, index):
+        """Raw pages at the given page indices of the partition in another dump, with shape (pages, raw_pagesize)."""
+        return np.stack(
+            [np.frombuffer(view(data, self.page_offset(i), self.raw_pagesize), "u1") for i in index.tolist()]
+        )
+
+    def fuse_pages(self, first, pages, corrected, status):
+        """Recover the uncorrectable chunks of a batch of pages from the other dumps of the chip.
+
+        Only the uncorrectable pages are read from the other dumps. Every uncorrectable chunk is replaced by the
+        decodable copy with the fewest flips, and chunks that no dump can correct by the bitwise majority vote over
+        all dumps if that decodes. The corrected pages and their status are updated in place, the read of the status
+        records which dump the recovered chunks came from.
+
+        Args:
+            first (int): Index of the first page of the batch.
+            pages (np.ndarray): Raw pages of the batch with shape (pages, raw_pagesize).
+            corrected (np.ndarray): Corrected pages of the batch.
+            status (np.ndarray): Status of the pages of the batch.
+        """
+        rows = np.flatnonzero(status["uncorrectable"])
+        num_reads = 1 + len(self.rereads)
+        candidates = np.stack([pages[rows]] + [self.reread_pages(data, first + rows) for data in self.rereads])
+
+        # flips of the candidates are only counted for the chunks that are used
+        corrected_bits = self.corrected_bits
+        options, flips, erased = self.decode_pages(candidates.reshape(-1, self.raw_pagesize))
+        shape = (num_reads, len(rows), -1)
+        options, flips, erased = options.reshape(shape), flips.reshape(shape), erased.reshape(shape)
+
+        # best decodable reread of every uncorrectable chunk of the first read
+        failed = flips[0] < 0
+        decodable = flips[1:] >= 0
+        best = np.where(decodable, flips[1:], np.iinfo(flips.dtype).max).argmin(axis=0)
+        pick = np.where(failed & decodable.any(axis=0), best + 1, 0)
+
+        # bitwise majority vote over all reads for chunks that no read can correct, the vote is option num_reads
+        vote = failed & (pick == 0)
+        vote_rows = np.flatnonzero(vote.any(axis=1))
+        voted = np.zeros((1, len(rows), self.raw_pagesize), dtype="u1")
+        voted_flips = np.full((1,) + failed.shape, -1, dtype=flips.dtype)
+        voted_erased = np.zeros((1,) + failed.shape, dtype=bool)
+        if len(vote_rows):
+            bits = np.unpackbits(candidates[:, vote_rows], axis=2).sum(axis=0, dtype=np.int64)
+            voted[0, vote_rows], voted_flips[0, vote_rows], voted_erased[0, vote_rows] = self.decode_pages(
+                np.packbits(bits * 2 > num_reads, axis=1)
+            )
+            pick = np.where(vote & (voted_flips[0] >= 0), num_reads, pick)
+        options = np.concatenate([options, voted])
+        chunk_flips = np.take_along_axis(np.concatenate([flips, voted_flips]), pick[None], axis=0)[0]
+        chunk_erased = np.take_along_axis(np.concatenate([erased, voted_erased]), pick[None], axis=0)[0]
+        self.corrected_bits = corrected_bits + int(chunk_flips[pick > 0].sum())
+
+        fused = corrected[rows]
+        for chunk, chunk_index in enumerate(self.layout.chunk_index):
+            chunk_rows = np.flatnonzero(pick[:, chunk] > 0)
+            fused[chunk_rows[:, None], chunk_index] = options[
+                pick[chunk_rows, chunk][:, None], chunk_rows[:, None], chunk_index
+            ]
+        corrected[rows] = fused
+
+        # read of every page: the dump all recovered chunks came from, or whether they came from several
+        reads = np.where(pick == num_reads, VOTED_READ, pick)
+        recovered = pick > 0
+        first_read = np.take_along_axis(reads, recovered.argmax(axis=1)[:, None], axis=1)[:, 0]
+        mixed = (recovered & (reads != first_read[:, None])).any(axis=1)
+        page_reads = np.where(recovered.any(axis=1), np.where(mixed, MIXED_READ, first_read), 0)
+        status["flips"][rows] = np.maximum(chunk_flips, 0).sum(axis=1)
+        status["uncorrectable"][rows] = (chunk_flips < 0).any(axis=1)
+        status["read"][rows] = page_reads
+        status["chunk_flips"][rows] = np.minimum(chunk_flips, np.iinfo(np.int16).max)
+        status["chunk_erased"][rows] = chunk_erased
+        if self.stats is not None:
+            self.stats.count("fused_pages", (~status["uncorrectable"][rows]).sum())
+            self.stats.count("unrecovered_pages", status["uncorrectable"][rows].sum())
+        LOGGER.debug(f"Recovered {(~status['uncorrectable'][rows]).sum()} of {len(rows)} uncorrectable pages")
+
+    def uncorrectable_pages(self, first, last):
+        """Indices of the uncorrectable pages in [first, last) that the uncorrectable policy acts on.
+
+        Raises:
+            ValueError: If there are uncorrectable pages and the policy is abort.
+        """
+        if self.policy == "raw":
+            return np.zeros(0, dtype=np.intp)
+        index = first + np.flatnonzero(self.status["uncorrectable"][first:last])
+        if len(index) and self.policy == "abort":
+            raise ValueError(f"Uncorrectable bitflips in page at: 0x{self.page_offset(int(index[0])):08x}")
+        return index
+
+    def apply_policy(self, first, userdata):
+        """Apply the uncorrectable policy to the user data of a batch of pages starting at page first.
+
+        Returns:
+            np.ndarray: User data of the batch, a copy if pages were zero-filled and userdata is read-only.
+        """
+        rows = self.uncorrectable_pages(first, first + len(userdata)) - first
+        if len(rows):
+            if not userdata.flags.writeable:
+                userdata = userdata.copy()
+            userdata[rows] = 0
+        return userdata
+
+    def apply_policy_range(self, offset, data, pagesize=None):
+        """Apply the uncorrectable policy to data read from offset in the corrected partition.
+
+        Args:
+            offset (int): Offset the data was read from.
+            data (bytes): Data read.
+            pagesize (int): Size of the records of every page in the data, defaults to the corrected page size.
+        """
+        pagesize = pagesize or self.corrected_pagesize
+        if not len(data):
+            return data
+        first = offset // pagesize
+        last = (offset + len(data) - 1) // pagesize
+        index = self.uncorrectable_pages(first, last + 1)
+        if not len(index):
+            return data
+        data = bytearray(data)
+        for page in index.tolist():
+            start = max(page * pagesize - offset, 0)
+            end = min((page + 1) * pagesize - offset, len(data))
+            data[start:end] = bytes(end - start)
+        return bytes(data)
+
+    def log_uncorrectable(self):
+        uncorrectable = int(self.status["uncorrectable"].sum())
+        if uncorrectable:
+            LOGGER.warning(
+                f"{uncorrectable} pages are uncorrectable, reading them will {POLICY_ACTIONS[self.policy]}"
+            )
+
+    def corrected_page(self, index):
+        """Return the corrected page at the given page index of the partition, using the page cache if available."""
+        return self.corrected_pages(index, index + 1)[0][0]
+
+    def cached_page(self, index):
+        return self.cache.get((self, index)) if self.cache is not None else None
+
+    def corrected_pages(self, first, last):
+        """Return the corrected pages in [first, last), correcting the pages that are not cached in runs.
+
+        The cache is checked without the partition lock, which is only held while a run of at most CACHE_RUN_PAGES
+        pages is corrected, so reads of other pages never wait behind more than one run of a readahead. Pages that
+        another thread cached in the meantime are not corrected again. Uncorrectable pages are cached like all other
+        pages, the uncorrectable policy is applied to them through self.status when they are read.
+
+        Returns:
+            tuple: Corrected pages (bytes) and the number of pages that were not cached.
+        """
+        if not self.has_ecc:
+            return [self.raw_page(index) for index in range(first, last)], 0
+
+        pages = [self.cached_page(index) for index in range(first, last)]
+        missing = [first + i for i, page in enumerate(pages) if page is None]
+        for run_first, run_last in page_runs(missing, CACHE_RUN_PAGES):
+            with self.lock:
+                pending = []
+                for index in range(run_first, run_last):
+                    pages[index - first] = self.cached_page(index)
+                    if pages[index - first] is None:
+                        pending.append(index)
+                for pending_first, pending_last in page_runs(pending, CACHE_RUN_PAGES):
+                    corrected, status = self.correct_raw_pages(pending_first, pending_last)
+                    self.status[pending_first:pending_last] = status
+                    for index, page in zip(range(pending_first, pending_last), corrected):
+                        pages[index - first] = page.tobytes()
+                        if self.cache is not None:
+                            self.cache.put((self, index), pages[index - first])
+        return pages, len(missing)
+
+    def cache_pages(self, first, last):
+        """Correct the pages in [first, last) that are not cached yet, see corrected_pages.
+
+        Returns:
+            int: Number of pages that were not cached.
+        """
+        if self.cache is None or not self.has_ecc:
+            return 0
+        return self.corrected_pages(first, min(last, self.num_pages))[1]
+
+    def userdata(self, pages, out=None):
+        """Gather the user data (and etfs transaction) of corrected pages with shape (pages, raw_pagesize).
+
+        The user data is written into out if given, which must have shape (pages, corrected_pagesize).
+        """
+        with stage_timer(self.stats, "rebuild"):
+            if out is None:
+                out = np.zeros((len(pages), self.corrected_pagesize), dtype="u1")
             else:
-                corrected_page = page
+                out[:, self.layout.user_padding] = 0
+            for position, offset, length in self.layout.user_runs:
+                out[:, position : position + length] = pages[:, offset : offset + length]
+        return out
 
-            # slice userdata from page
-            userdata = b""
-            for chunk in self.layout.user_data:
-                for start, end in chunk:
-                    userdata += corrected_page[start:end]
+    def read(self, offset, size):
+        """Read corrected data from the partition, correcting the pages involved on demand if not built yet.
 
-            # append transaction in case of ETFS
-            if self.layout.etfs_layout:
-                userdata += self.build_transaction(corrected_page)
+        Args:
+            offset (int): Offset in the corrected partition.
+            size (int): Number of bytes to read.
 
-            corrected_pages.append(userdata)
+        Returns:
+            bytes: Corrected partition data, a memoryview of the corrected buffer if the partition is built.
 
-        self.corrected = b"".join(corrected_pages)
-        LOGGER.info(f"Corrected {self.corrected_bits} bits")
+        Raises:
+            ValueError: If the range holds uncorrectable pages and the uncorrectable policy is abort.
+        """
+        if self.corrected is not None:
+            return self.apply_policy_range(offset, self.corrected.read(offset, size))
+        if not self.has_ecc:
+            return self.read_passthrough(offset, size)
+
+        end = min(offset + size, self.corrected_partition_size)
+        if offset >= end:
+            return b""
+        first = offset // self.corrected_pagesize
+        last = (end - 1) // self.corrected_pagesize
+        pages, misses = self.corrected_pages(first, last + 1)
+        if self.stats is not None and self.cache is not None:
+            self.stats.count("cache_misses", misses)
+            self.stats.count("cache_hits", last + 1 - first - misses)
+        data = self.userdata(np.frombuffer(b"".join(pages), "u1").reshape(len(pages), -1)).tobytes()
+        skip = offset - first * self.corrected_pagesize
+        return self.apply_policy_range(offset, data[skip : skip + end - offset])
+
+    def read_pages(self, offset, size, oob=False):
+        """Read the full corrected pages, spare area included, or only their spare area.
+
+        Built partitions join the corrected user data with the other protected bytes of the pages kept by the build.
+        Lazy partitions, and partitions loaded from the correction cache, correct the pages on demand through the page
+        cache. Bytes outside the protected data and ecc, like bad block markers and unprotected tags, are not corrected
+        and read as in the image, as do partitions without ecc.
+
+        Args:
+            offset (int): Offset in the consecutive pages (raw_pagesize bytes each) or spare areas (oobsize bytes).
+            size (int): Number of bytes to read.
+            oob (bool): Read the spare areas instead of the pages.
+
+        Returns:
+            bytes: Corrected pages or spare areas.
+
+        Raises:
+            ValueError: If the range holds uncorrectable pages and the uncorrectable policy is abort.
+        """
+        start, pagesize = (self.layout.pagesize, self.layout.oobsize) if oob else (0, self.raw_pagesize)
+        end = min(offset + size, self.num_pages * pagesize)
+        if offset >= end:
+            return b""
+        first = offset // pagesize
+        last = (end - 1) // pagesize
+        if self.corrected is not None and self.spare is not None:
+            pages = self.built_pages(first, last + 1)
+        else:
+            pages = np.frombuffer(bytearray(b"".join(self.corrected_pages(first, last + 1)[0])), "u1")
+            pages = pages.reshape(-1, self.raw_pagesize)
+        unprotected = self.layout.unprotected_index
+        pages[:, unprotected] = self.raw_pages(first, last + 1)[:, unprotected]
+        data = pages[:, start:].tobytes()
+        skip = offset - first * pagesize
+        return self.apply_policy_range(offset, data[skip : skip + end - offset], pagesize)
 
-    def build_transaction(self, page):
-        transaction = b""
-        start, end = self.layout.etfs_layout["fid"]
-        transaction += page[start:end]
-        transaction += b"\x00" * 2  # fid padding?
-        for key in ("cluster", "nclusters"):
-            start, end = self.layout.etfs_layout[key]
-            transaction += page[start:end]
-        transaction += b"\x00" * 2  # tacode and dacode
-        start, end = self.layout.etfs_layout["sequence"]
-        transaction += page[start:end]
-        return transaction
+    def built_pages(self, first, last):
+        """Corrected pages in [first, last) of a built partition, joined from the user data and self.spare.
+
+        Returns:
+            np.ndarray: Corrected pages with shape (pages, raw_pagesize), the bytes outside the protected data and ecc
+                are not set.
+        """
+        pages = np.empty((last - first, self.raw_pagesize), dtype="u1")
+        pages[:, self.layout.spare_index] = self.spare[first:last]
+        size = self.corrected_pagesize
+        userdata = np.frombuffer(self.corrected.read(first * size, (last - first) * size), "u1").reshape(-1, size)
+        for position, offset, length in self.layout.user_runs:
+            pages[:, offset : offset + length] = userdata[:, position : position + length]
+        return pages
+
+    def read_passthrough(self, offset, size):
+        """Read the user data of a partition without ecc straight from the image.
+
+        A range within a single run of user data of a page is a view of the image, other ranges gather the user data
+        of only the pages involved.
+        """
+        end = min(offset + size, self.corrected_partition_size)
+        if offset >= end:
+            return b""
+        first, skip = divmod(offset, self.corrected_pagesize)
+        last = (end - 1) // self.corrected_pagesize
+        if first == last:
+            for position, page_offset, length in self.layout.user_runs:
+                if position <= skip and skip + end - offset <= position + length:
+                    start = self.page_offset(first) + page_offset + skip - position
+                    return view(self.data, start, end - offset)
+        return self.userdata(self.raw_pages(first, last + 1)).tobytes()[skip : skip + end - offset]
+
+    def iter_corrected_batches(self, first=0, last=None):
+        """Correct the pages in [first, last) in batches of BATCH_PAGES pages.
+
+        The status of the pages is recorded in self.status.
+
+        Yields:
+            tuple: Index of the first page of the batch, corrected pages with shape (pages, raw_pagesize) and their
+                status.
+        """
+        last = self.num_pages if last is None else last
+        for batch_first in range(first, last, BATCH_PAGES):
+            batch_last = min(batch_first + BATCH_PAGES, last)
+            if self.has_ecc:
+                pages, status = self.correct_raw_pages(batch_first, batch_last)
+                self.status[batch_first:batch_last] = status
+                if self.spare is not None:
+                    self.spare[batch_first:batch_last] = pages[:, self.layout.spare_index]
+            else:
+                pages = self.raw_pages(batch_first, batch_last)
+            yield batch_first, pages, self.status[batch_first:batch_last]
+
+    def iter_cached_batches(self):
+        """Correct all pages in batches of BATCH_PAGES pages like iter_corrected_batches, while the partition is read.
+
+        The partition lock is only held while a batch is corrected, so concurrent reads wait for at most one batch,
+        and the corrected pages are put in the page cache, so reads afterwards do not correct them again.
+
+        Yields:
+            tuple: Index of the first page of the batch, corrected pages with shape (pages, raw_pagesize) and their
+                status.
+        """
+        for batch_first in range(0, self.num_pages, BATCH_PAGES):
+            batch_last = min(batch_first + BATCH_PAGES, self.num_pages)
+            with self.lock:
+                _, pages, status = next(self.iter_corrected_batches(batch_first, batch_last))
+            if self.cache is not None and self.has_ecc:
+                for index, page in enumerate(pages, batch_first):
+                    self.cache.put((self, index), page.tobytes())
+            yield batch_first, pages, status
+
+    def correct_range(self, first, last, spare=False):
+        """Correct the pages in [first, last) without acting on uncorrectable pages.
+
+        Args:
+            first (int): Index of the first page.
+            last (int): Index of the page after the last page.
+            spare (bool): Also return the protected bytes of the pages that are not user data (see
+                Layout.spare_index).
+
+        Returns:
+            tuple: Joined user data of the pages, their status and the joined protected bytes of the pages that are
+                not user data, None if spare is False.
+        """
+        corrected_pages, spare_bytes = [], []
+        for _, pages, _ in self.iter_corrected_batches(first, last):
+            corrected_pages.append(self.userdata(pages).tobytes())
+            if spare:
+                spare_bytes.append(pages[:, self.layout.spare_index].tobytes())
+        return b"".join(corrected_pages), self.status[first:last].copy(), b"".join(spare_bytes) if spare else None
+
+    def iter_corrected(self, first=0, last=None, progress=False, out=None):
+        """Correct the pages in [first, last) and yield their user data per batch.
+
+        The status of all pages is recorded in self.status, the uncorrectable policy is not applied.
+
+        Args:
+            first (int): Index of the first page.
+            last (int): Index of the page after the last page, defaults to the end of the partition.
+            progress (bool): Show a progress bar.
+            out (np.ndarray): Array with shape (last - first, corrected_pagesize) to write the user data into.
+
+        Yields:
+            np.ndarray: Corrected user data of a batch of pages with shape (pages, corrected_pagesize).
+        """
+        last = self.num_pages if last is None else last
+        with tqdm(total=last - first, disable=not progress) as progress_bar:
+            for batch_first, pages, status in self.iter_corrected_batches(first, last):
+                batch_out = None
+                if out is not None:
+                    batch_out = out[batch_first - first : batch_first - first + len(pages)]
+                yield self.userdata(pages, out=batch_out)
+                progress_bar.update(len(pages))
+
+    def sparse_buffer(self, scratch_dir=None):
+        """Empty buffer for the corrected partition, filled with SparseBuffer.append."""
+        return SparseBuffer(self.layout.erased_userdata, self.num_pages, scratch_dir=scratch_dir)
+
+    def spare_buffer(self, scratch_dir=None):
+        """Empty array for the protected bytes of every page that are not user data, None for partitions without ecc.
+
+        The array is backed by a file in scratch_dir if given, like the corrected buffer.
+        """
+        if not self.has_ecc:
+            return None
+        shape = (self.num_pages, len(self.layout.spare_index))
+        if scratch_dir is None or not shape[0] * shape[1]:
+            return np.empty(shape, dtype="u1")
+        return np.memmap(tempfile.TemporaryFile(dir=scratch_dir), dtype="u1", mode="w+", shape=shape)
+
+    def correct_partition(self, scratch_dir=None):
+        corrected = self.sparse_buffer(scratch_dir)
+        self.spare = self.spare_buffer(scratch_dir)
+        for userdata in self.iter_corrected(progress=True):
+            corrected.append(userdata)
+        self.corrected = corrected.finish()
+        LOGGER.info(f"Corrected {self.corrected_bits} bits")
+        LOGGER.info(f"Stored {self.corrected.num_stored} of {self.num_pages} pages, the other pages are erased")
+        self.log_uncorrectable()
@@ -0,0 +1,108 @@
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+from tqdm import tqdm
+
+from nandtool.stats import Stats
+
+LOGGER = logging.getLogger(__name__)
+
+# state of a worker process, set up once by the pool initializer
+_WORKER = dict()
+
+
+def _init_worker(image, part_conf, stats=False, rereads=()):
+    from nandtool.nand import NAND
+    from nandtool.source import open_source
+
+    _WORKER["source"] = source = open_source(image)
+    _WORKER["nand"] = NAND(
+        source, part_conf, stats=Stats() if stats else None, rereads=[open_source(data) for data in rereads]
+    )
+
+
+def _correct_shard(first, last, spare=False):
+    nand = _WORKER["nand"]
+    nand.corrected_bits = 0
+    data, status, spare = nand.correct_range(first, last, spare)
+    stats_report = None
+    if nand.stats is not None:
+        stats_report = nand.stats.report()
+        nand.stats = Stats()
+    return data, nand.corrected_bits, status, spare, stats_report
+
+
+def shard_pages(nand, jobs, shards_per_job=4, max_blocks=64):
+    """Split the pages of a partition into block aligned ranges.
+
+    Returns:
+        list: (first, last) page index ranges, last exclusive.
+    """
+    blocks_per_shard = max(1, min(max_blocks, -(-nand.num_blocks // (jobs * shards_per_job))))
+    pages_per_shard = blocks_per_shard * nand.layout.pages_per_block
+    return [
+        (first, min(first + pages_per_shard, nand.num_pages))
+        for first in range(0, nand.num_pages, pages_per_shard)
+    ]
+
+
+def iter_corrected_parallel(nand, image_path, jobs, progress=False):
+    """Correct a partition with a pool of worker processes, yielding the corrected user data per shard in order.
+
+    Every worker maps the image itself, so only page ranges and corrected data are sent between processes. At most
+    two shards per worker are in flight, which bounds the memory use for large partitions.
+
+    Args:
+        nand (NAND): Partition to correct.
+        image_path: Path or ImageSource of the image the partition is read from.
+        jobs (int): Number of worker processes.
+        progress (bool): Show a progress bar.
+    """
+    shards = shard_pages(nand, jobs)
+    LOGGER.info(f"Correcting {len(shards)} shards with {jobs} workers")
+
+    shards = iter(shards)
+    pending = deque()
+    # the protected bytes that are not user data are only sent back if the partition keeps them
+    keep_spare = nand.spare is not None
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_init_worker,
+        initargs=(image_path, nand.part_conf, nand.stats is not None, nand.rereads),
+    ) as executor, tqdm(total=nand.num_pages, disable=not progress) as progress_bar:
+        try:
+            for first, last in islice(shards, 2 * jobs):
+                pending.append((first, last, executor.submit(_correct_shard, first, last, keep_spare)))
+            while pending:
+                first, last, future = pending.popleft()
+                data, corrected_bits, status, spare, stats_report = future.result()
+                for next_first, next_last in islice(shards, 1):
+                    pending.append(
+                        (next_first, next_last, executor.submit(_correct_shard, next_first, next_last, keep_spare))
+                    )
+
+                nand.status[first:last] = status
+                if keep_spare:
+                    nand.spare[first:last] = np.frombuffer(spare, "u1").reshape(last - first, -1)
+                nand.corrected_bits += corrected_bits
+                if stats_report is not None:
+                    nand.stats.merge(stats_report)
+                progress_bar.update(last - first)
+                yield data
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+
+
+def correct_partition_parallel(nand, image_path, jobs, scratch_dir=None):
+    """Correct a partition with a pool of worker processes, giving the same result as NAND.correct_partition."""
+    corrected = nand.sparse_buffer(scratch_dir)
+    nand.spare = nand.spare_buffer(scratch_dir)
+    for data in iter_corrected_parallel(nand, image_path, jobs, progress=True):
+        corrected.append(np.frombuffer(data, "u1").reshape(-1, nand.corrected_pagesize))
+    nand.corrected = corrected.finish()
+    LOGGER.info(f"Corrected {nand.corrected_bits} bits")
+    nand.log_uncorrectable()
@@ -0,0 +1,181 @@
+import mmap
+from bisect import bisect_right
+from pathlib import Path
+
+import numpy as np
+
+from nandtool.config import ConfigError, check_image_size
+
+
+class ImageSource:
+    """One or more image files presented as a single image, without copying them into one file.
+
+    Every file is memory mapped. Files are either concatenated in order, or interleaved in units of interleave bytes,
+    e.g. a block or page per die: unit i of the image is unit i // len(paths) of file i % len(paths).
+
+    Args:
+        paths (list): Paths of the image files, in order.
+        interleave (int): Size in bytes of the interleaved units, 0 to concatenate the files.
+    """
+
+    def __init__(self, paths, interleave=0):
+        self.paths = [Path(path) for path in paths]
+        self.interleave = interleave
+        self.files = [open(path, "rb") for path in self.paths]
+        # empty files can not be mapped
+        self.maps = [
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if path.stat().st_size else b""
+            for f, path in zip(self.files, self.paths)
+        ]
+        self.sizes = [len(m) for m in self.maps]
+        if interleave and (len(set(self.sizes)) > 1 or self.sizes[0] % interleave):
+            self.close()
+            raise ValueError(f"Interleaved files must all have the same size, a multiple of {interleave} bytes")
+        self.starts = np.cumsum([0] + self.sizes).tolist()
+        self.size = self.starts[-1]
+        self.arrays = [np.frombuffer(m, "u1") for m in self.maps]
+
+    def __len__(self):
+        return self.size
+
+    def __str__(self):
+        return ", ".join(str(path) for path in self.paths)
+
+    def __getstate__(self):
+        # worker processes map the files themselves
+        return {"paths": self.paths, "interleave": self.interleave}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def close(self):
+        self.arrays = []
+        for m in self.maps:
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in self.files:
+            f.close()
+
+    def locate(self, offset):
+        """File and offset in the file of an image offset, with the number of bytes that follow contiguously."""
+        if self.interleave:
+            unit, within = divmod(offset, self.interleave)
+            index, file_unit = unit % len(self.maps), unit // len(self.maps)
+            return index, file_unit * self.interleave + within, self.interleave - within
+        index = bisect_right(self.starts, offset) - 1
+        return index, offset - self.starts[index], self.sizes[index] - (offset - self.starts[index])
+
+    def view(self, offset, size):
+        """Read [offset, offset + size), a memoryview of a mapped file if the range lies within a single file unit."""
+        size = max(0, min(size, self.size - offset))
+        if size == 0:
+            return b""
+        index, file_offset, length = self.locate(offset)
+        if size <= length:
+            return memoryview(self.maps[index])[file_offset : file_offset + size]
+        pieces = []
+        while size > 0:
+            index, file_offset, length = self.locate(offset)
+            length = min(length, size)
+            pieces.append(memoryview(self.maps[index])[file_offset : file_offset + length])
+            offset += length
+            size -= length
+        return b"".join(pieces)
+
+    def take(self, offsets):
+        """Gather the bytes at an array of image offsets."""
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if self.interleave:
+            unit, within = np.divmod(offsets, self.interleave)
+            index = unit % len(self.maps)
+            file_offsets = unit // len(self.maps) * self.interleave + within
+        else:
+            index = np.searchsorted(self.starts, offsets, side="right") - 1
+            file_offsets = offsets - np.asarray(self.starts)[index]
+        out = np.empty(offsets.shape, dtype="u1")
+        for i, array in enumerate(self.arrays):
+            mask = index == i
+            out[mask] = array[file_offsets[mask]]
+        return out
+
+
+def view(data, offset, size):
+    """Read [offset, offset + size) of an image, which is an ImageSource or a buffer such as bytes or an mmap."""
+    if isinstance(data, ImageSource):
+        return data.view(offset, size)
+    return memoryview(data)[offset : offset + size]
+
+
+def take(data, offsets):
+    """Gather the bytes at an array of offsets of an image, which is an ImageSource or a buffer."""
+    if isinstance(data, ImageSource):
+        return data.take(offsets)
+    return np.frombuffer(data, "u1")[offsets]
+
+
+def image_paths(image):
+    """Paths of the files of an image given as a path or an ImageSource."""
+    if isinstance(image, ImageSource):
+        return image.paths
+    return [Path(image)]
+
+
+def open_source(image):
+    """Open an image given as a path or a list of paths, ImageSources and buffers are returned as is."""
+    if isinstance(image, (ImageSource, bytes, bytearray)):
+        return image
+    if isinstance(image, (list, tuple)):
+        return ImageSource(image)
+    return ImageSource([image])
+
+
+def interleave_size(conf, unit):
+    """Size in bytes of the blocks or pages (with spare area) of all partitions, to interleave image files by.
+
+    Args:
+        conf: Loaded configuration.
+        unit (str): "block" or "page", or None to concatenate the files.
+
+    Returns:
+        int: Interleave size in bytes, 0 if unit is None.
+    """
+    if unit is None:
+        return 0
+    sizes = {
+        conf[partition].layout.blocksize if unit == "block" else conf[partition].layout.blocksize // conf[partition].layout.pages_per_block
+        for partition in conf.partitions
+    }
+    if len(sizes) > 1:
+        raise ConfigError(f"partitions have {unit}s of different sizes, the image files can not be interleaved by {unit}")
+    return sizes.pop()
+
+
+def open_image(paths, conf, interleave=None, size=None):
+    """Open the files of an image and check that all partitions of a configuration lie within it.
+
+    Args:
+        paths (list): Paths of the image files, in order.
+        conf: Loaded configuration.
+        interleave (str): "block" or "page" to interleave the files by, or None to concatenate them.
+        size (int): Size in bytes the image must have, e.g. of another dump of the same chip.
+
+    Returns:
+        ImageSource: Opened image.
+
+    Raises:
+        ConfigError: If the files can not be interleaved or a partition lies beyond the end of the image.
+    """
+    try:
+        source = ImageSource(paths, interleave_size(conf, interleave))
+    except ConfigError:
+        raise
+    except ValueError as e:
+        raise ConfigError(str(e)) from None
+    try:
+        if size is not None and len(source) != size:
+            raise ConfigError(f"image {source} has {len(source)} bytes instead of {size} bytes")
+        check_image_size(conf, len(source))
+    except ConfigError:
+        source.close()
+        raise
+    return source
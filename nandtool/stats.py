@@ -0,0 +1,126 @@
+import json
+import threading
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from time import perf_counter, time
+
+import numpy as np
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0)
+
+
+class Stats:
+    """Thread-safe counters and stage timers of a partition or a mount."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = defaultdict(float)
+        self.max_seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.histograms = dict()
+
+    def add_time(self, stage, seconds, calls=1, histogram=False):
+        """Add the time spent in a stage, optionally keeping a latency histogram of the stage."""
+        with self.lock:
+            self.seconds[stage] += seconds
+            self.calls[stage] += calls
+            self.max_seconds[stage] = max(self.max_seconds[stage], seconds)
+            if histogram:
+                buckets = self.histograms.setdefault(stage, [0] * (len(LATENCY_BUCKETS) + 1))
+                buckets[int(np.searchsorted(LATENCY_BUCKETS, seconds))] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, perf_counter() - start)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += int(value)
+
+    def merge(self, report):
+        """Add the stages and counters of a report of another Stats object, e.g. of a worker process."""
+        for stage, stage_report in report["stages"].items():
+            with self.lock:
+                self.seconds[stage] += stage_report["seconds"]
+                self.calls[stage] += stage_report["calls"]
+                self.max_seconds[stage] = max(self.max_seconds[stage], stage_report["max_seconds"])
+        for name, value in report["counters"].items():
+            self.count(name, value)
+
+    def report(self):
+        with self.lock:
+            stages = {
+                stage: {"seconds": self.seconds[stage], "calls": self.calls[stage], "max_seconds": self.max_seconds[stage]}
+                for stage in self.seconds
+            }
+            for stage, buckets in self.histograms.items():
+                labels = [f"<={bound}s" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+                stages[stage]["histogram"] = dict(zip(labels, buckets))
+            return {"stages": stages, "counters": dict(self.counters)}
+
+
+def stage_timer(stats, stage):
+    """Timer of a stage, or a no-op if stats are not collected."""
+    return nullcontext() if stats is None else stats.timer(stage)
+
+
+def block_report(status, pages_per_block):
+    """Histograms of the bitflips per page of every block with bitflips or uncorrectable pages.
+
+    Returns:
+        list: Per block its index, total flips, uncorrectable pages and the number of pages per flip count.
+    """
+    flips = status["flips"].reshape(-1, pages_per_block)
+    uncorrectable = status["uncorrectable"].reshape(-1, pages_per_block)
+    blocks = []
+    for block in np.flatnonzero(flips.any(axis=1) | uncorrectable.any(axis=1)):
+        blocks.append(
+            {
+                "block": int(block),
+                "flips": int(flips[block].sum()),
+                "uncorrectable_pages": int(uncorrectable[block].sum()),
+                "histogram": np.bincount(flips[block]).tolist(),
+            }
+        )
+    return blocks
+
+
+def read_report(status):
+    """Number of pages recovered from other dumps, per dump index, "vote" or "mixed"."""
+    from nandtool.nand import MIXED_READ, VOTED_READ
+
+    labels = {VOTED_READ: "vote", MIXED_READ: "mixed"}
+    reads, counts = np.unique(status["read"][status["read"] != 0], return_counts=True)
+    return {labels.get(int(read), str(int(read))): int(count) for read, count in zip(reads, counts)}
+
+
+def partition_report(nand):
+    """Stage timers, counters and block histograms of a partition."""
+    report = nand.stats.report() if nand.stats is not None else {"stages": dict(), "counters": dict()}
+    report["corrected_bits"] = nand.corrected_bits
+    report["uncorrectable_pages"] = int(nand.status["uncorrectable"].sum())
+    report["bad_blocks"] = (nand.start + nand.bad_blocks).tolist()
+    report["recovered_pages"] = read_report(nand.status)
+    report["page_histogram"] = np.bincount(nand.status["flips"]).tolist()
+    report["blocks"] = block_report(nand.status, nand.layout.pages_per_block)
+    return report
+
+
+def build_report(partitions, **extra):
+    """Report of all partitions, extra items (e.g. of the mount) are added at the top level."""
+    return {
+        "created": time(),
+        **extra,
+        "partitions": {name: partition_report(nand) for name, nand in partitions.items()},
+    }
+
+
+def write_report(path, report):
+    Path(path).write_text(json.dumps(report, indent=1))
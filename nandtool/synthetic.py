@@ -0,0 +1,380 @@
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from nandtool.nand import BATCH_PAGES, Layout
+
+LOGGER = logging.getLogger(__name__)
+
+# size of the random data written between partitions
+FILL_SIZE = 16 * 1024**2
+
+
+def flip_distribution(spec):
+    """Parse the distribution of the number of bitflips per chunk.
+
+    Args:
+        spec: Number of flips (e.g. 2 or "2"), "poisson:<mean>" or "uniform:<min>-<max>".
+
+    Returns:
+        function: Function drawing an integer array of the given shape from a random generator.
+    """
+    name, _, parameters = str(spec).partition(":")
+    try:
+        if not parameters:
+            flips = int(name)
+            return lambda rng, shape: np.full(shape, flips, dtype=np.int64)
+        if name == "poisson":
+            mean = float(parameters)
+            return lambda rng, shape: rng.poisson(mean, shape)
+        if name == "uniform":
+            low, high = (int(bound) for bound in parameters.split("-"))
+            return lambda rng, shape: rng.integers(low, high + 1, shape)
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid bitflip distribution {spec}, use <flips>, poisson:<mean> or uniform:<min>-<max>")
+
+
+def encode_pages(layout, pages):
+    """Write the ecc of every chunk of a batch of pages in place.
+
+    Chunks are encoded in layout order, so a chunk protecting the ecc of an earlier chunk is encoded over that ecc.
+    Ecc bits that do not fit the layout (shifted out by left_shift_ecc_buf) are lost and show up as bitflips when
+    the page is decoded.
+
+    Args:
+        layout (Layout): Layout of the pages.
+        pages (np.ndarray): Raw pages with shape (pages, raw_pagesize).
+
+    Returns:
+        np.ndarray: Number of ecc bits lost per chunk with shape (pages, chunks).
+    """
+    engine = layout.ecc_engine
+    lost_bits = np.zeros((len(pages), len(layout.ecc_index)), dtype=np.int64)
+    for chunk, (data_index, ecc_index) in enumerate(zip(layout.data_index, layout.ecc_index)):
+        ecc = engine.encode(layout.transform_data(pages[:, data_index]))
+        if ecc.shape[1] != len(ecc_index):
+            raise ValueError(f"Ecc of {ecc.shape[1]} bytes does not fit the {len(ecc_index)} bytes in the layout")
+        pages[:, ecc_index] = layout.revert_ecc(ecc.copy())
+        lost = np.unpackbits(layout.transform_ecc(pages[:, ecc_index]) ^ ecc, axis=1)[:, : engine.ecc_bits]
+        lost_bits[:, chunk] = lost.sum(axis=1)
+    return lost_bits
+
+
+def chunk_bits(layout):
+    """Page bit offsets (byte offset * 8 + bit) of the protected data and ecc bits of every chunk.
+
+    Ecc bits that are shifted out or end up in the padding of the ecc before decoding are left out, flipping them
+    would go unnoticed.
+    """
+    bits = []
+    for data_index, ecc_index in zip(layout.data_index, layout.ecc_index):
+        ecc_bits = np.arange(len(ecc_index) * 8)
+        single_bits = np.zeros((len(ecc_bits), len(ecc_index)), dtype="u1")
+        single_bits[ecc_bits, ecc_bits // 8] = 1 << (ecc_bits % 8)
+        changed = layout.transform_ecc(single_bits) ^ layout.transform_ecc(np.zeros_like(single_bits))
+        visible = np.unpackbits(changed, axis=1)[:, : layout.ecc_engine.ecc_bits].any(axis=1)
+        ecc_bits = ecc_bits[visible]
+        bits.append(
+            np.concatenate(
+                ((data_index[:, None] * 8 + np.arange(8)).ravel(), ecc_index[ecc_bits // 8] * 8 + ecc_bits % 8)
+            )
+        )
+    return bits
+
+
+def flip_bits(layout, pages, rows, flips, rng):
+    """Flip distinct random bits in the protected data and ecc of the chunks of the given pages, in place.
+
+    Args:
+        layout (Layout): Layout of the pages.
+        pages (np.ndarray): Raw pages with shape (pages, raw_pagesize).
+        rows (np.ndarray): Indices of the pages to flip bits in.
+        flips (np.ndarray): Number of bits to flip per chunk with shape (rows, chunks).
+        rng (np.random.Generator): Random generator.
+    """
+    for chunk, bits in enumerate(chunk_bits(layout)):
+        counts = flips[:, chunk]
+        max_flips = int(counts.max(initial=0))
+        if not max_flips:
+            continue
+
+        nbits = len(bits)
+        positions = rng.integers(0, nbits, (len(rows), max_flips))
+        # redraw the positions of chunks that would flip a bit twice
+        while True:
+            sorted_positions = np.sort(positions, axis=1)
+            duplicate = (sorted_positions[:, 1:] == sorted_positions[:, :-1]).any(axis=1)
+            if not duplicate.any():
+                break
+            positions[duplicate] = rng.integers(0, nbits, (int(duplicate.sum()), max_flips))
+
+        offsets = bits[positions]
+        masks = (1 << (offsets % 8)).astype("u1")
+        # positions beyond the number of flips of a chunk are not flipped
+        masks[np.arange(max_flips) >= counts[:, None]] = 0
+        np.bitwise_xor.at(pages, (rows[:, None], offsets // 8), masks)
+
+
+def generate_pages(layout, num_pages, rng, erased_fraction=0.0, flips=0, uncorrectable_fraction=0.0, flip_rng=None):
+    """Generate raw pages with random content and valid ecc, then flip bits in the pages that are not erased.
+
+    Args:
+        layout (Layout): Layout of the pages.
+        num_pages (int): Number of pages.
+        rng (np.random.Generator): Random generator of the page content.
+        erased_fraction (float): Fraction of the pages that is erased (all 0xff).
+        flips: Distribution of the number of bits flipped per chunk, see flip_distribution.
+        uncorrectable_fraction (float): Fraction of the chunks that gets more bitflips than the ecc can correct.
+        flip_rng (np.random.Generator): Random generator of the bitflips, defaults to rng. A separate generator keeps
+            the page content independent of the bitflips.
+
+    Returns:
+        tuple: Pages with shape (num_pages, raw_pagesize), bitflips per chunk with shape (num_pages, chunks) and
+            whether the pages are erased.
+    """
+    flip_rng = rng if flip_rng is None else flip_rng
+    pages = rng.integers(0, 256, (num_pages, layout.pagesize + layout.oobsize), dtype="u1")
+    erased = rng.random(num_pages) < erased_fraction
+    if layout.ecc_engine is None:
+        pages[erased] = 0xFF
+        return pages, np.zeros((num_pages, 0), dtype=np.int64), erased
+
+    chunk_flips = encode_pages(layout, pages)
+    pages[erased] = 0xFF
+    chunk_flips[erased] = 0
+
+    rows = np.flatnonzero(~erased)
+    injected = flip_distribution(flips)(flip_rng, (len(rows), len(layout.chunk_index)))
+    uncorrectable = flip_rng.random(injected.shape) < uncorrectable_fraction
+    injected[uncorrectable] = layout.ecc_engine.t + 1
+    flip_bits(layout, pages, rows, injected, flip_rng)
+    chunk_flips[rows] += injected
+    return pages, chunk_flips, erased
+
+
+def write_pages(f, offset, layout, num_pages, seed, stream=0, progress=False, **options):
+    """Generate pages in batches and write them to an open file at the given offset.
+
+    Every batch has its own random generators derived from the seed, the stream and the batch index, so the content
+    of a page does not depend on the bitflip options.
+
+    Returns:
+        tuple: Bitflips per chunk with shape (num_pages, chunks) and whether the pages are erased.
+    """
+    flips = []
+    erased = []
+    f.seek(offset)
+    with tqdm(total=num_pages, disable=not progress) as progress_bar:
+        for batch, first in enumerate(range(0, num_pages, BATCH_PAGES)):
+            pages, batch_flips, batch_erased = generate_pages(
+                layout,
+                min(BATCH_PAGES, num_pages - first),
+                np.random.default_rng([seed, stream, batch, 0]),
+                flip_rng=np.random.default_rng([seed, stream, batch, 1]),
+                **options,
+            )
+            f.write(pages.tobytes())
+            flips.append(batch_flips)
+            erased.append(batch_erased)
+            progress_bar.update(len(pages))
+    if not flips:
+        return np.zeros((0, len(layout.chunk_index)), dtype=np.int64), np.zeros(0, dtype=bool)
+    return np.concatenate(flips), np.concatenate(erased)
+
+
+def write_image(path, layout_conf, num_blocks, seed=0, erased_fraction=0.0, flips=0, uncorrectable_fraction=0.0):
+    """Write an image of num_blocks generated blocks with a single layout.
+
+    Args:
+        path (Path): Path of the image.
+        layout_conf: Layout configuration.
+        num_blocks (int): Number of blocks.
+        seed (int): Seed of the random generators, the same seed gives the same image.
+        erased_fraction (float): Fraction of the pages that is erased (all 0xff).
+        flips: Distribution of the number of bits flipped per chunk, see flip_distribution.
+        uncorrectable_fraction (float): Fraction of the chunks that gets more bitflips than the ecc can correct.
+
+    Returns:
+        tuple: Bitflips per chunk with shape (pages, chunks) and whether the pages are erased.
+    """
+    layout = Layout(layout_conf)
+    LOGGER.info(f"Generating image {path} of {num_blocks} blocks")
+    with open(path, "wb") as f:
+        return write_pages(
+            f,
+            0,
+            layout,
+            num_blocks * layout.pages_per_block,
+            seed,
+            erased_fraction=erased_fraction,
+            flips=flips,
+            uncorrectable_fraction=uncorrectable_fraction,
+        )
+
+
+def plan_regions(conf, num_blocks=None):
+    """Decide which partition generates which part of the image.
+
+    Partitions without ecc are filled with random data. Partitions with ecc are generated in configuration order,
+    a partition lying entirely within an earlier generated partition is skipped.
+
+    Args:
+        conf: Loaded configuration.
+        num_blocks (int): Size of the image in blocks of the largest block size, defaults to the end of the last
+            partition.
+
+    Returns:
+        tuple: Size of the image, a list of (partition, start offset, end offset) of the generated partitions and the
+            skipped partitions with the (partition, start offset, end offset) of the partition they lie within.
+    """
+    blocksize = max(conf[partition].layout.blocksize for partition in conf.partitions)
+    if num_blocks is not None:
+        size = num_blocks * blocksize
+    else:
+        ends = [(conf[p].endblock + 1) * conf[p].layout.blocksize for p in conf.partitions if conf[p].endblock != -1]
+        if not ends:
+            raise ValueError("All partitions end at the end of the image, the number of blocks is needed")
+        size = max(ends)
+
+    regions = []
+    skipped = dict()
+    for partition in conf.partitions:
+        part = conf[partition]
+        if not Layout(part.layout).ecc_engine:
+            continue
+        start = part.startblock * part.layout.blocksize
+        end = size if part.endblock == -1 else min(size, (part.endblock + 1) * part.layout.blocksize)
+        # whole blocks only
+        end = start + max(0, end - start) // part.layout.blocksize * part.layout.blocksize
+        if end <= start:
+            continue
+        containing = [region for region in regions if region[1] <= start and end <= region[2]]
+        if containing:
+            skipped[partition] = (containing[0][0], start, end)
+            continue
+        regions.append((partition, start, end))
+    return size, regions, skipped
+
+
+def generate_image(
+    path,
+    conf,
+    num_blocks=None,
+    seed=0,
+    erased_fraction=0.0,
+    flips=0,
+    uncorrectable_fraction=0.0,
+    manifest_path=None,
+    config_path=None,
+):
+    """Generate an image for a configuration and write a manifest of the generated bitflips.
+
+    The manifest is a JSON file with the generation options and a summary per partition, next to an npz file with
+    the bitflips per chunk ("<partition>_flips") and the erased pages ("<partition>_erased") of every generated
+    partition. Partitions lying within another partition refer to it with "generated_by". A chunk is uncorrectable
+    when it has more bitflips than the ecc algorithm can correct, although the decoder occasionally miscorrects such
+    a chunk. Generating the image again with the same seed and no bitflips gives the expected corrected content.
+
+    Args:
+        path (Path): Path of the image.
+        conf: Loaded configuration.
+        num_blocks (int): Size of the image in blocks of the largest block size, defaults to the end of the last
+            partition.
+        seed (int): Seed of the random generators, the same seed gives the same image.
+        erased_fraction (float): Fraction of the pages that is erased (all 0xff).
+        flips: Distribution of the number of bits flipped per chunk, see flip_distribution.
+        uncorrectable_fraction (float): Fraction of the chunks that gets more bitflips than the ecc can correct.
+        manifest_path (Path): Path of the manifest, defaults to the image path with suffix .manifest.json.
+        config_path (Path): Path of the configuration, recorded in the manifest.
+
+    Returns:
+        dict: The manifest.
+    """
+    path = Path(path)
+    manifest_path = Path(manifest_path or path.with_name(path.name + ".manifest.json"))
+    arrays_path = manifest_path.with_suffix(".npz")
+    flip_distribution(flips)
+    size, regions, skipped = plan_regions(conf, num_blocks)
+
+    manifest = {
+        "image": str(path),
+        "config": None if config_path is None else str(config_path),
+        "size": size,
+        "seed": seed,
+        "erased_fraction": erased_fraction,
+        "flips": str(flips),
+        "uncorrectable_fraction": uncorrectable_fraction,
+        "arrays": arrays_path.name,
+        "partitions": dict(),
+    }
+    arrays = dict()
+    LOGGER.info(f"Generating image {path} of {size} bytes")
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+        # random data outside the generated partitions
+        rng = np.random.default_rng([seed, len(conf.partitions)])
+        covered = sorted((start, end) for _, start, end in regions)
+        position = 0
+        for start, end in covered + [(size, size)]:
+            f.seek(position)
+            for offset in range(position, start, FILL_SIZE):
+                f.write(rng.bytes(min(FILL_SIZE, start - offset)))
+            position = max(position, end)
+
+        for partition, start, end in regions:
+            layout = Layout(conf[partition].layout)
+            LOGGER.info(f"Generating partition {partition}")
+            chunk_flips, erased = write_pages(
+                f,
+                start,
+                layout,
+                (end - start) // (layout.pagesize + layout.oobsize),
+                seed,
+                stream=list(conf.partitions).index(partition),
+                progress=True,
+                erased_fraction=erased_fraction,
+                flips=flips,
+                uncorrectable_fraction=uncorrectable_fraction,
+            )
+            uncorrectable = chunk_flips > layout.ecc_engine.t
+            arrays[f"{partition}_flips"] = chunk_flips
+            arrays[f"{partition}_erased"] = erased
+            manifest["partitions"][partition] = {
+                "start": start,
+                "end": end,
+                "pages": len(erased),
+                "erased_pages": int(erased.sum()),
+                "flipped_bits": int(chunk_flips.sum()),
+                "uncorrectable_chunks": int(uncorrectable.sum()),
+                "uncorrectable_pages": int(uncorrectable.any(axis=1).sum()),
+            }
+
+    for partition, (containing, start, end) in skipped.items():
+        manifest["partitions"][partition] = {"start": start, "end": end, "generated_by": containing}
+
+    np.savez_compressed(arrays_path, **arrays)
+    manifest_path.write_text(json.dumps(manifest, indent=1))
+    LOGGER.info(f"Wrote manifest {manifest_path}")
+    return manifest
+
+
+def load_manifest(manifest_path):
+    """Load a manifest and the bitflips and erased pages of its partitions.
+
+    Returns:
+        tuple: The manifest and a dict with (bitflips per chunk, erased pages) per partition.
+    """
+    manifest_path = Path(manifest_path)
+    manifest = json.loads(manifest_path.read_text())
+    with np.load(manifest_path.parent / manifest["arrays"]) as arrays:
+        partitions = {
+            partition: (arrays[f"{partition}_flips"], arrays[f"{partition}_erased"])
+            for partition, summary in manifest["partitions"].items()
+            if "generated_by" not in summary
+        }
+    return manifest, partitions
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+import pytest
+
+from nandtool.config import load_config
+from nandtool.synthetic import generate_image
+
+IMAGE_PATH = Path(__file__).parent / "data/test_image.bin"
+
+
+def example_config():
+    return load_config(Path(__file__).parent / "../nandtool/configs/example.toml")
+
+
+def partition_data(nand):
+    """Whole corrected partition, also for partitions that are read straight from the image."""
+    return bytes(nand.read(0, nand.corrected_partition_size))
+
+
+def create_test_image():
+    IMAGE_PATH.parent.mkdir(exist_ok=True)
+    generate_image(IMAGE_PATH, example_config(), seed=0, erased_fraction=0.1, flips="uniform:0-2")
+
+
+@pytest.fixture
+def test_image_data():
+    if not IMAGE_PATH.exists():
+        create_test_image()
+
+    with open(IMAGE_PATH, "rb") as f:
+        return f.read()
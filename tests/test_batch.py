@@ -0,0 +1,93 @@
+import json
+
+import numpy as np
+import pytest
+
+from nandtool.batch import REPORT_NAME, extract_resumable, load_jobs, run_batch
+from nandtool.config import ConfigError
+from nandtool.nand import NAND, build_partitions
+from nandtool.source import ImageSource
+
+from tests.conftest import IMAGE_PATH, example_config, partition_data
+
+MANIFEST = f"""
+[[job]]
+image = "{IMAGE_PATH}"
+config = "example"
+partitions = ["SIMPLE", "ETFS"]
+output_dir = "first"
+
+[[job]]
+image = ["{IMAGE_PATH}"]
+config = "example"
+partitions = ["COMPLEX1"]
+output_dir = "second"
+uncorrectable_policy = "zero"
+
+[[job]]
+image = "missing.bin"
+config = "example"
+output_dir = "third"
+"""
+
+
+def test_batch(tmp_path, test_image_data):
+    manifest_path = tmp_path / "manifest.toml"
+    manifest_path.write_text(MANIFEST)
+    jobs = load_jobs(manifest_path)
+    assert jobs[1]["output_dir"] == tmp_path / "second"
+
+    summaries = run_batch(jobs, concurrency=2, checkpoint_blocks=4)
+    assert "error" in summaries[2]
+    partitions = build_partitions(test_image_data, example_config())
+    for job, names in ((jobs[0], ("SIMPLE", "ETFS")), (jobs[1], ("COMPLEX1",))):
+        report = json.loads((job["output_dir"] / REPORT_NAME).read_text())
+        assert list(report["partitions"]) == list(names)
+        for name in names:
+            assert (job["output_dir"] / name).read_bytes() == partition_data(partitions[name])
+            assert report["partitions"][name]["corrected_bits"] == partitions[name].corrected_bits
+    assert summaries[0]["corrected_bits"] == partitions["SIMPLE"].corrected_bits + partitions["ETFS"].corrected_bits
+
+    # completed jobs are not extracted again
+    assert run_batch(jobs[:1])[0]["raw_bytes"] == 0
+
+    # any error of a job is recorded in its summary
+    summaries = run_batch([dict(jobs[0], config=None), jobs[0]])
+    assert "error" in summaries[0] and "error" not in summaries[1]
+
+
+def test_resume(tmp_path, test_image_data):
+    config = example_config()
+    expected = build_partitions(test_image_data, config)["ETFS"]
+    source = ImageSource([IMAGE_PATH])
+    output_path = tmp_path / "ETFS"
+    nand = NAND(source, config["ETFS"])
+    assert extract_resumable(nand, output_path, [source], checkpoint_blocks=16) == nand.num_pages
+
+    # interrupted after block 40 with garbage written after the checkpoint
+    checkpoint_path = tmp_path / "ETFS.checkpoint.json"
+    checkpoint = json.loads(checkpoint_path.read_text())
+    resume = 40 * nand.layout.pages_per_block
+    (tmp_path / "ETFS.status.partial").write_bytes(nand.status.tobytes())
+    with open(output_path, "r+b") as f:
+        f.seek(resume * nand.corrected_pagesize)
+        f.write(bytes(1000))
+    status = np.load(tmp_path / "ETFS.status")
+    nand = NAND(source, config["ETFS"])
+    partial = NAND(test_image_data, config["ETFS"])
+    partial.correct_range(0, resume)
+    checkpoint.update(pages=resume, corrected_bits=partial.corrected_bits, complete=False)
+    checkpoint_path.write_text(json.dumps(checkpoint))
+
+    assert extract_resumable(nand, output_path, [source]) == nand.num_pages - resume
+    assert output_path.read_bytes() == partition_data(expected)
+    assert nand.corrected_bits == expected.corrected_bits
+    assert (np.load(tmp_path / "ETFS.status") == status).all()
+    source.close()
+
+
+def test_invalid_manifest(tmp_path):
+    manifest_path = tmp_path / "manifest.toml"
+    manifest_path.write_text(MANIFEST.replace('output_dir = "third"', ""))
+    with pytest.raises(ConfigError, match="has no output_dir"):
+        load_jobs(manifest_path)
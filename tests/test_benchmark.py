@@ -0,0 +1,15 @@
+from nandtool.benchmark import layout_styles, run_case
+from nandtool.synthetic import write_image
+
+
+def test_run_case(tmp_path):
+    layouts = layout_styles()
+    image_path = tmp_path / "image.bin"
+    write_image(image_path, layouts["complex"], 2, erased_fraction=0.5, flips=2)
+    eager = run_case(image_path, layouts["complex"])
+    lazy = run_case(image_path, layouts["complex"], lazy=True)
+    for result in (eager, lazy):
+        assert result["uncorrectable_pages"] == 0
+        assert result["pages_per_second"] > 0
+        assert result["first_byte_seconds"] <= result["seconds"]
+    assert eager["corrected_bits"] == lazy["corrected_bits"]
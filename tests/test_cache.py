@@ -0,0 +1,47 @@
+import json
+import os
+
+import numpy as np
+
+from nandtool.cache import CorrectionCache
+from nandtool.nand import build_partitions
+
+from tests.conftest import IMAGE_PATH, example_config, partition_data
+
+
+def test_cache_roundtrip(tmp_path, test_image_data):
+    config = example_config()
+    cache = CorrectionCache(tmp_path)
+    built = build_partitions(test_image_data, config, image_path=IMAGE_PATH, disk_cache=cache)
+    # partitions without ecc are not cached
+    assert len(cache.entries()) == sum(nand.has_ecc for nand in built.values())
+
+    loaded = build_partitions(test_image_data, config, lazy=True, image_path=IMAGE_PATH, disk_cache=cache)
+    for name, nand in built.items():
+        assert partition_data(loaded[name]) == partition_data(nand)
+        assert loaded[name].corrected_bits == nand.corrected_bits
+        assert np.array_equal(loaded[name].status, nand.status)
+
+
+def test_cache_eviction(tmp_path, test_image_data):
+    config = example_config()
+    cache = CorrectionCache(tmp_path)
+    build_partitions(test_image_data, config, image_path=IMAGE_PATH, disk_cache=cache)
+
+    entries = cache.entries()
+    # age the least recently used entry beyond the maximum age
+    os.utime(tmp_path / entries[0]["key"] / "meta.json", (0, 0))
+    cache.evict()
+    assert len(cache.entries()) == len(entries) - 1
+
+    cache.max_size = entries[-1]["disk_size"]
+    cache.evict()
+    assert [entry["key"] for entry in cache.entries()] == [entries[-1]["key"]]
+
+    digests = json.loads((tmp_path / "digests.json").read_text())
+    assert list(digests.values()) == [cache.file_digest(IMAGE_PATH)]
+    cache.purge()
+    assert cache.entries() == []
+    # digests of image files without entries are dropped, no temporary files are left behind
+    assert json.loads((tmp_path / "digests.json").read_text()) == {}
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,81 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from nandtool.config import ConfigError, check_image_size, get_configs, load_config
+from nandtool.logger import get_git_revision_hash
+
+CONFIG = """
+partitions = ["DATA"]
+
+[bch4]
+t = 4
+poly = 8219
+
+[layout]
+pagesize = 2048
+oobsize = 64
+pages_per_block = 64
+ecc_protected_data = [[[0, 512]], [[512, 1024]], [[1024, 1536]], [[1536, 2048]]]
+user_data = [[[0, 512]], [[512, 1024]], [[1024, 1536]], [[1536, 2048]]]
+ecc = [[[2050, 2057]], [[2064, 2071]], [[2078, 2085]], [[2092, 2099]]]
+ecc_algorithm = "bch4"
+
+[DATA]
+startblock = 2
+endblock = 9
+layout = "layout"
+"""
+
+
+def test_bundled_configs():
+    for config_path in get_configs().values():
+        conf = load_config(config_path)
+        for partition in conf.partitions:
+            assert conf[partition].layout.blocksize > 0
+
+
+def test_load_config(tmp_path):
+    config_path = tmp_path / "config.toml"
+    config_path.write_text(CONFIG)
+    conf = load_config(config_path)
+    assert load_config(config_path) is conf
+    assert conf.DATA.layout.ecc_algorithm == {"t": 4, "poly": 8219}
+    assert conf.DATA.layout.left_shift_ecc_buf == 0
+    assert conf.DATA.skip_bad_blocks is False
+    with pytest.raises(AttributeError):
+        conf.DATA.startblock = 0
+
+    check_image_size(conf, 10 * conf.DATA.layout.blocksize)
+    with pytest.raises(ConfigError, match="spans blocks 2 to 9"):
+        check_image_size(conf, 9 * conf.DATA.layout.blocksize)
+
+
+@pytest.mark.parametrize(
+    "old, new, message",
+    [
+        ("[[2092, 2099]]]", "[[2092, 2098]]]", "has 6 ecc bytes"),
+        ("[[1536, 2048]]]\nuser", "[[1536, 2048]], [[0, 1]]]\nuser", "5 chunks of ecc_protected_data"),
+        ("[[2050, 2057]]", "[[2050, 2200]]", "invalid interval"),
+        ('layout = "layout"', 'layout = "missing"', "layout missing is not defined"),
+        ("endblock = 9", "endblock = 1", "endblock of partition DATA"),
+        ('ecc_algorithm = "bch4"', 'ecc_algorithm = "bch4"\nuncorrectable_policy = "skip"', "uncorrectable_policy"),
+        ("poly = 8219", 'poly = 8219\ntype = "crc"', "must be one of bch, hamming, rs"),
+        ("poly = 8219", "poly = 8219\nstep = 256", "unknown parameters step"),
+    ],
+)
+def test_invalid_config(tmp_path, old, new, message):
+    config_path = tmp_path / "config.toml"
+    config_path.write_text(CONFIG.replace(old, new, 1))
+    with pytest.raises(ConfigError, match=message):
+        load_config(config_path)
+
+
+def test_git_revision_hash():
+    package_dir = Path(__file__).parent.parent
+    try:
+        expected = subprocess.check_output(["git", "-C", str(package_dir), "rev-parse", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip("not in a git repository")
+    assert get_git_revision_hash(package_dir / "nandtool") == expected
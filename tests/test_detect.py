@@ -0,0 +1,24 @@
+from nandtool.config import load_config
+from nandtool.detect import detect, layout_toml
+from nandtool.nand import Layout
+from nandtool.synthetic import write_image
+
+from tests.conftest import example_config
+
+
+def test_detect(tmp_path):
+    layout_conf = example_config()["ETFS"].layout
+    image_path = tmp_path / "etfs.bin"
+    write_image(image_path, layout_conf, 16, seed=3, flips="uniform:0-1")
+
+    results = detect(image_path, samples=64, jobs=1, geometries=((2048, 64),))
+    best = next(result for result in results if result["source"] == "search")
+    assert best["score"] > 0.9
+    layout = Layout(best["layout"])
+    expected = Layout(layout_conf)
+    assert layout.ecc == expected.ecc and layout.protected_data == expected.protected_data
+    assert layout.left_shift == expected.left_shift
+
+    config_path = tmp_path / "detected.toml"
+    config_path.write_text(layout_toml(best["layout"]))
+    assert Layout(load_config(config_path).DATA.layout).ecc == expected.ecc
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from nandtool.config import ConfigError, load_config
+from nandtool.ecc import BCHEngine, HammingEngine, RSEngine
+from nandtool.nand import NAND, Layout
+from nandtool.synthetic import generate_pages
+
+ENGINES = [
+    (BCHEngine(8219, 4), 512),
+    (HammingEngine(256), 256),
+    (HammingEngine(512, "smartmedia"), 512),
+    (RSEngine(8), 200),
+    (RSEngine(8, symbol_size=10, fcr=1), 512),
+]
+
+
+@pytest.mark.parametrize("engine, length", ENGINES)
+def test_engine(engine, length):
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 256, (200, length), dtype="u1")
+    ecc = engine.encode(data)
+    assert ecc.shape == (200, engine.ecc_bytes)
+    assert (engine.correct(data.copy(), ecc.copy()) == 0).all()
+
+    # up to t bitflips per chunk in the data and ecc
+    flips = rng.integers(0, engine.t + 1, len(data))
+    codewords = np.unpackbits(np.concatenate((data, ecc), axis=1), axis=1)
+    for row, count in enumerate(flips):
+        codewords[row, rng.choice(length * 8 + engine.ecc_bits, count, replace=False)] ^= 1
+    flipped = np.packbits(codewords, axis=1)
+    flipped_data, flipped_ecc = flipped[:, :length].copy(), flipped[:, length:].copy()
+    assert (engine.correct(flipped_data, flipped_ecc) == flips).all()
+    assert (flipped_data == data).all()
+    assert (flipped_ecc == ecc).all()
+
+
+def test_hamming():
+    data = np.zeros((2, 256), dtype="u1")
+    data[0, 0x0F] = 1
+    data[1] = 0xFF
+    assert HammingEngine(256, "smartmedia").encode(data).tolist() == [[0x55, 0xAA, 0xAB], [0xFF, 0xFF, 0xFF]]
+    assert HammingEngine(256).encode(data).tolist() == [[0xAA, 0x55, 0xAB], [0xFF, 0xFF, 0xFF]]
+
+    # two bitflips are detected
+    engine = HammingEngine(512)
+    data = np.random.default_rng(0).integers(0, 256, (1, 512), dtype="u1")
+    ecc = engine.encode(data)
+    data[0, 3] ^= 0x11
+    assert engine.correct(data, ecc).tolist() == [-1]
+
+
+CONFIG = """
+partitions = ["DATA"]
+
+[ecc]
+{ecc_algorithm}
+
+[layout]
+pagesize = 2048
+oobsize = 64
+pages_per_block = 64
+ecc_protected_data = {protected_data}
+user_data = [[[0, 2048]]]
+ecc = {ecc}
+ecc_algorithm = "ecc"
+
+[DATA]
+startblock = 0
+endblock = 0
+layout = "layout"
+"""
+
+
+@pytest.mark.parametrize(
+    "ecc_algorithm, chunk, ecc_bytes",
+    [
+        ('type = "hamming"', 256, 3),
+        ('type = "hamming"\nstep = 512\nbyte_order = "smartmedia"', 512, 3),
+        ('type = "rs"\nnsym = 8\nsymbol_size = 10', 512, 10),
+    ],
+)
+def test_layout(tmp_path, ecc_algorithm, chunk, ecc_bytes):
+    chunks = 2048 // chunk
+    config_path = tmp_path / "config.toml"
+    config_path.write_text(
+        CONFIG.format(
+            ecc_algorithm=ecc_algorithm,
+            protected_data=[[[i * chunk, (i + 1) * chunk]] for i in range(chunks)],
+            ecc=[[[2050 + i * ecc_bytes, 2050 + (i + 1) * ecc_bytes]] for i in range(chunks)],
+        )
+    )
+    config = load_config(config_path)
+    layout = Layout(config.DATA.layout)
+    pages, flips, erased = generate_pages(
+        layout, 64, np.random.default_rng(1), erased_fraction=0.25, flips=1, flip_rng=np.random.default_rng(2)
+    )
+    clean, _, _ = generate_pages(layout, 64, np.random.default_rng(1), flip_rng=np.random.default_rng(2))
+
+    nand = NAND(pages.tobytes(), config.DATA)
+    corrected, status = nand.correct_pages(nand.raw_pages(0, 64))
+    assert not status["uncorrectable"].any()
+    assert (status["flips"] == flips.sum(axis=1)).all()
+    assert (corrected[~erased][:, :2048] == clean[~erased][:, :2048]).all()
+
+    # the ecc must have the size of the algorithm
+    invalid_path = tmp_path / "invalid.toml"
+    invalid_path.write_text(config_path.read_text().replace(f"[2050, {2050 + ecc_bytes}]", f"[2050, {2049 + ecc_bytes}]"))
+    with pytest.raises(ConfigError, match=f"has {ecc_bytes - 1} ecc bytes"):
+        load_config(invalid_path)
@@ -0,0 +1,42 @@
+import numpy as np
+
+from nandtool.etfs import ERASED_FID, ETFSIndex
+from nandtool.nand import NAND, Layout, PageCache
+from nandtool.synthetic import encode_pages, generate_pages
+
+from tests.conftest import example_config
+
+
+def test_etfs_index():
+    config = example_config()
+    layout = Layout(config["ETFS"].layout)
+    rng = np.random.default_rng(0)
+    pages, _, _ = generate_pages(layout, 2 * layout.pages_per_block, rng)
+
+    # (fid, cluster, sequence) per page, cluster 1 of fid 7 is rewritten and cluster 2 of fid 3 is never written
+    transactions = [(7, 0, 1), (7, 1, 2), (3, 0, 3), (3, 3, 4), (7, 1, 5), (7, 1, 4)]
+    etfs = layout.etfs_layout
+    for page, (fid, cluster, sequence) in zip(pages, transactions):
+        page[slice(*etfs["fid"])] = np.frombuffer(fid.to_bytes(2, "little"), "u1")
+        page[slice(*etfs["cluster"])] = np.frombuffer(cluster.to_bytes(4, "little"), "u1")
+        page[slice(*etfs["sequence"])] = np.frombuffer(sequence.to_bytes(4, "little"), "u1")
+    pages[len(transactions) :] = 0xFF
+    pages[len(transactions) :, slice(*etfs["fid"])] = np.frombuffer(ERASED_FID.to_bytes(2, "little"), "u1")
+    encode_pages(layout, pages[: len(transactions)])
+    clusters = pages[:, : layout.pagesize]
+
+    part_conf = {"startblock": 0, "endblock": -1, "layout": config["ETFS"].layout}
+    built = NAND(pages.tobytes(), part_conf)
+    built.correct_partition()
+    lazy = NAND(pages.tobytes(), part_conf, cache=PageCache())
+    for nand in (built, lazy):
+        index = ETFSIndex(nand)
+        assert sorted(index.files) == [3, 7]
+        assert index.files[7].tolist() == [0, 4]
+        assert index.read(7, 0, 2 * layout.pagesize) == clusters[[0, 4]].tobytes()
+        assert index.file_size(3) == 4 * layout.pagesize
+        assert index.read(3, layout.pagesize, 2 * layout.pagesize) == bytes(2 * layout.pagesize)
+        assert index.read(3, 3 * layout.pagesize + 10, 100) == clusters[3, 10:110].tobytes()
+
+    # indexing a lazy partition fills the page cache
+    assert len(lazy.cache) == lazy.num_pages
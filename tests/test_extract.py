@@ -0,0 +1,40 @@
+import json
+
+import numpy as np
+
+from nandtool.extract import extract_partition
+from nandtool.nand import NAND, build_partitions
+
+from tests.conftest import IMAGE_PATH, example_config, partition_data
+
+
+def test_extract_partition(tmp_path, test_image_data):
+    config = example_config()
+    partitions = build_partitions(test_image_data, config)
+
+    for name in ("COMPLEX1", "RAW"):
+        extract_partition(NAND(test_image_data, config[name]), tmp_path / name)
+        assert (tmp_path / name).read_bytes() == partition_data(partitions[name])
+
+    nand = NAND(test_image_data, config["ETFS"])
+    extract_partition(nand, tmp_path / "ETFS", jobs=2, image_path=IMAGE_PATH)
+    assert (tmp_path / "ETFS").read_bytes() == bytes(partitions["ETFS"].corrected)
+    assert nand.corrected_bits == partitions["ETFS"].corrected_bits
+    assert (np.load(tmp_path / "ETFS.status") == partitions["ETFS"].status).all()
+
+
+def test_extract_sparse(tmp_path, test_image_data, caplog):
+    config = example_config()
+    nand = build_partitions(test_image_data, config)["SIMPLE"]
+    extract_partition(NAND(test_image_data, config["SIMPLE"]), tmp_path / "SIMPLE", sparse=True)
+    assert "read as 0x00 instead of 0xff" in caplog.text
+
+    data = bytearray((tmp_path / "SIMPLE").read_bytes())
+    erased = json.loads((tmp_path / "SIMPLE.erased.json").read_text())
+    extents = erased["extents"]
+    assert erased["fill"] == 0
+    assert [tuple(extent) for extent in extents] == nand.corrected.erased_extents()
+    for start, end in extents:
+        assert not any(data[start:end])
+        data[start:end] = b"\xff" * (end - start)
+    assert data == bytes(nand.corrected)
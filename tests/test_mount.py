@@ -0,0 +1,122 @@
+import io
+import json
+import stat
+import sys
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from nandtool.nand import NAND, build_partitions
+from nandtool.source import open_image
+from nandtool.synthetic import encode_pages, generate_pages
+
+from tests.conftest import IMAGE_PATH, example_config, partition_data
+
+try:
+    import fuse  # noqa: F401
+except (ImportError, OSError):
+    # fusepy needs libfuse to import, the operations are called directly without mounting
+    fuse = types.ModuleType("fuse")
+    fuse.FUSE = None
+    fuse.Operations = object
+    fuse.FuseOSError = type("FuseOSError", (OSError,), {})
+    sys.modules["fuse"] = fuse
+
+from nandtool.mount import FuseNAND  # noqa: E402
+
+
+def read_file(fs, path, chunk_size=None):
+    """Read a whole file of the mount, in sequential reads of chunk_size bytes if given."""
+    size = fs.getattr(path)["st_size"]
+    chunk_size = chunk_size or size
+    return b"".join(bytes(fs.read(path, chunk_size, offset, None)) for offset in range(0, size, chunk_size))
+
+
+def test_mount_files(tmp_path, test_image_data):
+    config = example_config()
+    expected = build_partitions(test_image_data, config)
+    fs = FuseNAND(open_image([IMAGE_PATH], config), tmp_path, config, stats=True)
+
+    entries = set(fs.readdir("/", None))
+    assert set(expected) <= entries
+    assert ".stats" in entries
+    for name, nand in expected.items():
+        assert fs.getattr(f"/{name}")["st_size"] == nand.corrected_partition_size
+        assert read_file(fs, f"/{name}") == partition_data(nand)
+
+        pages = read_file(fs, f"/{name}.pages")
+        assert len(pages) == nand.num_pages * nand.raw_pagesize
+        assert pages == nand.read_pages(0, len(pages))
+        oob = read_file(fs, f"/{name}.oob")
+        assert len(oob) == nand.num_pages * nand.layout.oobsize
+        assert oob == nand.read_pages(0, len(oob), oob=True)
+
+        assert (f"{name}.status" in entries) == nand.has_ecc
+        if nand.has_ecc:
+            assert np.array_equal(np.load(io.BytesIO(read_file(fs, f"/{name}.status"))), nand.status)
+
+    assert "ETFS.files" in entries
+    report = json.loads(read_file(fs, "/.stats"))
+    assert set(report["partitions"]) == set(expected)
+    assert report["fuse"]["counters"]["read_bytes"] > 0
+    fs.close()
+
+
+def test_mount_lazy_readahead(tmp_path, test_image_data):
+    config = example_config()
+    expected = build_partitions(test_image_data, config)["SIMPLE"]
+    fs = FuseNAND(open_image([IMAGE_PATH], config), tmp_path, config, lazy=True, readahead=8, stats=True)
+    nand = fs.partitions["SIMPLE"]
+    assert nand.corrected is None
+
+    # sequential reads correct the following pages in the background
+    size = 3 * nand.corrected_pagesize
+    data = b"".join(bytes(fs.read("/SIMPLE", size, offset, None)) for offset in (0, size))
+    # the readahead runs on a single worker, wait for it
+    fs.executor.submit(lambda: None).result()
+    assert all((nand, index) in fs.cache for index in range(6 + 8))
+    data += bytes(fs.read("/SIMPLE", size, 2 * size, None))
+    assert data == partition_data(expected)[: 3 * size]
+
+    # the page files of lazy partitions are corrected through the same cache
+    raw_size = 4 * nand.raw_pagesize
+    assert bytes(fs.read("/SIMPLE.pages", raw_size, 0, None)) == expected.read_pages(0, raw_size)
+    assert np.array_equal(np.load(io.BytesIO(read_file(fs, "/SIMPLE.status")))[:14], expected.status[:14])
+
+    report = json.loads(read_file(fs, "/.stats"))
+    assert report["fuse"]["cache"]["hits"] == 3
+
+    # concurrent reads from several FUSE threads
+    size = 4096
+    offsets = range(0, nand.corrected_partition_size, size)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda offset: bytes(fs.read("/SIMPLE", size, offset, None)), offsets))
+    assert b"".join(results) == partition_data(expected)
+    fs.close()
+
+
+def test_mount_etfs(tmp_path, test_image_data):
+    config = example_config()
+    nand = NAND(test_image_data, config["ETFS"])
+    layout = nand.layout
+
+    # the first two pages of the partition hold the clusters of fid 7
+    pages, _, _ = generate_pages(layout, 2, np.random.default_rng(0))
+    etfs = layout.etfs_layout
+    for cluster, page in enumerate(pages):
+        page[slice(*etfs["fid"])] = np.frombuffer((7).to_bytes(2, "little"), "u1")
+        page[slice(*etfs["cluster"])] = np.frombuffer(cluster.to_bytes(4, "little"), "u1")
+        page[slice(*etfs["sequence"])] = np.frombuffer((cluster + 1).to_bytes(4, "little"), "u1")
+    encode_pages(layout, pages)
+    image = bytearray(test_image_data)
+    start = nand.page_offset(0)
+    image[start : start + pages.nbytes] = pages.tobytes()
+    image_path = tmp_path / "image.bin"
+    image_path.write_bytes(image)
+
+    fs = FuseNAND(open_image([image_path], config), tmp_path, config)
+    assert "7" in fs.readdir("/ETFS.files", None)
+    assert stat.S_ISDIR(fs.getattr("/ETFS.files")["st_mode"])
+    assert read_file(fs, "/ETFS.files/7") == pages[:, : layout.pagesize].tobytes()
+    fs.close()
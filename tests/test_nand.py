@@ -1,86 +1,27 @@
-import os
-from pathlib import Path
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import bchlib
+import numpy as np
 import pytest
 
-from nandtool.config import load_config
-from nandtool.nand import NAND, Layout, build_partitions, modify_buffer
-
-
-@pytest.fixture
-def test_image_data():
-    path = Path(__file__).parent / "data/test_image.bin"
-    if not path.exists():
-        create_test_image()
-
-    with open(path, "rb") as f:
-        return f.read()
-
-
-def example_config():
-    return load_config(Path(__file__).parent / "../nandtool/configs/example.toml")
-
-
-def encode(data, config):
-    data = modify_buffer(data, config.data_invert, config.ecc_reverse)
-    return data
-
-
-def decode(ecc, config):
-    if config.left_shift == 4:
-        ecc = bytes.fromhex("0" + ecc.hex()[:-1])
-    ecc = modify_buffer(ecc, config.ecc_invert, config.ecc_reverse)
-    return ecc
-
-
-def create_page(config):
-    raw_page_size = config.pagesize + config.oobsize
-    start_data = bytearray(os.urandom(raw_page_size))
-
-    for chunk_data_ranges, chunk_ecc_ranges in zip(config.protected_data, config.ecc):
-        chunk_data = b"".join(start_data[start:end] for start, end in chunk_data_ranges)
-
-        enc_data = encode(chunk_data, config)
-        enc_ecc = config.bch.encode(enc_data)
-        chunk_ecc = decode(enc_ecc, config)
-
-        for start, end in chunk_ecc_ranges:
-            assert (
-                len(chunk_ecc) == end - start
-            ), f"length of ecc {len(chunk_ecc)} not equal to expected {end} - {start}"
-            start_data = start_data[:start] + chunk_ecc + start_data[end:]
-
-    return start_data
-
-
-def create_test_image():
-    config = example_config()
-
-    partition_data = {}
-    for partition in config.partitions:
-        if partition == "RAW":
-            continue
-
-        startblock = config[partition].startblock
-        endblock = config[partition].endblock
-        layout = Layout(config[partition].layout)
-        num_pages = layout.pages_per_block
-
-        n = (endblock - startblock + 1) * num_pages
-        partition_data[(startblock, endblock)] = b"".join(
-            [create_page(layout)[0] for _ in range(n)]
-        )
-
-    with open(Path(__file__).parent / "data/test_image.bin", "wb") as f:
-        partition_data = sorted(partition_data.items())
-        for i, ((start, end), data) in enumerate(partition_data):
-            _, previous_end = partition_data[i - 1][0]
-            if start - previous_end - 1 > 0:
-                block_len = len(data) // (end - start + 1)
-                n = start - previous_end - 1
-                f.write(bytearray(os.urandom(n * block_len)))
-            f.write(data)
+from nandtool.nand import (
+    NAND,
+    VOTED_READ,
+    Layout,
+    PageCache,
+    SparseBuffer,
+    build_partitions,
+    modify_buffer,
+    page_runs,
+    shift_left,
+    shift_right,
+    translate_table,
+)
+from nandtool.stats import Stats
+from nandtool.synthetic import flip_bits, generate_pages
+
+from tests.conftest import example_config, partition_data
 
 
 def test_modify_buffer():
@@ -100,7 +41,7 @@ def test_modify_buffer():
     assert modify_buffer(None) == None
 
 
-def test_correct_chunk():
+def test_correct_chunk(test_image_data):
     config = example_config()
     nand = NAND(test_image_data, config["SIMPLE"])
 
@@ -126,3 +67,347 @@ def test_correct_chunk():
 def test_image(test_image_data):
     config = example_config()
     build_partitions(test_image_data, config)
+
+
+def test_lazy_read(test_image_data):
+    config = example_config()
+    eager = build_partitions(test_image_data, config)
+    cache = PageCache(max_size=4 * 2112)
+    lazy = build_partitions(test_image_data, config, lazy=True, cache=cache)
+
+    for name, nand in lazy.items():
+        assert nand.corrected is None
+        expected = partition_data(eager[name])
+        for offset, size in ((0, 100), (2000, 5000), (len(expected) - 10, 100)):
+            assert nand.read(offset, size) == expected[offset : offset + size]
+        assert nand.read(len(expected), 10) == b""
+    assert cache.size <= cache.max_size
+
+
+def test_concurrent_lazy_read(test_image_data):
+    config = example_config()
+    eager = build_partitions(test_image_data, config)
+    lazy = build_partitions(test_image_data, config, lazy=True, cache=PageCache())
+    nand, expected = lazy["SIMPLE"], bytes(eager["SIMPLE"].corrected)
+    nand.cache_pages(0, 8)
+    assert len(nand.cache) == 8
+
+    size = 4096
+    offsets = list(range(0, len(expected), size))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda offset: nand.read(offset, size), offsets))
+    assert b"".join(results) == expected
+    assert nand.corrected_bits == eager["SIMPLE"].corrected_bits
+
+
+def test_cached_read_during_correction(test_image_data):
+    nand = build_partitions(test_image_data, example_config(), lazy=True, cache=PageCache())["SIMPLE"]
+    expected = nand.read(0, 4096)
+
+    # a correction holding the partition lock does not block reads of cached pages
+    locked, release = threading.Event(), threading.Event()
+
+    def correct():
+        with nand.lock:
+            locked.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=correct)
+    thread.start()
+    locked.wait()
+    assert nand.read(0, 4096) == expected
+    assert thread.is_alive()
+    release.set()
+    thread.join()
+
+    assert page_runs([0, 1, 2, 3, 5, 6, 9], 3) == [(0, 3), (3, 4), (5, 7), (9, 10)]
+
+
+def test_read_pages(test_image_data):
+    config = example_config()
+    cache = PageCache()
+    built = build_partitions(test_image_data, config, cache=cache, policy="raw")
+    lazy = build_partitions(test_image_data, config, lazy=True, cache=cache, policy="raw")
+
+    # built partitions are not corrected again, lazy partitions go through the page cache
+    for partitions in (built, lazy):
+        for name, nand in partitions.items():
+            reference = NAND(test_image_data, config[name])
+            pages = np.concatenate([batch for _, batch, _ in reference.iter_corrected_batches()])
+            unprotected = nand.layout.unprotected_index
+            pages[:, unprotected] = reference.raw_pages(0, nand.num_pages)[:, unprotected]
+            expected = pages.tobytes()
+            oob = pages[:, nand.layout.pagesize :].tobytes()
+            for offset, size in ((0, 100), (2000, 5000), (len(expected) - 10, 100)):
+                assert nand.read_pages(offset, size) == expected[offset : offset + size]
+            assert nand.read_pages(len(expected), 10) == b""
+            assert nand.read_pages(60, 200, oob=True) == oob[60:260]
+        assert bool(len(cache)) == (partitions is lazy)
+
+
+def test_read_pages_unprotected(test_image_data):
+    config = example_config()
+    nand = NAND(test_image_data, config["SIMPLE"])
+    # a bad block marker, which is outside the protected data and ecc
+    image = bytearray(test_image_data)
+    image[nand.page_offset(0) + nand.layout.pagesize] = 0x00
+    image = bytes(image)
+    raw = NAND(image, config["SIMPLE"]).raw_pages(0, nand.num_pages)
+    unprotected = nand.layout.unprotected_index
+    assert nand.layout.pagesize in unprotected
+
+    built = build_partitions(image, config)["SIMPLE"]
+    lazy = build_partitions(image, config, lazy=True, cache=PageCache())["SIMPLE"]
+    for partition in (built, lazy):
+        pages = np.frombuffer(partition.read_pages(0, raw.nbytes), "u1").reshape(raw.shape)
+        assert (pages[:, unprotected] == raw[:, unprotected]).all()
+        assert partition.read_pages(0, 4, oob=True) == raw[0, nand.layout.pagesize : nand.layout.pagesize + 4].tobytes()
+
+
+def test_page_cache():
+    cache = PageCache(max_size=10)
+    cache.put(0, b"a" * 4)
+    cache.put(1, b"b" * 4)
+    assert cache.get(0) == b"a" * 4
+    cache.put(2, b"c" * 4)
+    assert cache.get(1) is None, "least recently used page should have been evicted"
+    assert cache.get(0) == b"a" * 4
+    assert cache.size == 8
+
+
+def test_erased_page():
+    config = example_config()
+    nand = NAND(b"", config["SIMPLE"])
+    raw_pagesize = nand.layout.pagesize + nand.layout.oobsize
+
+    page = b"\xff" * raw_pagesize
+    assert nand.correct_page(page) == (page, False)
+
+    # a few bitflips in an erased chunk are restored instead of decoded
+    flipped = bytearray(page)
+    flipped[10] = 0xFE
+    flipped[2050] = 0xEF
+    nand.layout.erased_threshold = 4
+    corrected, uncorrectable = nand.correct_page(bytes(flipped))
+    assert corrected == page and not uncorrectable
+    assert nand.corrected_bits == 2
+
+    zero_bits = nand.count_zero_bits(np.frombuffer(flipped * 2, "u1").reshape(2, -1))
+    assert zero_bits.tolist() == [[2, 0, 0, 0]] * 2
+
+
+def test_compile_plans():
+    config = example_config()
+    layout = Layout(config["COMPLEX1"].layout)
+
+    # out of order intervals are gathered in the order of the layout
+    assert len(layout.data_index[1]) == 0x410
+    assert layout.data_index[1][0x3E2 : 0x3E2 + 0x12].tolist() == list(range(0x802, 0x810)) + [0x800, 0x801, 0x81E, 0x81F]
+    assert layout.ecc_index[0].tolist() == list(range(0x410, 0x41E))
+    assert layout.user_runs == [(0, 0, 0x410), (0x410, 0x41E, 0x3E2), (0x7F2, 0x802, 0xE)]
+
+    nand = NAND(b"", config["ETFS"])
+    page = np.arange(2112, dtype=np.uint16).astype("u1").reshape(1, -1)
+    userdata = nand.userdata(page)[0]
+    assert len(userdata) == 2048 + 16
+    assert userdata[:2048].tobytes() == page[0, :2048].tobytes()
+    assert userdata[2048:].tobytes() == (
+        page[0, 2060:2062].tobytes() + b"\x00" * 2 + page[0, 2056:2060].tobytes()
+        + page[0, 2050:2052].tobytes() + b"\x00" * 2 + page[0, 2052:2056].tobytes()
+    )
+
+
+def test_scratch_buffer(tmp_path, test_image_data):
+    config = example_config()
+    in_memory = NAND(test_image_data, config["COMPLEX1"])
+    in_memory.correct_partition()
+    file_backed = NAND(test_image_data, config["COMPLEX1"])
+    file_backed.correct_partition(scratch_dir=tmp_path)
+
+    assert isinstance(in_memory.corrected.data, bytearray)
+    assert bytes(file_backed.corrected) == bytes(in_memory.corrected)
+    view = file_backed.read(100, 200)
+    assert isinstance(view, memoryview) and view == bytes(in_memory.corrected)[100:300]
+
+    assert isinstance(file_backed.spare, np.memmap) and not isinstance(in_memory.spare, np.memmap)
+    size = 4 * in_memory.raw_pagesize
+    assert file_backed.read_pages(0, size) == in_memory.read_pages(0, size)
+
+
+def test_correct_chunks():
+    config = example_config()
+    layout = Layout(config["SIMPLE"].layout)
+    pages, _, _ = generate_pages(layout, 8, np.random.default_rng(0))
+    nand = NAND(pages.tobytes(), config["SIMPLE"])
+    data = pages[:, nand.layout.data_index[0]].copy()
+    ecc = pages[:, nand.layout.ecc_index[0]].copy()
+
+    data[1, 5] ^= 0x10
+    data[2, 7] ^= 0x03
+    ecc[3] = 0
+    corrected_data, corrected_ecc, flips = nand.correct_chunks(data, ecc)
+
+    assert flips.tolist() == [0, 1, 2, -1, 0, 0, 0, 0]
+    assert nand.corrected_bits == 3
+    assert np.array_equal(corrected_data[:3], pages[:3, nand.layout.data_index[0]])
+    assert np.array_equal(corrected_data[3], data[3]), "uncorrectable chunks are left as is"
+    assert np.array_equal(corrected_ecc[:3], pages[:3, nand.layout.ecc_index[0]])
+
+
+def test_transforms():
+    data = b"\xde\x3d\x54\xd9\x9b\xfa\xd6\x65\x3b\xff"
+    array = np.frombuffer(data, "u1").reshape(1, -1)
+
+    for reverse in (False, True):
+        for invert in (False, True):
+            table = translate_table(reverse, invert)
+            expected = modify_buffer(data, reverse=reverse, invert=invert)
+            assert (array if table is None else table[array]).tobytes() == expected
+
+    # a shift of 4 bits matches the nibble shift on the hex string
+    assert shift_left(array, 4).tobytes() == bytes.fromhex(data.hex()[1:] + "0")
+    assert shift_right(array, 4).tobytes() == bytes.fromhex("0" + data.hex()[:-1])
+    for bits in (1, 7, 8, 12, 20):
+        number = int.from_bytes(data, "big")
+        mask = (1 << (8 * len(data))) - 1
+        assert shift_left(array, bits).tobytes() == ((number << bits) & mask).to_bytes(len(data), "big")
+        assert shift_right(array, bits).tobytes() == (number >> bits).to_bytes(len(data), "big")
+
+
+def test_bad_blocks():
+    config = example_config()
+    layout_conf = dict(config["SIMPLE"].layout)
+    layout = Layout(layout_conf)
+    pages, _, _ = generate_pages(layout, 4 * layout.pages_per_block, np.random.default_rng(0))
+    # the first oob byte is not used by the simple layout, a marker in the last page of block 2 marks it bad
+    marker = layout.pagesize
+    pages[:, marker] = 0xFF
+    blocks = pages.reshape(4, layout.pages_per_block, -1)
+    blocks[2] = np.random.default_rng(1).integers(0, 256, blocks[2].shape)
+    blocks[2, :, marker] = 0xFF
+    blocks[2, -1, marker] = 0
+    clean = NAND(pages.tobytes(), {"startblock": 0, "endblock": -1, "layout": layout_conf})
+    clean_data = clean.userdata(pages).reshape(4, -1)
+
+    clean.correct_partition()
+    assert clean.status["uncorrectable"].reshape(4, -1).all(axis=1).tolist() == [False, False, True, False]
+    with pytest.raises(ValueError):
+        clean.read(0, clean.corrected_partition_size)
+
+    layout_conf.update(bad_block_marker=marker, bad_block_pages=[0, -1])
+    nand = NAND(pages.tobytes(), {"startblock": 0, "endblock": -1, "layout": layout_conf})
+    nand.correct_partition()
+    assert nand.bad_blocks.tolist() == [2]
+    assert nand.status["bad_block"].sum() == layout.pages_per_block
+    assert not nand.status["uncorrectable"].any()
+    assert bytes(nand.corrected) == clean_data.tobytes()
+
+    part_conf = {"startblock": 0, "endblock": -1, "layout": layout_conf, "skip_bad_blocks": True}
+    nand = NAND(pages.tobytes(), part_conf)
+    nand.correct_partition()
+    assert nand.num_blocks == 3
+    assert bytes(nand.corrected) == clean_data[[0, 1, 3]].tobytes()
+    assert nand.page_offset(2 * layout.pages_per_block) == 3 * layout.blocksize
+
+    lazy = NAND(pages.tobytes(), part_conf, cache=PageCache())
+    offset = 2 * layout.pages_per_block * nand.corrected_pagesize - 100
+    assert lazy.read(offset, 200) == nand.read(offset, 200)
+
+
+def test_sparse_buffer():
+    erased_page = np.array([0xFF, 0xFF, 0, 0xFF], dtype="u1")
+    pages = np.tile(erased_page, (6, 1))
+    pages[[1, 2, 4]] = np.arange(12, dtype="u1").reshape(3, 4)
+    buffer = SparseBuffer(erased_page, 6)
+    buffer.append(pages[:3])
+    buffer.append(pages[3:])
+    buffer.finish()
+
+    assert buffer.slots.tolist() == [-1, 0, 1, -1, 2, -1]
+    assert len(buffer.data) == 12
+    assert buffer.erased_extents() == [(0, 4), (12, 16), (20, 24)]
+    assert bytes(buffer) == pages.tobytes()
+    view = buffer.read(5, 6)
+    assert isinstance(view, memoryview) and view == pages.tobytes()[5:11]
+    for offset, size in ((0, 24), (2, 13), (14, 100), (24, 1)):
+        assert buffer.read(offset, size) == pages.tobytes()[offset : offset + size]
+
+
+def test_passthrough(test_image_data):
+    config = example_config()
+    nand = build_partitions(test_image_data, config)["RAW"]
+    assert nand.corrected is None
+    expected = b"".join(userdata.tobytes() for userdata in NAND(test_image_data, config["RAW"]).iter_corrected())
+
+    for offset, size in ((0, 100), (500, 100), (2000, 5000), (len(expected) - 10, 100)):
+        assert nand.read(offset, size) == expected[offset : offset + size]
+    view = nand.read(2048 * 3 + 10, 100)
+    assert isinstance(view, memoryview) and view.obj is test_image_data
+
+
+def test_fuse_rereads():
+    config = example_config()
+    layout_conf = config["SIMPLE"].layout
+    layout = Layout(layout_conf)
+    part_conf = {"startblock": 0, "endblock": -1, "layout": layout_conf}
+    clean, _, _ = generate_pages(layout, 64, np.random.default_rng(0))
+    clean_data = NAND(clean.tobytes(), part_conf).userdata(clean).tobytes()
+
+    # every dump has other uncorrectable chunks
+    dumps = [
+        generate_pages(
+            layout, 64, np.random.default_rng(0), flips=1, uncorrectable_fraction=0.1,
+            flip_rng=np.random.default_rng(seed),
+        )[0].tobytes()
+        for seed in (1, 2, 3)
+    ]
+    nand = NAND(dumps[0], part_conf, rereads=dumps[1:])
+    nand.correct_partition()
+    assert bytes(nand.corrected) == clean_data
+    assert not nand.status["uncorrectable"].any()
+    assert {1, 2} <= set(nand.status["read"].tolist())
+
+    # no dump can correct the first chunk of the first page, the majority vote can
+    dumps = [clean.copy() for _ in range(3)]
+    for seed, dump in enumerate(dumps):
+        flips = np.zeros((1, len(layout.chunk_index)), dtype=np.int64)
+        flips[0, 0] = layout.ecc_engine.t + 1
+        flip_bits(layout, dump, np.array([0]), flips, np.random.default_rng(seed))
+    nand = NAND(dumps[0].tobytes(), part_conf, rereads=[dump.tobytes() for dump in dumps[1:]], cache=PageCache())
+    assert nand.read(0, 100) == clean_data[:100]
+    assert nand.status[0]["read"] == VOTED_READ
+    assert not nand.status[0]["uncorrectable"]
+
+
+@pytest.mark.parametrize("policy", ["abort", "zero", "raw"])
+def test_uncorrectable_policy(policy):
+    config = example_config()
+    layout_conf = config["SIMPLE"].layout
+    layout = Layout(layout_conf)
+    part_conf = {"startblock": 0, "endblock": -1, "layout": layout_conf}
+    pages, _, _ = generate_pages(layout, 64, np.random.default_rng(0))
+    flips = np.zeros((2, len(layout.chunk_index)), dtype=np.int64)
+    flips[:, 1] = layout.ecc_engine.t + 1
+    flip_bits(layout, pages, np.array([3, 4]), flips, np.random.default_rng(1))
+    raw = NAND(pages.tobytes(), part_conf).userdata(pages)
+
+    built = NAND(pages.tobytes(), part_conf, policy=policy)
+    built.correct_partition()
+    lazy = NAND(pages.tobytes(), part_conf, cache=PageCache(), stats=Stats(), policy=policy)
+    for nand in (built, lazy):
+        size = nand.corrected_pagesize
+        assert nand.read(0, 3 * size) == raw[:3].tobytes()
+        if policy == "abort":
+            with pytest.raises(ValueError):
+                nand.read(3 * size - 10, 20)
+            continue
+        expected = bytes(2 * size) if policy == "zero" else raw[3:5].tobytes()
+        assert nand.read(3 * size - 10, 2 * size + 20) == raw[2, -10:].tobytes() + expected + raw[5, :10].tobytes()
+        status = nand.status[3]
+        assert status["uncorrectable"] and status["chunk_flips"].tolist()[1] == -1
+        assert not nand.status["chunk_erased"].any()
+
+    # uncorrectable pages are corrected only once
+    if policy != "abort":
+        lazy.read(0, 6 * lazy.corrected_pagesize)
+        assert lazy.stats.counters["pages"] == 6
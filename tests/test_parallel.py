@@ -0,0 +1,41 @@
+
+import pytest
+
+from nandtool.nand import NAND, build_partitions
+from nandtool.parallel import correct_partition_parallel, shard_pages
+
+from tests.conftest import IMAGE_PATH, example_config, partition_data
+
+
+def test_shard_pages():
+    config = example_config()
+    nand = NAND(b"", config["COMPLEX2"])
+    shards = shard_pages(nand, jobs=4)
+
+    assert shards[0][0] == 0
+    assert shards[-1][1] == nand.num_pages
+    for (_, last), (first, _) in zip(shards, shards[1:]):
+        assert last == first
+        assert first % nand.layout.pages_per_block == 0
+
+
+def test_parallel_identical(test_image_data):
+    config = example_config()
+    serial = build_partitions(test_image_data, config)
+    parallel = build_partitions(test_image_data, config, jobs=3, image_path=IMAGE_PATH)
+
+    for name, nand in serial.items():
+        assert partition_data(parallel[name]) == partition_data(nand)
+        assert parallel[name].corrected_bits == nand.corrected_bits
+        assert (parallel[name].spare is None) == (not nand.has_ecc)
+        assert parallel[name].read_pages(0, 10**6) == nand.read_pages(0, 10**6)
+
+
+def test_parallel_strict(test_image_data):
+    config = example_config()
+    nand = NAND(test_image_data, config["SIMPLE"])
+    nand.part_conf["layout"]["ecc"] = [[[2051, 2058]], [[2064, 2071]], [[2078, 2085]], [[2092, 2099]]]
+    correct_partition_parallel(nand, IMAGE_PATH, jobs=2)
+    assert nand.status["uncorrectable"].any()
+    with pytest.raises(ValueError):
+        nand.read(0, nand.corrected_partition_size)
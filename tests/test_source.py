@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from nandtool.cache import CorrectionCache
+from nandtool.config import ConfigError
+from nandtool.nand import NAND, build_partitions
+from nandtool.source import ImageSource, open_image
+
+from tests.conftest import IMAGE_PATH, example_config, partition_data
+
+PARTITIONS = ("COMPLEX1", "ETFS")
+
+
+def split_image(tmp_path, data, interleave=0, files=2):
+    """Write the image as files, concatenated at unaligned offsets or interleaved in units of interleave bytes."""
+    if interleave:
+        units = np.frombuffer(data, "u1").reshape(-1, files, interleave)
+        pieces = [units[:, i].tobytes() for i in range(files)]
+    else:
+        cuts = [0, 3000003, 3000003, len(data)]
+        pieces = [data[start:end] for start, end in zip(cuts, cuts[1:])]
+    paths = [tmp_path / f"die{i}.bin" for i in range(len(pieces))]
+    for path, piece in zip(paths, pieces):
+        path.write_bytes(piece)
+    return paths
+
+
+@pytest.mark.parametrize("unit", [None, "block", "page"])
+def test_image_source(tmp_path, test_image_data, unit):
+    config = example_config()
+    expected = {name: NAND(test_image_data, config[name]) for name in PARTITIONS}
+    for nand in expected.values():
+        nand.correct_partition()
+
+    interleave = {None: 0, "block": config.ETFS.layout.blocksize, "page": 2112}[unit]
+    paths = split_image(tmp_path, test_image_data, interleave)
+    source = open_image(paths, config, unit)
+    assert len(source) == len(test_image_data)
+    assert bytes(source.view(2999000, 3000)) == test_image_data[2999000:3002000]
+    offsets = np.array([0, 3000003, 5000000, len(test_image_data) - 1])
+    assert source.take(offsets).tolist() == list(test_image_data[offset] for offset in offsets)
+
+    for name, nand in expected.items():
+        partition = NAND(source, config[name])
+        partition.correct_partition()
+        assert partition_data(partition) == partition_data(nand)
+        assert partition.read(5000, 100) == nand.read(5000, 100)
+
+    # worker processes open the files themselves
+    partition = build_partitions(source, config, jobs=2, image_path=source)["ETFS"]
+    assert partition_data(partition) == partition_data(expected["ETFS"])
+    source.close()
+
+
+def test_image_source_errors(tmp_path, test_image_data):
+    config = example_config()
+    paths = split_image(tmp_path, test_image_data)
+    with pytest.raises(ConfigError):
+        open_image(paths, config, "block")
+    with pytest.raises(ConfigError):
+        open_image(paths[:1], config)
+
+
+def test_image_digest(tmp_path, test_image_data):
+    cache = CorrectionCache(tmp_path / "cache")
+    assert cache.image_digest(ImageSource([IMAGE_PATH])) == cache.image_digest(IMAGE_PATH)
+    paths = split_image(tmp_path, test_image_data, interleave=135168)
+    assert cache.image_digest(ImageSource(paths)) != cache.image_digest(ImageSource(paths, 135168))
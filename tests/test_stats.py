@@ -0,0 +1,49 @@
+import numpy as np
+
+from nandtool.nand import STATUS_DTYPE, PageCache, build_partitions
+from nandtool.stats import Stats, block_report, build_report
+
+from tests.conftest import example_config
+
+
+def test_stats_merge():
+    stats = Stats()
+    stats.add_time("decode", 0.5, calls=10)
+    stats.count("flips", 3)
+    other = Stats()
+    other.add_time("decode", 1.5, calls=5)
+    other.add_time("read", 0.002, histogram=True)
+    other.count("flips", 2)
+    stats.merge(other.report())
+
+    report = stats.report()
+    assert report["stages"]["decode"] == {"seconds": 2.0, "calls": 15, "max_seconds": 1.5}
+    assert report["counters"] == {"flips": 5}
+    assert other.report()["stages"]["read"]["histogram"]["<=0.01s"] == 1
+
+
+def test_block_report():
+    status = np.zeros(8, dtype=STATUS_DTYPE)
+    status["flips"][5] = 2
+    status["flips"][6] = 1
+    status["uncorrectable"][7] = True
+    assert block_report(status, 4) == [{"block": 1, "flips": 3, "uncorrectable_pages": 1, "histogram": [2, 1, 1]}]
+
+
+def test_partition_stats(test_image_data):
+    config = example_config()
+    partitions = build_partitions(test_image_data, config, stats=True)
+    report = build_report(partitions)
+    for name, nand in partitions.items():
+        partition_report = report["partitions"][name]
+        assert sum(block["flips"] for block in partition_report["blocks"]) == nand.corrected_bits
+        if nand.has_ecc:
+            assert partition_report["counters"]["flips"] == nand.corrected_bits
+            assert partition_report["counters"]["pages"] == nand.num_pages
+            assert {"erased_check", "transform", "decode", "rebuild"} <= set(partition_report["stages"])
+
+    lazy = build_partitions(test_image_data, config, lazy=True, cache=PageCache(), stats=True)["SIMPLE"]
+    lazy.read(0, 4096)
+    lazy.read(0, 4096)
+    assert lazy.stats.counters["cache_misses"] == 2
+    assert lazy.stats.counters["cache_hits"] == 2
@@ -0,0 +1,58 @@
+import numpy as np
+
+from nandtool.nand import NAND, Layout, build_partitions
+from nandtool.synthetic import flip_distribution, generate_image, generate_pages, load_manifest
+
+from tests.conftest import example_config
+
+
+def test_generate_pages():
+    config = example_config()
+    layout_conf = config["SIMPLE"].layout
+    layout = Layout(layout_conf)
+    clean, _, _ = generate_pages(layout, 64, np.random.default_rng(1), flip_rng=np.random.default_rng(2))
+    pages, flips, erased = generate_pages(
+        layout, 64, np.random.default_rng(1), erased_fraction=0.25, flips=3, flip_rng=np.random.default_rng(2)
+    )
+    assert 0 < erased.sum() < 64
+    assert (pages[erased] == 0xFF).all()
+
+    nand = NAND(pages.tobytes(), {"startblock": 0, "endblock": 0, "layout": layout_conf})
+    corrected, status = nand.correct_pages(nand.raw_pages(0, 64))
+    assert not status["uncorrectable"].any()
+    assert (status["flips"] == flips.sum(axis=1)).all()
+    assert (flips[~erased] == 3).all()
+    assert (corrected[~erased][:, : layout.pagesize] == clean[~erased][:, : layout.pagesize]).all()
+
+
+def test_flip_distribution():
+    rng = np.random.default_rng(0)
+    assert (flip_distribution("2")(rng, (3, 4)) == 2).all()
+    uniform = flip_distribution("uniform:1-3")(rng, 1000)
+    assert uniform.min() == 1 and uniform.max() == 3
+    assert abs(flip_distribution("poisson:1.5")(rng, 10000).mean() - 1.5) < 0.1
+
+
+def test_manifest(tmp_path):
+    config = example_config()
+    options = dict(seed=5, erased_fraction=0.2)
+    generate_image(tmp_path / "clean.bin", config, **options)
+    manifest = generate_image(
+        tmp_path / "image.bin", config, flips="poisson:1", uncorrectable_fraction=0.02, **options
+    )
+    assert manifest["partitions"]["ETFS"]["end"] == 256 * config["ETFS"].layout.blocksize
+    _, partitions = load_manifest(tmp_path / "image.bin.manifest.json")
+
+    clean = build_partitions((tmp_path / "clean.bin").read_bytes(), config)
+    data = (tmp_path / "image.bin").read_bytes()
+    for name, (flips, erased) in partitions.items():
+        nand = NAND(data, config[name])
+        corrected, status = nand.correct_pages(nand.raw_pages(0, nand.num_pages))
+        uncorrectable = (flips > nand.layout.ecc_engine.t).any(axis=1)
+        assert uncorrectable.any()
+        assert (status["flips"][~uncorrectable] == flips[~uncorrectable].sum(axis=1)).all()
+
+        # all other pages are corrected to the content of the clean image
+        userdata = nand.userdata(corrected).reshape(nand.num_pages, -1)
+        expected = np.frombuffer(bytes(clean[name].corrected), "u1").reshape(nand.num_pages, -1)
+        assert (userdata[~uncorrectable] == expected[~uncorrectable]).all()